@@ -0,0 +1,193 @@
+"""
+Fit benchmark: speed and accuracy of the fitters in experiments/fitting.py on seeded synthetic data.
+
+For each case in fit_cases.yml, draws --batch sets of true params, generates noisy traces of --length points from the
+model, fits each one (or all at once for the batch fitters), and reports per fitter:
+    time/fit [ms]: wall time per trace
+    evals/fit: model evaluations per fitter call (each curve_fit / LM iteration evaluates the model once, so this
+        tracks iterations across fitters that do not report them; a batch fitter is one call for all traces)
+    fail: fraction of traces where the fit reported failure or a checked param is off by more than its tolerance
+    bias: mean error of each checked param over the successful fits (relative to the true value, or absolute)
+
+Usage (from the repo root):
+    python benchmarks/fit_benchmark.py
+    python benchmarks/fit_benchmark.py --noise 0.1 --length 51 --batch 200 --fitters fitexp fitdecaysin
+    python benchmarks/fit_benchmark.py --output fit_results.json
+    python benchmarks/fit_benchmark.py --save-baseline
+
+The same --seed always generates the same data. If a baseline file exists (from a run with the same noise, length,
+and batch), each case is compared against it and the script exits with status 1 if anything got slower than
+baseline*(1+tolerance) by more than min_regression_ms, or its failure rate went up by more than max_fail_increase.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+bench_path = os.path.dirname(os.path.abspath(__file__))
+
+def case_name(case):
+    return case.get('name', case['fitter'])
+
+def generate(case, length, batch, noise, rng):
+    """
+    Returns xdata (length,), true params (batch, n params), noisy ydata (batch, length)
+    """
+    from experiments import fitting as fitter
+    model = getattr(fitter, case['model'])
+    xdata = np.linspace(case['x'][0], case['x'][1], length)
+    if case.get('integer', False): xdata = np.round(xdata)
+    params = np.array([rng.uniform(*p, size=batch) if isinstance(p, list) else np.full(batch, float(p)) for p in case['params']]).T
+    ydata = np.array([model(xdata, *p) for p in params])
+    ydata += rng.normal(0, noise*case.get('noise_scale', 1), size=ydata.shape)
+    return xdata, params, ydata
+
+@contextlib.contextmanager
+def count_evals(model_name):
+    """
+    Count calls to the model (and its batched version) inside experiments.fitting while in the context
+    """
+    from experiments import fitting as fitter
+    counter = [0]
+    model = getattr(fitter, model_name)
+    def counted_model(*args, **kwargs):
+        counter[0] += 1
+        return model(*args, **kwargs)
+    setattr(fitter, model_name, counted_model)
+    batch_entry = next(((name, entry) for name, entry in fitter.batch_models.items() if entry[0] is model), None)
+    if batch_entry is not None:
+        name, (_, model_batch, init_batch, n_params) = batch_entry
+        def counted_model_batch(*args, **kwargs):
+            counter[0] += 1
+            return model_batch(*args, **kwargs)
+        fitter.batch_models[name] = (model, counted_model_batch, init_batch, n_params)
+    try:
+        yield counter
+    finally:
+        setattr(fitter, model_name, model)
+        if batch_entry is not None: fitter.batch_models[batch_entry[0]] = batch_entry[1]
+
+def run_case(case, length, batch, noise, seed, repeat=1):
+    from experiments import fitting as fitter
+    fit_func = getattr(fitter, case['fitter'])
+    kwargs = case.get('kwargs', dict())
+    rng = np.random.default_rng(seed)
+    xdata, params, ydata = generate(case, length, batch, noise, rng)
+
+    times = []
+    for _ in range(repeat):
+        with count_evals(case['model']) as evals, contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            if case.get('batch', False):
+                pOpt, pCov = fit_func(xdata, ydata, **kwargs)
+            else:
+                results = [fit_func(xdata, y, **kwargs) for y in ydata]
+                pOpt = np.array([r[0] for r in results], dtype=float)
+                pCov = np.array([r[1] for r in results], dtype=float)
+            times.append(time.perf_counter() - t)
+
+    failed = ~np.all(np.isfinite(pCov.reshape(batch, -1)), axis=-1)
+    bias = dict()
+    errors = dict()
+    for name, check in case['check'].items():
+        i, tol = check[0], check[1]
+        err = pOpt[:, i] - params[:, i]
+        if len(check) < 3 or check[2] != 'abs': err = err/np.abs(params[:, i])
+        failed |= ~(np.abs(err) <= tol)
+        errors[name] = err
+    for name, err in errors.items():
+        bias[name] = float(np.mean(err[~failed])) if np.any(~failed) else None
+
+    return dict(
+        time_ms=1e3*min(times)/batch,
+        evals=evals[0]/(1 if case.get('batch', False) else batch),
+        fail=float(np.mean(failed)),
+        bias=bias,
+    )
+
+def compare(results, baseline, tolerance, min_regression_ms, max_fail_increase):
+    """
+    Returns list of (name, message) for regressions of results against baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None: continue
+        t, t_base = result['time_ms'], base['time_ms']
+        if t > t_base*(1+tolerance) and t - t_base > min_regression_ms:
+            regressions.append((name, f'{t:.3f} ms/fit (baseline {t_base:.3f} ms/fit)'))
+        if result['fail'] > base['fail'] + max_fail_increase:
+            regressions.append((name, f'failure rate {100*result["fail"]:.1f}% (baseline {100*base["fail"]:.1f}%)'))
+    return regressions
+
+def print_table(results, baseline):
+    print()
+    width = max([len(name) for name in results] + [10])
+    print(f'{"":{width}}  {"time/fit [ms]":>13}  {"baseline":>9}  {"evals/fit":>9}  {"fail":>6}  bias')
+    for name, result in results.items():
+        base = baseline.get(name)
+        base_str = '' if base is None else f'{base["time_ms"]:.3f}'
+        bias_str = ', '.join('' if b is None else f'{param} {b:+.2e}' for param, b in result['bias'].items())
+        print(f'{name:{width}}  {result["time_ms"]:>13.3f}  {base_str:>9}  {result["evals"]:>9.1f}  {100*result["fail"]:>5.1f}%  {bias_str}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=os.path.join(bench_path, 'fit_cases.yml'), help='fit cases')
+    parser.add_argument('--fitters', nargs='*', default=None, help='only run these cases (default: all)')
+    parser.add_argument('--noise', type=float, default=0.05, help='noise std relative to the signal amplitude')
+    parser.add_argument('--length', type=int, default=101, help='points per trace')
+    parser.add_argument('--batch', type=int, default=50, help='traces per case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='report the best time of this many runs')
+    parser.add_argument('--output', default=None, help='write this run as json')
+    parser.add_argument('--baseline', default=os.path.join(bench_path, 'fit_baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite the baseline with this run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional slowdown vs baseline')
+    parser.add_argument('--min-regression-ms', type=float, default=0.1, help='ignore slowdowns smaller than this per fit')
+    parser.add_argument('--max-fail-increase', type=float, default=0.02, help='allowed increase in failure rate')
+    args = parser.parse_args()
+
+    sys.path.insert(0, repo_path)
+    import yaml
+    with open(args.cases, 'r') as f:
+        cases = yaml.safe_load(f)
+    if args.fitters: cases = [case for case in cases if case_name(case) in args.fitters]
+
+    settings = dict(noise=args.noise, length=args.length, batch=args.batch, seed=args.seed)
+    results = dict()
+    for case in cases:
+        results[case_name(case)] = run_case(case, args.length, args.batch, args.noise, args.seed, repeat=args.repeat)
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            saved = json.load(f)
+        if saved.get('settings') == settings: baseline = saved['results']
+        else: print(f'Baseline {args.baseline} was run with different settings {saved.get("settings")}, not comparing')
+    print_table(results, baseline)
+
+    output = dict(settings=settings, results=results)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=4)
+        print(f'\nSaved results to {args.output}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(output, f, indent=4)
+        print(f'\nSaved baseline to {args.baseline}')
+        sys.exit(0)
+
+    regressions = compare(results, baseline, args.tolerance, args.min_regression_ms, args.max_fail_increase)
+    if len(regressions) > 0:
+        print('\nRegressions:')
+        for name, message in regressions:
+            print(f'\t{name}: {message}')
+        sys.exit(1)
@@ -0,0 +1,261 @@
+"""
+Startup benchmark: cold import time of experiments and each experiment module, and the time to construct
+(initialize + body) and compile every *Program class against a stored QickConfig dump, with no board attached.
+
+Usage (from the repo root):
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --soccfg soccfg.json --config config_q3diamond.yml
+    python benchmarks/startup_benchmark.py --soccfg soccfg.json --config config_q3diamond.yml --save-baseline
+
+The QickConfig dump is the json string from soc.dump_cfg() on the board, e.g.
+    with open('soccfg.json', 'w') as f: f.write(soc.dump_cfg())
+
+Prints a per-module table. If a baseline file exists, each entry is compared against it and the script
+exits with status 1 if anything got slower than baseline*(1+tolerance) by more than min_regression_ms, if anything
+that ran in the baseline now fails, or if a *Program class has no case in startup_cases.yml (add one, or list the
+class under skip if it is only ever constructed through a subclass).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+repo_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+bench_path = os.path.dirname(os.path.abspath(__file__))
+
+def experiment_modules():
+    """
+    All importable experiment modules, found the same way as the lazy registry in experiments/__init__.py
+    """
+    expt_path = os.path.join(repo_path, 'experiments')
+    modules = []
+    for f in sorted(os.listdir(expt_path)):
+        if f[0]=="_" or f[0]==".": continue
+        fpath = os.path.join(expt_path, f)
+        if os.path.isdir(fpath):
+            for subf in sorted(os.listdir(fpath)):
+                if subf[0]=="_" or subf[0]=="." or not subf.endswith('.py'): continue
+                modules.append(f'experiments.{f}.{subf[:-3]}')
+        elif f.endswith('.py'):
+            modules.append(f'experiments.{f[:-3]}')
+    return modules
+
+_import_snippet = """
+import time, sys
+t = time.perf_counter()
+try:
+    import {module}
+    print(time.perf_counter() - t)
+except Exception as e:
+    print('error', type(e).__name__, e, file=sys.stderr)
+    sys.exit(1)
+"""
+
+def time_cold_import(module, repeat=3, env=None):
+    """
+    Best of repeat cold imports of module (each in a fresh interpreter). Returns time in ms, or None if the import failed.
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', _import_snippet.format(module=module)], cwd=repo_path, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f'\t{module}: {result.stderr.strip()}')
+            return None
+        times.append(1e3*float(result.stdout.strip().split('\n')[-1]))
+    return min(times)
+
+def reduce_to_qubit(cfg, q_ind):
+    # same as the per qubit config reduction at the start of e.g. T1Experiment.acquire
+    for subcfg in (cfg.device.readout, cfg.device.qubit, cfg.hw.soc):
+        for key, value in subcfg.items() :
+            if isinstance(value, list):
+                subcfg.update({key: value[q_ind]})
+            elif isinstance(value, dict):
+                for key2, value2 in value.items():
+                    for key3, value3 in value2.items():
+                        if isinstance(value3, list):
+                            value2.update({key3: value3[q_ind]})
+
+def expand_to_qubits(cfg):
+    # same as the config expansion at the start of e.g. RamseyExperiment.acquire
+    num_qubits_sample = len(cfg.device.qubit.f_ge)
+    for subcfg in (cfg.device.readout, cfg.device.qubit, cfg.hw.soc):
+        for key, value in subcfg.items() :
+            if isinstance(value, dict):
+                for key2, value2 in value.items():
+                    for key3, value3 in value2.items():
+                        if not(isinstance(value3, list)):
+                            value2.update({key3: [value3]*num_qubits_sample})
+            elif not(isinstance(value, list)):
+                subcfg.update({key: [value]*num_qubits_sample})
+
+def program_classes(modules):
+    """
+    {qualified name: program class} for every *Program class defined in modules, where the qualified name is the module
+    path below experiments, e.g. single_qubit.t1.T1Program. Modules that fail to import are skipped here; they already
+    show up as failed in the cold import table.
+    """
+    import importlib
+    import inspect
+    from qick import QickProgram
+
+    programs = dict()
+    for module in modules:
+        try:
+            m = importlib.import_module(module)
+        except Exception as e:
+            print(f'\t{module}: {type(e).__name__} {e}')
+            continue
+        for name, obj in vars(m).items():
+            if not inspect.isclass(obj) or obj.__module__ != module: continue
+            if name.endswith('Program') and issubclass(obj, QickProgram):
+                programs[f'{module[len("experiments."):]}.{name}'] = obj
+    return programs
+
+def match_program(programs, name):
+    """
+    Qualified names in programs matching a case's program, given as a class name or as a module.Class suffix
+    """
+    return [qualname for qualname in programs if qualname == name or qualname.endswith('.' + name)]
+
+def time_program_construction(soccfg_file, config_file, cases_file, modules, repeat=3):
+    """
+    Time constructing (initialize + body) and compiling every *Program class in modules, using the case for it in
+    cases_file. Returns ({qualified name: (module name, best time in ms or None if it failed)}, [qualified names
+    of programs with no case and not listed under skip]).
+    """
+    import yaml
+    from qick import QickConfig
+    from slab import AttrDict
+    from experiments.headless import set_headless
+    set_headless(True)
+
+    with open(soccfg_file, 'r') as f:
+        soccfg = QickConfig(f.read())
+    with open(config_file, 'r') as f:
+        yaml_cfg = yaml.safe_load(f)
+    with open(cases_file, 'r') as f:
+        cases_cfg = yaml.safe_load(f)
+
+    programs = program_classes(modules)
+    skipped = set()
+    for name in cases_cfg.get('skip', []):
+        skipped.update(match_program(programs, name))
+
+    results = dict()
+    for case in cases_cfg['cases']:
+        name = case['program']
+        matches = match_program(programs, name)
+        if len(matches) != 1:
+            print(f'\t{name}: ' + ('no such program' if len(matches) == 0 else f'ambiguous, use one of {matches}'))
+            results[name] = (None, None)
+            continue
+        qualname = matches[0]
+        program = programs[qualname]
+        times = []
+        for _ in range(repeat):
+            cfg = AttrDict(json.loads(json.dumps(yaml_cfg)))
+            if 'qubit' in case: reduce_to_qubit(cfg, case['qubit'])
+            if case.get('expand_qubits', False): expand_to_qubits(cfg)
+            cfg.expt = AttrDict(case['expt'])
+            t = time.perf_counter()
+            try:
+                prog = program(soccfg=soccfg, cfg=cfg, **case.get('kwargs', dict()))
+                prog.compile()
+            except Exception as e:
+                print(f'\t{qualname}: {type(e).__name__} {e}')
+                times = None
+                break
+            times.append(1e3*(time.perf_counter() - t))
+        results[qualname] = (program.__module__, None if times is None else min(times))
+
+    missing = [qualname for qualname in programs if qualname not in results and qualname not in skipped]
+    for qualname in missing: results[qualname] = (programs[qualname].__module__, None)
+    return results, missing
+
+def compare(results, baseline, tolerance, min_regression_ms):
+    """
+    results, baseline: {name: time ms}. Returns list of (name, time, baseline time) for regressions. Anything that ran
+    in the baseline but failed now (time None) counts as a regression.
+    """
+    regressions = []
+    for name, t in results.items():
+        t_base = baseline.get(name)
+        if t_base is None: continue
+        if t is None or (t > t_base*(1+tolerance) and t - t_base > min_regression_ms):
+            regressions.append((name, t, t_base))
+    return regressions
+
+def print_table(title, rows, baseline):
+    print()
+    print(title)
+    width = max([len(name) for name, _ in rows] + [10])
+    print(f'{"":{width}}  {"time [ms]":>10}  {"baseline":>10}  {"change":>8}')
+    for name, t in rows:
+        t_base = baseline.get(name)
+        t_str = 'failed' if t is None else f'{t:.1f}'
+        base_str = '' if t_base is None else f'{t_base:.1f}'
+        change_str = '' if t is None or t_base is None else f'{100*(t/t_base - 1):+.0f}%'
+        print(f'{name:{width}}  {t_str:>10}  {base_str:>10}  {change_str:>8}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--soccfg', default=None, help='json QickConfig dump (soc.dump_cfg()); program construction is skipped if not given')
+    parser.add_argument('--config', default=os.path.join(repo_path, 'config_q3diamond.yml'), help='experiment config yml')
+    parser.add_argument('--cases', default=os.path.join(bench_path, 'startup_cases.yml'), help='program construction cases')
+    parser.add_argument('--baseline', default=os.path.join(bench_path, 'startup_baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='overwrite the baseline with this run')
+    parser.add_argument('--repeat', type=int, default=3, help='report the best of this many runs')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed fractional slowdown vs baseline')
+    parser.add_argument('--min-regression-ms', type=float, default=10, help='ignore slowdowns smaller than this')
+    parser.add_argument('--modules', nargs='*', default=None, help='only benchmark these modules (default: all)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, repo_path)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = repo_path + os.pathsep + env.get('PYTHONPATH', '')
+    env['SLAB_HEADLESS'] = '1'
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    import_baseline = baseline.get('import', dict())
+    program_baseline = baseline.get('program', dict())
+
+    modules = args.modules if args.modules else ['experiments'] + experiment_modules()
+    import_results = {module: time_cold_import(module, repeat=args.repeat, env=env) for module in modules}
+    print_table('Cold import', list(import_results.items()), import_baseline)
+
+    program_results = dict()
+    missing = []
+    if args.soccfg is not None:
+        program_modules, missing = time_program_construction(args.soccfg, args.config, args.cases, experiment_modules(), repeat=args.repeat)
+        program_results = {name: t for name, (module, t) in program_modules.items()}
+        rows = sorted(program_results.items(), key=lambda item: str(program_modules[item[0]][0])) # group by module
+        print_table('Program construction (initialize + compile)', rows, program_baseline)
+        if len(missing) > 0:
+            print(f'\nNo case in {args.cases} for:')
+            for name in missing: print(f'\t{name}')
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'import': {k:v for k, v in import_results.items() if v is not None},
+                'program': {k:v for k, v in program_results.items() if v is not None},
+            }, f, indent=4)
+        print(f'\nSaved baseline to {args.baseline}')
+        sys.exit(0)
+
+    regressions = compare(import_results, import_baseline, args.tolerance, args.min_regression_ms)
+    regressions += compare(program_results, program_baseline, args.tolerance, args.min_regression_ms)
+    if len(regressions) > 0:
+        print('\nRegressions:')
+        for name, t, t_base in regressions:
+            t_str = 'failed' if t is None else f'{t:.1f} ms'
+            print(f'\t{name}: {t_str} (baseline {t_base:.1f} ms)')
+    if len(regressions) > 0 or len(missing) > 0:
+        sys.exit(1)
@@ -1,38 +1,65 @@
-import importlib, inspect
+"""
+Lazy registry of experiment classes.
+
+Importing every experiment module up front pulls in qick, matplotlib, scipy, tqdm, etc. for ~30 modules, which takes
+seconds on the RFSoC ARM host. Instead we scan the source files once (without executing them) to build a
+class name -> module name index, and only import a module the first time one of its classes is accessed,
+i.e. meas.T1Experiment still works after import experiments as meas.
+"""
+
+import importlib
 import os,os.path
+import re
 import sys
 
+path = __path__[0]
+_registry = None # class name -> full module name, built on first access
+_class_def = re.compile(r'^class\s+(\w+)', re.MULTILINE) # top level class definitions only
+
 """
 module_path: parent directory path with . as subfile dividers
-f: filename to import modules from
+f: filename to index classes from
 """
-def import_modules_from_files(module_path, f):
-    if f[0]!="_" and f[0]!=".":
-        module_name = module_path + "." + f.split(".")[0]
-        m = importlib.import_module(module_name)
-        print('imported', module_name)
-        for name, obj in inspect.getmembers(m):
-            if inspect.isclass(obj):
-                setattr(thismodule,name,getattr(m, name))
-        del m
-        del name
-        del obj
+def _index_classes_from_file(module_path, fpath, f, registry):
+    if f[0]=="_" or f[0]=="." or not f.endswith(".py"): return
+    module_name = module_path + "." + f.split(".")[0]
+    with open(fpath, 'r', encoding='utf-8') as src:
+        class_names = _class_def.findall(src.read())
+    for class_name in class_names:
+        # DONOTUSE modules never shadow a class of the same name defined in a maintained module
+        if f.startswith('DONOTUSE') and class_name in registry: continue
+        registry[class_name] = module_name
 
-path = __path__[0]
-thismodule = sys.modules[__name__]
-files=os.listdir(path)
-module_path = os.path.split(path)[-1]
-for f in files:
-    fpath = os.path.join(path, f)
-    if f[0]=="_" or f[0]==".": continue
-    if os.path.isdir(fpath):
-        subfiles = os.listdir(fpath)
-        submodule_path = module_path + "." + os.path.split(fpath)[-1]
-        for subf in subfiles:
-            import_modules_from_files(submodule_path, subf)
-    else:
-        import_modules_from_files(module_path, f)
+def _build_registry():
+    global _registry
+    if _registry is not None: return _registry
+    registry = dict()
+    module_path = __name__
+    for f in sorted(os.listdir(path)):
+        fpath = os.path.join(path, f)
+        if f[0]=="_" or f[0]==".": continue
+        if os.path.isdir(fpath):
+            submodule_path = module_path + "." + f
+            for subf in sorted(os.listdir(fpath)):
+                _index_classes_from_file(submodule_path, os.path.join(fpath, subf), subf, registry)
+        else:
+            _index_classes_from_file(module_path, fpath, f, registry)
+    _registry = registry
+    return _registry
+
+def __getattr__(name):
+    if name.startswith('__'): raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    registry = _build_registry()
+    thismodule = sys.modules[__name__]
+    if name in registry:
+        m = importlib.import_module(registry[name])
+        obj = getattr(m, name)
+        setattr(thismodule, name, obj) # cache so __getattr__ is not hit again
+        return obj
+    # allow direct access to submodules, e.g. meas.fitting
+    if os.path.exists(os.path.join(path, name + '.py')) or os.path.isdir(os.path.join(path, name)):
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-del f
-del thismodule
-del files
\ No newline at end of file
+def __dir__():
+    return sorted(set(globals().keys()) | set(_build_registry().keys()))
@@ -0,0 +1,77 @@
+import numpy as np
+
+import experiments.fitting as fitter
+
+"""
+Bootstrap confidence intervals for the batched fit models in fitting.py (batch_models: 'sin', 'decaysin', 'exp',
+'lor', 'rb').
+
+Every resample is drawn up front as one integer index array, and all the resampled traces are refit together with
+the batched LM solver, warm started from the fit to the original data. So 1000 resamples is one batched fit of
+1000 traces instead of 1000 curve_fit calls.
+
+Two ways to resample:
+    'samples': ydata is (n_points, n_samples), several independent samples at each x (the RB variations at each
+        depth, or single shots). Each resample draws n_samples with replacement at every x and fits the mean.
+    'residuals': ydata is (n_points,) (e.g. an averaged T1 or Ramsey trace). Fit once, then each resample is the
+        fit plus the residuals drawn with replacement.
+
+    pOpt, pInterval, p_boot = bootstrap.bootstrap_fit('rb', depths, probs, n_resamples=1000)
+    error_interval = bootstrap.percentile_interval(fitter.rb_error(p_boot[:, 0], d=2))
+"""
+
+def resample_indices(n_points, n_samples, n_resamples, rng=None):
+    """
+    Index array (n_resamples, n_points, n_samples) drawing n_samples with replacement independently at each point
+    """
+    rng = np.random.default_rng(rng)
+    return rng.integers(0, n_samples, size=(n_resamples, n_points, n_samples))
+
+def percentile_interval(samples, ci=95):
+    """
+    Central ci% percentile interval along axis 0, ignoring nan (failed resamples). Returns (2, ...) [lower, upper].
+    """
+    return np.nanpercentile(samples, [50 - ci/2, 50 + ci/2], axis=0)
+
+def bootstrap_fit(model, xdata, ydata, n_resamples=1000, method='samples', ci=95, fitparams=None, pOpt=None, rng=None, max_iter=50):
+    """
+    model: one of fitter.batch_models
+    ydata: (n_points, n_samples) for method='samples', (n_points,) for method='residuals'
+    fitparams: initial guess for the fit to the original data, same format as the single trace fit functions
+    pOpt: use this as the fit to the original data instead of fitting it here (e.g. the result of the regular fit)
+    rng: seed or np.random.Generator
+    Returns pOpt (n_params,), pInterval (2, n_params) [lower, upper], and p_boot (n_resamples, n_params) with nan
+    for resamples whose fit failed.
+    """
+    _, model_batch, init_batch, n_params = fitter.batch_models[model]
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+    rng = np.random.default_rng(rng)
+
+    if method == 'samples':
+        y_fit = np.mean(ydata, axis=1)
+        n_points, n_samples = ydata.shape
+        inds = resample_indices(n_points, n_samples, n_resamples, rng=rng)
+        y_boot = np.mean(ydata[np.arange(n_points)[None, :, None], inds], axis=-1)
+    elif method == 'residuals':
+        y_fit = ydata
+    else: assert False, f'Unknown bootstrap method {method}'
+
+    if pOpt is None:
+        pOpt, _ = fitter.fit_batch(model, xdata, y_fit[None], fitparams=fitparams)
+        pOpt = pOpt[0]
+    pOpt = np.asarray(pOpt, dtype=float)
+
+    if method == 'residuals':
+        f, _ = model_batch(xdata, pOpt[None])
+        resid = y_fit - f[0]
+        inds = rng.integers(0, len(resid), size=(n_resamples, len(resid)))
+        y_boot = f + resid[inds]
+
+    # all resamples start from pOpt, with the bounds each would get in a regular batch fit
+    p0, bounds = init_batch(xdata, y_boot, np.tile(pOpt, (n_resamples, 1)))
+    p_boot, _, _, converged = fitter._lm_batch(model_batch, xdata, y_boot, p0, bounds=bounds, max_iter=max_iter)
+    p_boot[~converged] = np.nan
+    if not np.all(converged):
+        print(f'Warning: bootstrap fit failed for {np.sum(~converged)}/{n_resamples} resamples')
+    return pOpt, percentile_interval(p_boot, ci=ci), p_boot
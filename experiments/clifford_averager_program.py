@@ -1,15 +1,114 @@
-import matplotlib.pyplot as plt
 import numpy as np
+from collections import namedtuple
+from itertools import repeat
 from qick import *
+from qick.helpers import gauss
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, is_headless
 
 import scipy as sp
 
 import experiments.fitting as fitter
+from experiments import waveform_cache
+from experiments.program_cache import soccfg_hash
 
 
+"""
+Rotate the raw shots of all readout channels at once: stacks di_buf, dq_buf (n_chs, n_shots) into one complex64 buffer
+and multiplies each channel in place by scale*exp(i*angle), so the returned I and Q are float32 views into that buffer
+(real and imaginary parts) instead of copies. angle [deg], scale, threshold: one per channel (or a scalar). If
+threshold is not None, I is replaced in place by 1 where I > threshold, otherwise 0.
+"""
+def rotate_shots(di_buf, dq_buf, angle=0, scale=1, threshold=None):
+    n_chs = len(di_buf)
+    angle = np.broadcast_to(np.asarray(angle, dtype=np.float64), (n_chs,))
+    scale = np.broadcast_to(np.asarray(scale, dtype=np.float64), (n_chs,))
+    shots = np.empty(np.shape(di_buf), dtype=np.complex64)
+    shots.real = di_buf
+    shots.imag = dq_buf
+    shots *= (scale*np.exp(1j*np.pi/180*angle)).astype(np.complex64)[:, None]
+    bufi, bufq = shots.real, shots.imag
+    if threshold is not None:
+        threshold = np.broadcast_to(np.asarray(threshold, dtype=np.float32), (n_chs,))
+        np.greater(bufi, threshold[:, None], out=bufi, casting='unsafe')
+    return bufi, bufq
+
+"""
+Post processing shared by every acquire_rotated, over any number of readout channels (di_buf, dq_buf: (n_chs, n_shots),
+scale: 1/readout length of each channel). Returns (avgi, avgi_err) if angle is specified, otherwise (avgi, avgq):
+    post_process == None: averages of the shots rotated by angle
+    post_process == 'threshold': population of shots above threshold after rotating by angle
+    post_process == 'scale': rotated average of I scaled so the g/e averages in ge_avgs go to 0/1. ge_avgs should be
+        of shape (n_chs, 4) and should represent the pre-rotation Ig, Qg, Ie, Qe. Channels whose ge_avgs entry is not
+        a list/array were not calibrated and come out nan.
+"""
+def post_process_shots(di_buf, dq_buf, scale=1, angle=None, threshold=None, ge_avgs=None, post_process=None, verbose=False):
+    n_chs, buf_len = np.shape(di_buf)
+    if post_process == 'threshold': assert threshold is not None
+    elif post_process == 'scale': assert ge_avgs is not None
+    elif post_process is not None: assert False, 'Undefined post processing flag, options are None, threshold, scale'
+    angle_chs = np.zeros(n_chs) if angle is None else np.asarray(angle[:n_chs], dtype=np.float64)
+    if post_process != 'threshold': threshold = None
+    else: threshold = threshold[:n_chs]
+
+    bufi, bufq = rotate_shots(di_buf, dq_buf, angle=angle_chs, scale=scale, threshold=threshold)
+    avgi = np.mean(bufi, axis=1, dtype=np.float64)
+    avgi_err = np.std(bufi, axis=1, dtype=np.float64) / np.sqrt(buf_len)
+    if verbose: print(np.median(bufi, axis=1))
+    if post_process is None and angle is None:
+        if verbose: print(np.median(bufq, axis=1))
+        return avgi, np.mean(bufq, axis=1, dtype=np.float64)
+
+    if post_process == 'scale':
+        calibrated = np.array([isinstance(ge_avgs[ch], (list, np.ndarray)) for ch in range(n_chs)])
+        ge = np.full((n_chs, 4), np.nan)
+        ge[calibrated] = [ge_avgs[ch] for ch in np.flatnonzero(calibrated)]
+        cos, sin = np.cos(np.pi/180*angle_chs), np.sin(np.pi/180*angle_chs)
+        g_rot = ge[:, 0]*cos - ge[:, 1]*sin
+        e_rot = ge[:, 2]*cos - ge[:, 3]*sin
+        avgi = (avgi - g_rot) / (e_rot - g_rot)
+        avgi_err = avgi_err / (e_rot - g_rot)
+    return avgi, avgi_err
+
+"""
+Loaded pulse parameters stored in CliffordAveragerProgram.pulse_dict, replacing the dict per pulse. A slotted named
+tuple, since RB programs load and play thousands of pulses per build: immutable, so a play just reads the fields, and
+override() returns the same spec if nothing is overridden. to_dict() gives back the keys the old dict for that pulse
+type had, for saving with the experiment data.
+"""
+class PulseSpec(namedtuple('PulseSpec', ['ch', 'name', 'type', 'waveformname', 'length', 'sigma', 'flat_length', 'mask', 'mu', 'beta', 'period_us', 'I_mhz_vs_us', 'Q_mhz_vs_us', 'times_us', 'freq_MHz', 'phase_deg', 'gain', 'flag'], defaults=(None,)*18)):
+    __slots__ = ()
+    _type_keys = dict(
+        const=('ch', 'name', 'type', 'length', 'freq_MHz', 'phase_deg', 'gain', 'flag'),
+        gauss=('ch', 'name', 'waveformname', 'type', 'sigma', 'freq_MHz', 'phase_deg', 'gain', 'flag'),
+        flat_top=('ch', 'name', 'waveformname', 'type', 'sigma', 'flat_length', 'freq_MHz', 'phase_deg', 'gain', 'flag'),
+        mux4=('ch', 'name', 'type', 'mask', 'length', 'flag'),
+        adiabatic=('ch', 'name', 'waveformname', 'type', 'mu', 'beta', 'period_us', 'freq_MHz', 'phase_deg', 'gain', 'flag'),
+        IQpulse=('ch', 'name', 'waveformname', 'type', 'I_mhz_vs_us', 'Q_mhz_vs_us', 'times_us', 'freq_MHz', 'phase_deg', 'gain', 'flag'),
+    )
+
+    def override(self, **kwargs):
+        overrides = {key: value for key, value in kwargs.items() if value is not None}
+        if len(overrides) == 0: return self
+        return self._replace(**overrides)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self._type_keys.get(self.type, self._fields)}
+
+"""
+Register conversions (freq2reg, deg2reg, us2cycles) only depend on the soccfg and their arguments, but every program
+in a sweep redoes the same ones in initialize() for every qubit and channel, and again for every pulse it plays. They
+are memoized across programs in one table per soccfg, keyed by the conversion and its arguments (for the per qubit
+lists in initialize, the whole tuple of device cfg values and channels), so changing a device cfg value just misses
+instead of needing to invalidate anything. Tables are looked up by soccfg_hash, not id(soccfg), which a later soccfg
+can reuse once the first is garbage collected.
+"""
+_register_memo = dict() # soccfg_hash(soccfg) -> {key: register value(s)}
+_register_memo_maxsize = 4096 # per soccfg, cleared when full since swept frequencies/phases add an entry per point
+
+def clear_register_memo():
+    _register_memo.clear()
 
 """Falserager program that takes care of the standard pulse loading for basic X, Y, Z +/- pi and pi/2 True.:
 """
@@ -23,9 +122,89 @@ class CliffordAveragerProgram(AveragerProgram):
 
         # copy over parameters for the acquire method
         self.cfg.reps = cfg.expt.reps
+
+        self._regs = _register_memo.setdefault(soccfg_hash(soccfg), dict()) # conversions shared by all programs on an identical soccfg
+        if len(self._regs) > _register_memo_maxsize: self._regs.clear()
+
+        self.parallel_pulses = self.cfg.expt.get('parallel_pulses', False)
+        self.ch_qubits = dict() # gen ch -> set of qubits its pulses act on
+        self._qubit_ts = dict() # qubit -> timestamp [tProc cycles since the last sync] at which its last pulse ends
         
         super().__init__(soccfg, self.cfg)
 
+    def freq2reg_cached(self, freq_MHz, gen_ch, ro_ch=None):
+        key = ('freq2reg', freq_MHz, gen_ch, ro_ch)
+        reg = self._regs.get(key)
+        if reg is None: reg = self._regs[key] = self.freq2reg(freq_MHz, gen_ch=gen_ch, ro_ch=ro_ch)
+        return reg
+
+    def deg2reg_cached(self, phase_deg, gen_ch):
+        key = ('deg2reg', phase_deg, gen_ch)
+        reg = self._regs.get(key)
+        if reg is None: reg = self._regs[key] = self.deg2reg(phase_deg, gen_ch=gen_ch)
+        return reg
+
+    def us2cycles_cached(self, us, gen_ch=None, ro_ch=None):
+        key = ('us2cycles', us, gen_ch, ro_ch)
+        cycles = self._regs.get(key)
+        if cycles is None: cycles = self._regs[key] = self.us2cycles(us, gen_ch=gen_ch, ro_ch=ro_ch)
+        return cycles
+
+    """
+    Pulse scheduling. By default every played pulse is followed by a sync_all, so pulses are serialized across all
+    channels. With cfg.expt.parallel_pulses, play_pulse instead starts a pulse on its own channel's timeline as soon as
+    that channel and every qubit it acts on (ch_qubits, filled in by initialize for the qubit and readout channels and by
+    subclasses for their extra channels) are free, so pulses on independent qubits overlap. Pulses on channels with no
+    qubits mapped wait for every channel and block every qubit. sync_all and measure still align everything.
+    """
+    def add_ch_qubits(self, ch, qubits):
+        self.ch_qubits.setdefault(ch, set()).update(qubits)
+
+    def play_pulse(self, ch):
+        if not self.parallel_pulses:
+            self.pulse(ch=ch)
+            self.sync_all()
+            return
+        qubits = self.ch_qubits.get(ch)
+        if qubits is None:
+            qubits = range(self.num_qubits_sample)
+            t_free = self.get_max_timestamp()
+        else: t_free = max([self._qubit_ts.get(q, 0) for q in qubits])
+        if t_free <= int(self.get_timestamp(gen_ch=ch)): self.pulse(ch=ch) # channel is the last to free up
+        else: self.pulse(ch=ch, t=int(np.ceil(t_free)))
+        t_end = self.get_timestamp(gen_ch=ch)
+        for q in qubits: self._qubit_ts[q] = t_end
+
+    def sync_all(self, *args, **kwargs):
+        super().sync_all(*args, **kwargs)
+        self._qubit_ts.clear()
+
+    def measure(self, *args, **kwargs):
+        if self.parallel_pulses: self.sync_all() # measure times its pulse and trigger from the last sync
+        return super().measure(*args, **kwargs)
+
+    """
+    [self.<conversion>(value, gen_ch=gen_ch, ro_ch=ro_ch) for value, gen_ch, ro_ch in zip(values, gen_chs, ro_chs)]
+    for the per qubit register lists in initialize, memoized as one entry. gen_chs, ro_chs: one per value, or None to
+    leave out that kwarg
+    """
+    def convert_regs(self, conversion, values, gen_chs=None, ro_chs=None):
+        gen_chs = repeat(None) if gen_chs is None else gen_chs
+        ro_chs = repeat(None) if ro_chs is None else ro_chs
+        args = tuple(zip(values, gen_chs, ro_chs))
+        key = (conversion, args)
+        regs = self._regs.get(key)
+        if regs is None:
+            convert = getattr(self, conversion)
+            regs = self._regs[key] = tuple(convert(value, **{k: ch for k, ch in (('gen_ch', gen_ch), ('ro_ch', ro_ch)) if ch is not None}) for value, gen_ch, ro_ch in args)
+        return list(regs)
+
+    """
+    Dict of name: dict(params) for every loaded pulse, for saving with the experiment data
+    """
+    def pulse_params(self):
+        return {name: spec.to_dict() for name, spec in self.pulse_dict.items()}
+
     """
     Wrappers to load and play pulses.
     If play is false, must specify all parameters and all params will be saved (load params).
@@ -42,19 +221,18 @@ class CliffordAveragerProgram(AveragerProgram):
         """
         if name is not None and (name not in self.pulse_dict.keys() or reload):
             assert ch is not None
-            self.pulse_dict.update({name:dict(ch=ch, name=name, type='const', length=length, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)})
+            self.pulse_dict[name] = PulseSpec(ch=ch, name=name, type='const', length=length, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)
         if play or set_reg:
             assert name in self.pulse_dict.keys()
             # if not (ch == None):
             #     print('Warning: you have specified a pulse parameter that can only be changed when loading.')
-            params = self.pulse_dict[name].copy()
-            if freq_MHz is not None: params['freq_MHz'] = freq_MHz
-            if phase_deg is not None: params['phase_deg'] = phase_deg
-            if gain is not None: params['gain'] = gain
-            self.set_pulse_registers(ch=params['ch'], style='const', freq=self.freq2reg(params['freq_MHz'], gen_ch=params['ch']), phase=self.deg2reg(params['phase_deg'], gen_ch=params['ch']), gain=params['gain'], length=params['length'], phrst=phrst)
+            params = self.pulse_dict[name]
+            if freq_MHz is None: freq_MHz = params.freq_MHz
+            if phase_deg is None: phase_deg = params.phase_deg
+            if gain is None: gain = params.gain
+            self.set_pulse_registers(ch=params.ch, style='const', freq=self.freq2reg_cached(freq_MHz, params.ch), phase=self.deg2reg_cached(phase_deg, params.ch), gain=gain, length=params.length, phrst=phrst)
             if play:
-                self.pulse(ch=params['ch'])
-                self.sync_all()
+                self.play_pulse(params.ch)
 
     def handle_gauss_pulse(self, name, waveformname=None, ch=None, sigma=None, freq_MHz=None, phase_deg=None, gain=None, reload=True, play=False, set_reg=False, flag=None, phrst=0):
         """
@@ -63,22 +241,21 @@ class CliffordAveragerProgram(AveragerProgram):
         if name not in self.pulse_dict.keys() or reload:
             assert None not in [ch, sigma]
             if waveformname is None: waveformname = name
-            self.pulse_dict.update({name:dict(ch=ch, name=name, waveformname=waveformname, type='gauss', sigma=sigma, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)})
+            self.pulse_dict[name] = PulseSpec(ch=ch, name=name, waveformname=waveformname, type='gauss', sigma=sigma, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)
             if reload or waveformname not in self.envelopes[ch].keys():
                 self.add_gauss(ch=ch, name=waveformname, sigma=sigma, length=sigma*4)
                 # print('added gauss pulse', name, 'on ch', ch)
         if play or set_reg:
             # if not (ch == sigma == None):
             #     print('Warning: you have specified a pulse parameter that can only be changed when loading.')
-            params = self.pulse_dict[name].copy()
-            if freq_MHz is not None: params['freq_MHz'] = freq_MHz
-            if phase_deg is not None: params['phase_deg'] = phase_deg
-            if gain is not None: params['gain'] = gain
-            self.set_pulse_registers(ch=params['ch'], style='arb', freq=self.freq2reg(params['freq_MHz'], gen_ch=params['ch']), phase=self.deg2reg(params['phase_deg'], gen_ch=params['ch']), gain=params['gain'], waveform=params['waveformname'], phrst=phrst)
+            params = self.pulse_dict[name]
+            if freq_MHz is None: freq_MHz = params.freq_MHz
+            if phase_deg is None: phase_deg = params.phase_deg
+            if gain is None: gain = params.gain
+            self.set_pulse_registers(ch=params.ch, style='arb', freq=self.freq2reg_cached(freq_MHz, params.ch), phase=self.deg2reg_cached(phase_deg, params.ch), gain=gain, waveform=params.waveformname, phrst=phrst)
             if play:
                 # print('playing gauss pulse', params['name'], 'on ch', params['ch'])
-                self.pulse(ch=params['ch'])
-                self.sync_all()
+                self.play_pulse(params.ch)
 
     def handle_flat_top_pulse(self, name, waveformname=None, ch=None, sigma=3, flat_length=None, freq_MHz=None, phase_deg=None, gain=None, reload=True, play=False, set_reg=False, flag=None, phrst=0):
         """
@@ -89,7 +266,7 @@ class CliffordAveragerProgram(AveragerProgram):
         if name not in self.pulse_dict.keys() or reload:
             assert None not in [ch, sigma, flat_length]
             if waveformname is None: waveformname = name
-            self.pulse_dict.update({name:dict(ch=ch, name=name, waveformname=waveformname, type='flat_top', sigma=sigma, flat_length=flat_length, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)})
+            self.pulse_dict[name] = PulseSpec(ch=ch, name=name, waveformname=waveformname, type='flat_top', sigma=sigma, flat_length=flat_length, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)
             if reload or waveformname not in self.envelopes[ch].keys():
                 # print('all waveforms')
                 # for i_ch in range(len(self.envelopes)):
@@ -101,14 +278,13 @@ class CliffordAveragerProgram(AveragerProgram):
             # if not (ch == name == sigma == length == None):
             #     print('Warning: you have specified a pulse parameter that can only be changed when loading.')
             assert name in self.pulse_dict.keys()
-            params = self.pulse_dict[name].copy()
-            if freq_MHz is not None: params['freq_MHz'] = freq_MHz
-            if phase_deg is not None: params['phase_deg'] = phase_deg
-            if gain is not None: params['gain'] = gain
-            self.set_pulse_registers(ch=params['ch'], style='flat_top', freq=self.freq2reg(params['freq_MHz'], gen_ch=params['ch']), phase=self.deg2reg(params['phase_deg'], gen_ch=params['ch']), gain=params['gain'], waveform=params['waveformname'], length=params['flat_length'], phrst=phrst)
+            params = self.pulse_dict[name]
+            if freq_MHz is None: freq_MHz = params.freq_MHz
+            if phase_deg is None: phase_deg = params.phase_deg
+            if gain is None: gain = params.gain
+            self.set_pulse_registers(ch=params.ch, style='flat_top', freq=self.freq2reg_cached(freq_MHz, params.ch), phase=self.deg2reg_cached(phase_deg, params.ch), gain=gain, waveform=params.waveformname, length=params.flat_length, phrst=phrst)
             if play:
-                self.pulse(ch=params['ch'])
-                self.sync_all()
+                self.play_pulse(params.ch)
 
     def handle_mux4_pulse(self, name, ch=None, mask=None, length=None, reload=True, play=False, set_reg=False, flag=None):
         """
@@ -117,28 +293,41 @@ class CliffordAveragerProgram(AveragerProgram):
         if name is not None and reload: # and name not in self.pulse_dict.keys():
             assert ch is not None
             assert ch == 6, 'Only ch 6 on q3diamond supports mux4 currently!'
-            self.pulse_dict.update({name:dict(ch=ch, name=name, type='mux4', mask=mask, length=length, flag=flag)})
+            self.pulse_dict[name] = PulseSpec(ch=ch, name=name, type='mux4', mask=mask, length=length, flag=flag)
         if play or set_reg:
             assert name in self.pulse_dict.keys()
-            params = self.pulse_dict[name].copy()
-            if mask is not None: params['mask'] = mask
-            if length is not None: params['length'] = length
-            self.set_pulse_registers(ch=params['ch'], style='const', length=length, mask=mask)
+            params = self.pulse_dict[name]
+            self.set_pulse_registers(ch=params.ch, style='const', length=length, mask=mask)
             if play:
-                self.pulse(ch=params['ch'])
-                self.sync_all()
+                self.play_pulse(params.ch)
+
+    """
+    Envelopes are shared across programs through waveform_cache, so a sweep that builds a new program per point only
+    computes each distinct envelope once.
+    """
+    def add_gauss(self, ch, name, sigma, length, maxv=None):
+        gencfg = self.soccfg['gens'][ch]
+        if maxv is None: maxv = gencfg['maxv']*gencfg['maxv_scale']
+        samps_per_clk = gencfg['samps_per_clk']
+        def make():
+            length_samps = np.round(length) * samps_per_clk
+            return gauss(mu=length_samps/2-0.5, si=sigma*samps_per_clk, length=length_samps, maxv=maxv), None
+        idata, _ = waveform_cache.get_waveform('gauss', gencfg, (sigma, length, maxv), make)
+        self.add_pulse(ch=ch, name=name, idata=idata)
 
     # mu, beta are dimensionless
     def add_adiabatic(self, ch, name, mu, beta, period_us):
         period = self.us2cycles(period_us, gen_ch=ch)
         gencfg = self.soccfg['gens'][ch]
-        maxv = gencfg['maxv']*gencfg['maxv_scale']
-        samps_per_clk = gencfg['samps_per_clk']
-        length = np.round(period) * samps_per_clk
-        period *= samps_per_clk
-        t = np.arange(0, length)
-        iamp, qamp = fitter.adiabatic_iqamp(t, amp_max=1, mu=mu, beta=beta, period=period)
-        self.add_pulse(ch=ch, name=name, idata=maxv*iamp, qdata=maxv*qamp)
+        def make():
+            maxv = gencfg['maxv']*gencfg['maxv_scale']
+            samps_per_clk = gencfg['samps_per_clk']
+            length = np.round(period) * samps_per_clk
+            t = np.arange(0, length)
+            iamp, qamp = fitter.adiabatic_iqamp(t, amp_max=1, mu=mu, beta=beta, period=period*samps_per_clk)
+            return maxv*iamp, maxv*qamp
+        idata, qdata = waveform_cache.get_waveform('adiabatic', gencfg, (mu, beta, period), make)
+        self.add_pulse(ch=ch, name=name, idata=idata, qdata=qdata)
 
     def handle_adiabatic_pulse(self, name, waveformname=None, ch=None, mu=None, beta=None, period_us=None, freq_MHz=None, phase_deg=None, gain=None, reload=True, play=False, set_reg=False, flag=None, phrst=0):
         """
@@ -147,44 +336,49 @@ class CliffordAveragerProgram(AveragerProgram):
         if name not in self.pulse_dict.keys() or reload:
             assert None not in [ch, mu, beta, period_us]
             if waveformname is None: waveformname = name
-            self.pulse_dict.update({name:dict(ch=ch, name=name, waveformname=waveformname, type='adiabatic', mu=mu, beta=beta, period_us=period_us, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)})
+            self.pulse_dict[name] = PulseSpec(ch=ch, name=name, waveformname=waveformname, type='adiabatic', mu=mu, beta=beta, period_us=period_us, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)
             if reload or waveformname not in self.envelopes[ch].keys():
                 self.add_adiabatic(ch=ch, name=waveformname, mu=mu, beta=beta, period_us=period_us)
                 # print('added gauss pulse', name, 'on ch', ch)
         if play or set_reg:
             # if not (ch == sigma == None):
             #     print('Warning: you have specified a pulse parameter that can only be changed when loading.')
-            params = self.pulse_dict[name].copy()
-            if freq_MHz is not None: params['freq_MHz'] = freq_MHz
-            if phase_deg is not None: params['phase_deg'] = phase_deg
-            if gain is not None: params['gain'] = gain
-            self.set_pulse_registers(ch=params['ch'], style='arb', freq=self.freq2reg(params['freq_MHz'], gen_ch=params['ch']), phase=self.deg2reg(params['phase_deg'], gen_ch=params['ch']), gain=params['gain'], waveform=params['waveformname'], phrst=phrst)
+            params = self.pulse_dict[name]
+            if freq_MHz is None: freq_MHz = params.freq_MHz
+            if phase_deg is None: phase_deg = params.phase_deg
+            if gain is None: gain = params.gain
+            self.set_pulse_registers(ch=params.ch, style='arb', freq=self.freq2reg_cached(freq_MHz, params.ch), phase=self.deg2reg_cached(phase_deg, params.ch), gain=gain, waveform=params.waveformname, phrst=phrst)
             if play:
                 # print('playing gauss pulse', params['name'], 'on ch', params['ch'])
-                self.pulse(ch=params['ch'])
-                self.sync_all()
+                self.play_pulse(params.ch)
 
     # I_mhz_vs_us, Q_mhz_vs_us = functions of time in us, in units of MHz
     # times_us = times at which I_mhz_vs_us and Q_mhz_vs_us are defined
+    # only plots the envelope the first time it is computed
     def add_IQ(self, ch, name, I_mhz_vs_us, Q_mhz_vs_us, times_us):
         gencfg = self.soccfg['gens'][ch]
-        maxv = gencfg['maxv']*gencfg['maxv_scale'] - 1
-        samps_per_clk = gencfg['samps_per_clk']
-        times_cycles = np.linspace(0, self.us2cycles(times_us[-1], gen_ch=ch), len(times_us))
-        times_samps = samps_per_clk * times_cycles
-        IQ_scale = max((np.max(np.abs(I_mhz_vs_us)), np.max(np.abs(Q_mhz_vs_us))))
-        I_func = sp.interpolate.interp1d(times_samps, I_mhz_vs_us/IQ_scale, kind='linear', fill_value='extrapolate')
-        Q_func = sp.interpolate.interp1d(times_samps, Q_mhz_vs_us/IQ_scale, kind='linear', fill_value='extrapolate')
-        t = np.arange(0, np.round(times_samps[-1]))
-        iamps = I_func(t)
-        qamps = Q_func(t)
-        plt.plot(maxv*iamps, '.-')
-        # plt.plot(times_samps, I_func(times_samps), '.-')
-        plt.plot(maxv*qamps, '.-')
-        plt.axhline(maxv)
-        # plt.plot(times_samps, Q_func(times_samps), '.-')
-        plt.show()
-        self.add_pulse(ch=ch, name=name, idata=maxv*iamps, qdata=maxv*qamps)        
+        length_cycles = self.us2cycles(times_us[-1], gen_ch=ch)
+        def make():
+            maxv = gencfg['maxv']*gencfg['maxv_scale'] - 1
+            samps_per_clk = gencfg['samps_per_clk']
+            times_cycles = np.linspace(0, length_cycles, len(times_us))
+            times_samps = samps_per_clk * times_cycles
+            IQ_scale = max((np.max(np.abs(I_mhz_vs_us)), np.max(np.abs(Q_mhz_vs_us))))
+            I_func = sp.interpolate.interp1d(times_samps, I_mhz_vs_us/IQ_scale, kind='linear', fill_value='extrapolate')
+            Q_func = sp.interpolate.interp1d(times_samps, Q_mhz_vs_us/IQ_scale, kind='linear', fill_value='extrapolate')
+            t = np.arange(0, np.round(times_samps[-1]))
+            iamps = I_func(t)
+            qamps = Q_func(t)
+            if not is_headless():
+                plt.plot(maxv*iamps, '.-')
+                # plt.plot(times_samps, I_func(times_samps), '.-')
+                plt.plot(maxv*qamps, '.-')
+                plt.axhline(maxv)
+                # plt.plot(times_samps, Q_func(times_samps), '.-')
+                plt.show()
+            return maxv*iamps, maxv*qamps
+        idata, qdata = waveform_cache.get_waveform('IQ', gencfg, (I_mhz_vs_us, Q_mhz_vs_us, times_us, length_cycles), make)
+        self.add_pulse(ch=ch, name=name, idata=idata, qdata=qdata)
 
     def handle_IQ_pulse(self, name, waveformname=None, ch=None, I_mhz_vs_us=None, Q_mhz_vs_us=None, times_us=None, freq_MHz=None, phase_deg=None, gain=None, reload=True, play=False, set_reg=False, flag=None, phrst=0):
         """
@@ -193,20 +387,19 @@ class CliffordAveragerProgram(AveragerProgram):
         if name not in self.pulse_dict.keys() or reload:
             assert ch is not None and I_mhz_vs_us is not None and Q_mhz_vs_us is not None and times_us is not None
             if waveformname is None: waveformname = name
-            self.pulse_dict.update({name:dict(ch=ch, name=name, waveformname=waveformname, type='IQpulse', I_mhz_vs_us=I_mhz_vs_us, Q_mhz_vs_us=Q_mhz_vs_us, times_us=times_us, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)})
+            self.pulse_dict[name] = PulseSpec(ch=ch, name=name, waveformname=waveformname, type='IQpulse', I_mhz_vs_us=I_mhz_vs_us, Q_mhz_vs_us=Q_mhz_vs_us, times_us=times_us, freq_MHz=freq_MHz, phase_deg=phase_deg, gain=gain, flag=flag)
             if reload or waveformname not in self.envelopes[ch].keys():
                 self.add_IQ(ch=ch, name=waveformname, I_mhz_vs_us=I_mhz_vs_us, Q_mhz_vs_us=Q_mhz_vs_us, times_us=times_us)
         if play or set_reg:
             # if not (ch == sigma == None):
             #     print('Warning: you have specified a pulse parameter that can only be changed when loading.')
-            params = self.pulse_dict[name].copy()
-            if freq_MHz is not None: params['freq_MHz'] = freq_MHz
-            if phase_deg is not None: params['phase_deg'] = phase_deg
-            if gain is not None: params['gain'] = gain
-            self.set_pulse_registers(ch=params['ch'], style='arb', freq=self.freq2reg(params['freq_MHz'], gen_ch=params['ch']), phase=self.deg2reg(params['phase_deg'], gen_ch=params['ch']), gain=params['gain'], waveform=params['waveformname'], phrst=phrst)
+            params = self.pulse_dict[name]
+            if freq_MHz is None: freq_MHz = params.freq_MHz
+            if phase_deg is None: phase_deg = params.phase_deg
+            if gain is None: gain = params.gain
+            self.set_pulse_registers(ch=params.ch, style='arb', freq=self.freq2reg_cached(freq_MHz, params.ch), phase=self.deg2reg_cached(phase_deg, params.ch), gain=gain, waveform=params.waveformname, phrst=phrst)
             if play:
-                self.pulse(ch=params['ch'])
-                self.sync_all()
+                self.play_pulse(params.ch)
 
 
     """
@@ -220,7 +413,7 @@ class CliffordAveragerProgram(AveragerProgram):
         f_ge = self.cfg.device.qubit.f_ge[q]
         gain = self.cfg.device.qubit.pulses.pi_ge.gain[q]
         phase_deg = self.overall_phase[q] + extra_phase
-        sigma = self.us2cycles(self.cfg.device.qubit.pulses.pi_ge.sigma[q], gen_ch=self.qubit_chs[q])
+        sigma = self.us2cycles_cached(self.cfg.device.qubit.pulses.pi_ge.sigma[q], gen_ch=self.qubit_chs[q])
         waveformname = 'pi_ge'
         type = self.cfg.device.qubit.pulses.pi_ge.type[q]
         if special:
@@ -259,7 +452,7 @@ class CliffordAveragerProgram(AveragerProgram):
             self.handle_IQ_pulse(name=f'{name}_q{q}', ch=self.qubit_chs[q], waveformname=f'{waveformname}_q{q}', I_mhz_vs_us=I_mhz_vs_us, Q_mhz_vs_us=Q_mhz_vs_us, times_us=times_us, freq_MHz=f_ge, phase_deg=phase_deg, gain=gain, play=play, flag=flag, phrst=phrst, reload=reload)
         elif type == 'flat_top':
             assert False, 'flat top not checked yet'
-            flat_length = self.us2cycles(self.cfg.device.qubit.pulses.pi_ge.length[q], gen_ch=self.qubit_chs[q]) - 3*4
+            flat_length = self.us2cycles_cached(self.cfg.device.qubit.pulses.pi_ge.length[q], gen_ch=self.qubit_chs[q]) - 3*4
             self.handle_flat_top_pulse(name=f'{name}_q{q}', ch=self.qubit_chs[q], waveformname=f'{waveformname}_q{q}', sigma=sigma, flat_length=flat_length, freq_MHz=f_ge, phase_deg=phase_deg, gain=gain, play=play, flag=flag, phrst=phrst, reload=reload) 
         else: assert False, f'Pulse type {type} not supported.'
 
@@ -292,17 +485,21 @@ class CliffordAveragerProgram(AveragerProgram):
 
         self.overall_phase = [0]*self.num_qubits_sample
 
+        for q in range(self.num_qubits_sample):
+            self.add_ch_qubits(self.qubit_chs[q], [q])
+            self.add_ch_qubits(self.res_chs[q], [q])
+
         self.q_rps = [self.ch_page(ch) for ch in self.qubit_chs] # get register page for qubit_ch
-        self.f_res_reg = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.readout.frequency, self.res_chs)]
+        self.f_res_reg = self.convert_regs('freq2reg', self.cfg.device.readout.frequency, gen_chs=self.res_chs)
 
-        self.f_ge_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_ge, self.qubit_chs)]
-        self.f_ef_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_ef, self.qubit_chs)]
-        self.f_res_regs = [self.freq2reg(f, gen_ch=gen_ch, ro_ch=adc_ch) for f, gen_ch, adc_ch in zip(self.cfg.device.readout.frequency, self.res_chs, self.adc_chs)]
-        self.f_Q1_ZZ_regs = [self.freq2reg(f, gen_ch=self.qubit_chs[1]) for f in self.cfg.device.qubit.f_Q1_ZZ]
-        self.f_Q_ZZ1_regs = [self.freq2reg(f, gen_ch=self.qubit_chs[q]) for q, f in enumerate(self.cfg.device.qubit.f_Q_ZZ1)]
+        self.f_ge_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_ge, gen_chs=self.qubit_chs)
+        self.f_ef_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_ef, gen_chs=self.qubit_chs)
+        self.f_res_regs = self.convert_regs('freq2reg', self.cfg.device.readout.frequency, gen_chs=self.res_chs, ro_chs=self.adc_chs)
+        self.f_Q1_ZZ_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_Q1_ZZ, gen_chs=repeat(self.qubit_chs[1]))
+        self.f_Q_ZZ1_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_Q_ZZ1, gen_chs=self.qubit_chs)
 
-        self.readout_lengths_dac = [self.us2cycles(length, gen_ch=gen_ch) for length, gen_ch in zip(self.cfg.device.readout.readout_length, self.res_chs)]
-        self.readout_lengths_adc = [1+self.us2cycles(length, ro_ch=ro_ch) for length, ro_ch in zip(self.cfg.device.readout.readout_length, self.adc_chs)]
+        self.readout_lengths_dac = self.convert_regs('us2cycles', self.cfg.device.readout.readout_length, gen_chs=self.res_chs)
+        self.readout_lengths_adc = [1+cycles for cycles in self.convert_regs('us2cycles', self.cfg.device.readout.readout_length, ro_chs=self.adc_chs)]
 
         # declare res dacs, add readout pulses
         if self.res_ch_types[0] == 'mux4': # only supports having all resonators be on mux, or none
@@ -338,10 +535,10 @@ class CliffordAveragerProgram(AveragerProgram):
             self.X_pulse(q=q, play=False, reload=True)
 
             # assume ef pulses are gauss
-            pi_ef_sigma_cycles = self.us2cycles(self.pi_ef_sigmas_us[q], gen_ch=self.qubit_chs[q])
+            pi_ef_sigma_cycles = self.us2cycles_cached(self.pi_ef_sigmas_us[q], gen_ch=self.qubit_chs[q])
             self.add_gauss(ch=self.qubit_chs[q], name=f"pi_ef_qubit{q}", sigma=pi_ef_sigma_cycles, length=pi_ef_sigma_cycles*4)
             if q != 1:
-                pi_Q1_ZZ_sigma_cycles = self.us2cycles(self.pi_Q1_ZZ_sigmas_us[q], gen_ch=self.qubit_chs[1])
+                pi_Q1_ZZ_sigma_cycles = self.us2cycles_cached(self.pi_Q1_ZZ_sigmas_us[q], gen_ch=self.qubit_chs[1])
                 self.add_gauss(ch=self.qubit_chs[1], name=f"qubit1_ZZ{q}", sigma=pi_Q1_ZZ_sigma_cycles, length=pi_Q1_ZZ_sigma_cycles*4)
 
         # declare adcs - readout for all qubits everytime, defines number of buffers returned regardless of number of adcs triggered
@@ -405,25 +602,20 @@ class CliffordAveragerProgram(AveragerProgram):
     """
     def get_shots(self, angle=None, threshold=None, avg_shots=False, verbose=False, return_err=False):
         buf_len = len(self.di_buf[0])
+        n_chs = len(self.ro_chs)
 
         if angle is None: angle = [0]*len(self.cfg.device.qubit.f_ge)
-        bufi = np.array([
-            self.di_buf[i]*np.cos(np.pi/180*angle[i]) - self.dq_buf[i]*np.sin(np.pi/180*angle[i])
-            for i, ch in enumerate(self.ro_chs)])
-        bufi = np.array([bufi[i]/ro['length'] for i, (ch, ro) in enumerate(self.ro_chs.items())])
-        if threshold is not None: # categorize single shots
-            bufi = np.array([np.heaviside(bufi[ch] - threshold[ch], 0) for ch in range(len(self.adc_chs))])
-        avgi = np.average(bufi, axis=1) # [num_chs]
-        bufi_err = np.std(bufi, axis=1) / np.sqrt(buf_len) # [num_chs]
-        if verbose: print([np.median(bufi[i]) for i in range(4)])
-
-        bufq = np.array([
-            self.di_buf[i]*np.sin(np.pi/180*angle[i]) + self.dq_buf[i]*np.cos(np.pi/180*angle[i])
-            for i, ch in enumerate(self.ro_chs)])
-        bufq = np.array([bufq[i]/ro['length'] for i, (ch, ro) in enumerate(self.ro_chs.items())])
-        avgq = np.average(bufq, axis=1) # [num_chs]
-        bufq_err = np.std(bufq, axis=1) / np.sqrt(buf_len) # [num_chs]
-        if verbose: print([np.median(bufq[i]) for i in range(4)])
+        scale = [1/ro['length'] for ch, ro in self.ro_chs.items()]
+        if threshold is not None: threshold = threshold[:n_chs] # categorize single shots
+        # single shots are float32 views, accumulate the averages in float64
+        bufi, bufq = rotate_shots(self.di_buf, self.dq_buf, angle=angle[:n_chs], scale=scale, threshold=threshold)
+        avgi = np.mean(bufi, axis=1, dtype=np.float64) # [num_chs]
+        bufi_err = np.std(bufi, axis=1, dtype=np.float64) / np.sqrt(buf_len) # [num_chs]
+        if verbose: print(np.median(bufi, axis=1))
+
+        avgq = np.mean(bufq, axis=1, dtype=np.float64) # [num_chs]
+        bufq_err = np.std(bufq, axis=1, dtype=np.float64) / np.sqrt(buf_len) # [num_chs]
+        if verbose: print(np.median(bufq, axis=1))
 
         if avg_shots:
             idata = avgi
@@ -440,43 +632,10 @@ class CliffordAveragerProgram(AveragerProgram):
     If post_process == 'scale': uses angle + ge_avgs to scale the average of all shots on a scale of 0 to 1. ge_avgs should be of shape (num_total_qubits, 4) and should represent the pre-rotation Ig, Qg, Ie, Qe
     If post_process == None: uses angle to rotate the i and q and then returns the avg i and q
     """
-    def acquire_rotated(self, soc, progress, angle=None, threshold=None, ge_avgs=None, post_process=None, verbose=False):
-        avgi, avgq = self.acquire(soc, load_pulses=True, progress=progress)
-        if post_process == None: 
-            avgi_rot, avgq_rot, avgi_err, avgq_err = self.get_shots(angle=angle, avg_shots=True, verbose=verbose, return_err=True)
-            if angle is None: return avgi_rot, avgq_rot
-            else: return avgi_rot, avgi_err
-        elif post_process == 'threshold':
-            assert threshold is not None
-            popln, avgq_rot, popln_err, avgq_err = self.get_shots(angle=angle, threshold=threshold, avg_shots=True, verbose=verbose, return_err=True)
-            return popln, popln_err
-        elif post_process == 'scale':
-            assert ge_avgs is not None
-            avgi_rot, avgq_rot, avgi_err, avgq_err = self.get_shots(angle=angle, avg_shots=True, verbose=verbose, return_err=True)
-
-            ge_avgs_rot = [None]*4
-            for q, angle_q in enumerate(angle):
-                if not isinstance(ge_avgs[q], (list, np.ndarray)): continue # this qubit was not calibrated
-                Ig_q, Qg_q, Ie_q, Qe_q = ge_avgs[q]
-                ge_avgs_rot[q] = [
-                    Ig_q*np.cos(np.pi/180*angle_q) - Qg_q*np.sin(np.pi/180*angle_q),
-                    Ie_q*np.cos(np.pi/180*angle_q) - Qe_q*np.sin(np.pi/180*angle_q)
-                ]
-            shape = None
-            for q in range(4):
-                if ge_avgs_rot[q] is not None:
-                    shape = np.shape(ge_avgs_rot[q])
-                    break
-            for q in range(4):
-                if ge_avgs_rot[q] is None: ge_avgs_rot[q] = np.zeros(shape=shape)
-                
-            ge_avgs_rot = np.asarray(ge_avgs_rot)
-            avgi_rot -= ge_avgs_rot[:,0]
-            avgi_rot /= ge_avgs_rot[:,1] - ge_avgs_rot[:,0]
-            avgi_err /= ge_avgs_rot[:,1] - ge_avgs_rot[:,0]
-            return avgi_rot, avgi_err
-        else:
-            assert False, 'Undefined post processing flag, options are None, threshold, scale'
+    def acquire_rotated(self, soc, progress, angle=None, threshold=None, ge_avgs=None, post_process=None, verbose=False, load_pulses=True):
+        avgi, avgq = self.acquire(soc, load_pulses=load_pulses, progress=progress)
+        scale = [1/ro['length'] for ch, ro in self.ro_chs.items()]
+        return post_process_shots(self.di_buf, self.dq_buf, scale=scale, angle=angle, threshold=threshold, ge_avgs=ge_avgs, post_process=post_process, verbose=verbose)
 
 # ===================================================================== #
 
@@ -489,7 +648,7 @@ class QutritAveragerProgram(CliffordAveragerProgram):
         f_ef_MHz = self.cfg.device.qubit.f_ef[q]
         gain = self.cfg.device.qubit.pulses.pi_ef.gain[q]
         phase_deg = self.overall_phase[q] + extra_phase
-        sigma_cycles = self.us2cycles(self.cfg.device.qubit.pulses.pi_ef.sigma[q], gen_ch=ch)
+        sigma_cycles = self.us2cycles_cached(self.cfg.device.qubit.pulses.pi_ef.sigma[q], gen_ch=ch)
         waveformname = 'pi_ef'
         if pihalf:
             if divide_len:
@@ -568,7 +727,7 @@ class CliffordEgGfAveragerProgram(QutritAveragerProgram):
             f_EgGf_MHz = self.cfg.device.qubit.f_EgGf[qNotDrive]
             gain = self.cfg.device.qubit.pulses.pi_EgGf.gain[qNotDrive]
             phase_deg = self.overall_phase[qNotDrive] + extra_phase
-            sigma_cycles = self.us2cycles(self.cfg.device.qubit.pulses.pi_EgGf.sigma[qNotDrive], gen_ch=ch)
+            sigma_cycles = self.us2cycles_cached(self.cfg.device.qubit.pulses.pi_EgGf.sigma[qNotDrive], gen_ch=ch)
             type = self.cfg.device.qubit.pulses.pi_EgGf.type[qNotDrive]
             waveformname = 'pi_EgGf'
         else:
@@ -576,7 +735,7 @@ class CliffordEgGfAveragerProgram(QutritAveragerProgram):
             f_EgGf_MHz = self.cfg.device.qubit.f_EgGf_Q[qDrive]
             gain = self.cfg.device.qubit.pulses.pi_EgGf_Q.gain[qDrive]
             phase_deg = self.overall_phase[qDrive] + extra_phase
-            sigma_cycles = self.us2cycles(self.cfg.device.qubit.pulses.pi_EgGf_Q.sigma[qDrive], gen_ch=ch)
+            sigma_cycles = self.us2cycles_cached(self.cfg.device.qubit.pulses.pi_EgGf_Q.sigma[qDrive], gen_ch=ch)
             type = self.cfg.device.qubit.pulses.pi_EgGf_Q.type[qDrive]
             waveformname = 'pi_EgGf'
         if pihalf:
@@ -618,6 +777,10 @@ class CliffordEgGfAveragerProgram(QutritAveragerProgram):
         self.swap_Q_chs = self.cfg.hw.soc.dacs.swap_Q.ch
         self.swap_Q_ch_types = self.cfg.hw.soc.dacs.swap_Q.type
         super().initialize()
+        # the Eg-Gf swaps act on both q and Q1
+        for q, (ch, ch_Q) in enumerate(zip(self.swap_chs, self.swap_Q_chs)):
+            self.add_ch_qubits(ch, [q, 1])
+            self.add_ch_qubits(ch_Q, [q, 1])
         for q in self.qubits:
             if q==1: continue
             mixer_freq = 0
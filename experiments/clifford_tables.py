@@ -0,0 +1,110 @@
+import os
+import numpy as np
+
+"""
+Precompiled single qubit Clifford group tables for RB.
+
+Each Clifford is represented by where it sends the 6 cardinal points of the Bloch sphere in the basis
+Z, X, Y, -Z, -X, -Y, i.e. as a permutation perm with perm[k] = index that cardinal point k goes to
+(this is the column of the 1 in column k of the corresponding 6x6 permutation matrix). Each Clifford gate
+can be uniquely identified just by checking where +Z and +X go.
+
+Tables (all integer numpy arrays, indexed by position in clifford_1q_names):
+    clifford_1q_names: names of the 24 Cliffords as comma separated pulses, read as a matrix product acting on
+        the state (pulses are applied in reverse order of the name)
+    clifford_1q_index: name -> index
+    clifford_1q_perms: [24, 6] permutation of the cardinal points for each Clifford
+    clifford_1q_mult: [24, 24] composition table, clifford_1q_mult[i, j] = index of C_i @ C_j (C_j applied first)
+    clifford_1q_inv: [24] index of the inverse of each Clifford
+    clifford_1q_lookup: [6, 6] index of the Clifford that sends +Z to row z_new and +X to row x_new
+
+The tables are built once and cached to disk (in __pycache__ next to this file), so importing the RB
+modules just loads a few small arrays.
+"""
+
+_TABLES_VERSION = 1
+_cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', f'clifford_1q_tables_v{_TABLES_VERSION}.npz')
+
+# Basic pulses as permutations of (Z, X, Y, -Z, -X, -Y)
+_basic_perms = {
+    'Z':    [0, 4, 5, 3, 1, 2],
+    'X':    [3, 1, 5, 0, 4, 2],
+    'Y':    [3, 4, 2, 0, 1, 5],
+    'Z/2':  [0, 2, 4, 3, 5, 1],
+    'X/2':  [5, 1, 0, 2, 4, 3],
+    'Y/2':  [1, 3, 2, 4, 0, 5],
+    '-Z/2': [0, 5, 1, 3, 2, 4],
+    '-X/2': [2, 1, 3, 5, 4, 0],
+    '-Y/2': [4, 0, 2, 1, 3, 5],
+    'I':    [0, 1, 2, 3, 4, 5],
+}
+
+# Read pulse as a matrix product acting on state (meaning apply pulses in reverse order of the tuple)
+two_step_pulses = [
+    ('X','Z/2'), ('X/2','Z/2'), ('-X/2','Z/2'),
+    ('Y','Z/2'), ('Y/2','Z/2'), ('-Y/2','Z/2'),
+    ('X','Z'), ('X/2','Z'), ('-X/2','Z'),
+    ('Y','Z'), ('Y/2','Z'), ('-Y/2','Z'),
+    ('X','-Z/2'), ('X/2','-Z/2'), ('-X/2','-Z/2'),
+    ('Y','-Z/2'), ('Y/2','-Z/2'), ('-Y/2','-Z/2'),
+]
+
+def _build_tables():
+    names = list(_basic_perms.keys())
+    perms = [tuple(perm) for perm in _basic_perms.values()]
+    seen = set(perms)
+    for pulse in two_step_pulses:
+        # (A @ B) e_k = A e_{B[k]}
+        new_perm = tuple(np.array(_basic_perms[pulse[0]])[_basic_perms[pulse[1]]])
+        if new_perm in seen: continue # get rid of repeats
+        seen.add(new_perm)
+        names.append(pulse[0]+','+pulse[1])
+        perms.append(new_perm)
+    perms = np.array(perms, dtype=np.int8)
+    n = len(names)
+
+    lookup = np.full((6, 6), -1, dtype=np.int8)
+    lookup[perms[:,0], perms[:,1]] = np.arange(n)
+
+    # composed[i, j] = perms[i][perms[j]]
+    composed = perms[np.arange(n)[:,None,None], perms[None,:,:]]
+    mult = lookup[composed[:,:,0], composed[:,:,1]]
+    inv = np.argmax(mult == lookup[0, 1], axis=1).astype(np.int8) # C_i @ C_inv = I
+    return np.array(names), perms, mult, inv, lookup
+
+def _load_tables():
+    try:
+        with np.load(_cache_file) as tables:
+            return tables['names'], tables['perms'], tables['mult'], tables['inv'], tables['lookup']
+    except (OSError, KeyError, ValueError):
+        pass
+    names, perms, mult, inv, lookup = _build_tables()
+    try:
+        os.makedirs(os.path.dirname(_cache_file), exist_ok=True)
+        np.savez(_cache_file, names=names, perms=perms, mult=mult, inv=inv, lookup=lookup)
+    except OSError:
+        pass # read only install, just rebuild next time
+    return names, perms, mult, inv, lookup
+
+_names, clifford_1q_perms, clifford_1q_mult, clifford_1q_inv, clifford_1q_lookup = _load_tables()
+clifford_1q_names = [str(name) for name in _names]
+clifford_1q_index = {name:i for i, name in enumerate(clifford_1q_names)}
+del _names
+
+def clifford_1q_matrix(name):
+    """
+    6x6 matrix representation of the Clifford, mapping the cardinal points in the basis Z, X, Y, -Z, -X, -Y
+    """
+    perm = clifford_1q_perms[clifford_1q_index[name]]
+    matrix = np.zeros((6, 6), dtype=int)
+    matrix[perm, np.arange(6)] = 1
+    return matrix
+
+def total_clifford(pulse_n_seq):
+    """
+    Index of the Clifford equivalent to applying the Cliffords with indices pulse_n_seq in order
+    """
+    total = clifford_1q_index['I']
+    for n in pulse_n_seq:
+        total = clifford_1q_mult[n, total]
+    return int(total)
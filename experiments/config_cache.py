@@ -0,0 +1,59 @@
+import os
+import traceback
+from copy import deepcopy
+
+import yaml
+from slab import AttrDict
+
+"""
+Process-wide cache of parsed YAML config files.
+
+Nested sweeps (e.g. SingleShotOptExperiment, which makes a new HistogramExperiment for every (freq, gain, len) point)
+construct an Experiment per point, and each construction re-reads and re-parses the config yml. Parsed configs are
+cached here keyed by absolute path, and invalidated when the file's mtime or size changes. Every caller gets its own
+deep copy: experiments routinely mutate their cfg in place (cfg.device.readout.frequency[q] = f), so a shared object
+would leak changes between experiments. Copying the parsed dict is much cheaper than parsing the yml again.
+
+This is opt in per class: an Experiment subclass uses the cache by listing CachedConfigMixin before slab's Experiment,
+e.g. class HistogramExperiment(CachedConfigMixin, Experiment). All other slab Experiments load their config as usual.
+"""
+
+_config_cache = dict() # abspath -> ((mtime_ns, size), parsed config)
+
+def load_yaml_config(config_file):
+    """
+    Returns an AttrDict of the parsed yml config_file, only re-parsing if the file has changed on disk.
+    """
+    abspath = os.path.abspath(config_file)
+    stat = os.stat(abspath)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _config_cache.get(abspath)
+    if cached is None or cached[0] != key:
+        with open(abspath, 'r') as fid:
+            cached = (key, yaml.safe_load(fid))
+        _config_cache[abspath] = cached
+    return AttrDict(deepcopy(cached[1]))
+
+def clear_config_cache():
+    _config_cache.clear()
+
+class CachedConfigMixin:
+    """
+    Loads .yml/.yaml configs through load_yaml_config, and defers to Experiment.load_config for everything else (json,
+    h5, no config, missing file). Like slab, a config that fails to load or has no aliases prints the error and
+    continues rather than raising.
+    """
+    def load_config(self):
+        if self.config_file is None or not self.config_file.lower().endswith(('.yml', '.yaml')):
+            return super().load_config()
+        try:
+            self.cfg = load_yaml_config(self.config_file)
+            if self.cfg is not None:
+                for alias, inst in self.cfg['aliases'].items():
+                    if inst in self.im:
+                        setattr(self, alias, self.im[inst])
+        except OSError:
+            return super().load_config() # let slab report the missing file as usual
+        except Exception:
+            print("Could not load config.")
+            traceback.print_exc()
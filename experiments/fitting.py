@@ -1,64 +1,185 @@
 import numpy as np
 import scipy as sp
 import cmath
+import functools
+import hashlib
+import os
+from collections import OrderedDict
 
 # ====================================================== #
 
 """
-Compare the fit between the check_measures (amps, avgi, and avgq by default) in data, using the compare_param_i-th parameter to do the comparison. Pick the best method of measurement out of the check_measures, and return the fit, fit_err, and any other get_best_data_params corresponding to that measurement.
+Opt-in cache of fit results, for re-running analyze() on the same data (e.g. in a notebook).
 
-If fitfunc is specified, uses R^2 to determine best fit.
+Fit functions decorated with @cached_fit are keyed by a hash of the fit function name, xdata, ydata, fitparams, and
+any other arguments; the bounds and initial guesses are computed deterministically from those, so they are covered
+too. The key also includes a hash of this file, so editing any model or fitter invalidates old entries.
+
+    fitter.enable_fit_cache(maxsize=256, cache_dir=None) # cache_dir: also persist results as .npz files there
+    fitter.disable_fit_cache()
+    fitter.clear_fit_cache()
+
+Cached calls return copies of (pOpt, pCov) (or whatever tuple of arrays the fit returns) and skip the prints of the
+original fit.
 """
-def get_best_fit(data, fitfunc=None, prefixes=['fit'], check_measures=('amps', 'avgi', 'avgq'), get_best_data_params=(), override=None):
-    fit_errs = [data[f'{prefix}_err_{check}'] for check in check_measures for prefix in prefixes]
-    all_check_measures = [f'{prefix}_err_{check}' for check in check_measures for prefix in prefixes]
 
-    # fix the error matrix so "0" error is adjusted to inf
-    for fit_err_check in fit_errs:
-        for i, fit_err in enumerate(np.diag(fit_err_check)):
-            if fit_err == 0: fit_err_check[i][i] = np.inf
+_fit_cache = None # OrderedDict key -> (pOpt, pCov, ...) when enabled, in LRU order
+_fit_cache_maxsize = 256
+_fit_cache_dir = None
+with open(__file__, 'rb') as _f: _source_hash = hashlib.sha1(_f.read()).hexdigest()
+
+def enable_fit_cache(maxsize=256, cache_dir=None):
+    global _fit_cache, _fit_cache_maxsize, _fit_cache_dir
+    if _fit_cache is None: _fit_cache = OrderedDict()
+    _fit_cache_maxsize = maxsize
+    _fit_cache_dir = cache_dir
+    if cache_dir is not None: os.makedirs(cache_dir, exist_ok=True)
+
+def disable_fit_cache():
+    global _fit_cache, _fit_cache_dir
+    _fit_cache = None
+    _fit_cache_dir = None
+
+def clear_fit_cache(disk=False):
+    if _fit_cache is not None: _fit_cache.clear()
+    if disk and _fit_cache_dir is not None:
+        for f in os.listdir(_fit_cache_dir):
+            if f.startswith('fit_') and f.endswith('.npz'): os.remove(os.path.join(_fit_cache_dir, f))
+
+def _hash_arg(h, arg):
+    # returns False if arg can't be hashed reliably
+    if arg is None or isinstance(arg, (bool, int, float, complex, str, np.number)):
+        h.update(repr((type(arg).__name__, arg)).encode())
+    elif isinstance(arg, (list, tuple, np.ndarray)):
+        try: arr = np.asarray(arg)
+        except ValueError: arr = None # ragged
+        if arr is None or arr.dtype.kind not in 'biufc':
+            h.update(f'seq{len(arg)}'.encode())
+            return all(_hash_arg(h, a) for a in arg)
+        arr = np.ascontiguousarray(arr)
+        h.update(f'{arr.dtype.str}{arr.shape}'.encode())
+        h.update(arr.tobytes())
+    else: return False
+    return True
+
+def _fit_key(func, args, kwargs):
+    h = hashlib.sha1(_source_hash.encode())
+    h.update(func.__qualname__.encode())
+    for arg in list(args) + sorted(kwargs.items()):
+        if not _hash_arg(h, arg): return None
+    return h.hexdigest()
 
-    fits = [data[f'{prefix}_{check}'] for check in check_measures for prefix in prefixes]
+def cached_fit(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _fit_cache is None: return func(*args, **kwargs)
+        key = _fit_key(func, args, kwargs)
+        if key is None: return func(*args, **kwargs)
+
+        result = _fit_cache.get(key)
+        disk_file = None if _fit_cache_dir is None else os.path.join(_fit_cache_dir, f'fit_{key}.npz')
+        if result is None and disk_file is not None and os.path.exists(disk_file):
+            try:
+                with np.load(disk_file) as f: result = tuple(f[k] for k in f.files)
+            except (OSError, KeyError, ValueError): result = None
+        if result is None:
+            fit_result = func(*args, **kwargs)
+            try: result = tuple(np.array(r, dtype=float) for r in fit_result)
+            except (TypeError, ValueError): return fit_result # e.g. a failed fit with None in pOpt
+            if disk_file is not None:
+                try: np.savez(disk_file, *result)
+                except OSError: pass
+        _fit_cache[key] = result
+        _fit_cache.move_to_end(key)
+        while len(_fit_cache) > _fit_cache_maxsize: _fit_cache.popitem(last=False)
+        return tuple(np.copy(r) for r in result)
+    return wrapper
+
+# ====================================================== #
+
+"""
+Compare candidate fits of the same experiment (e.g. to each of amps, avgi, avgq), all at once.
+
+fits: (n_candidates, ..., n_params), pCovs: (n_candidates, ..., n_params, n_params), ydata: (n_candidates, ..., n_pts)
+with any leading dims (e.g. qubits) in between. Returns a score (n_candidates, ...) where lower is better, and inf
+for a fit that failed (a zero, inf or nan variance on the diagonal of its pCov, or a nan score). The model is
+evaluated once on the whole stack, so fitfunc has to broadcast over params of shape (n_candidates, ..., 1).
+
+metric:
+    'r2': -R^2 of the fit to ydata (so 1 - R^2 up to an offset, comparable across quadratures with different scales)
+    'aic': n log(RSS/n) + 2k (Akaike information criterion)
+    'bic': n log(RSS/n) + k log(n) (Bayesian information criterion, penalizes extra params more for long traces)
+    'err': mean relative error sqrt(diag(pCov))/|fit|, does not need fitfunc or ydata
+AIC and BIC are in the units of ydata, so use them to compare models (or numbers of params) fit to the same data;
+use R^2 or err to compare fits to different quadratures.
+"""
+def compare_fits(fits, pCovs, xdata=None, ydata=None, fitfunc=None, metric='r2'):
+    fits = np.asarray(fits, dtype=float)
+    pCovs = np.asarray(pCovs, dtype=float)
+    var = np.diagonal(pCovs, axis1=-2, axis2=-1)
+    failed = np.any((var == 0) | ~np.isfinite(var), axis=-1)
+
+    if metric == 'err':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.mean(np.sqrt(np.abs(var)) / np.abs(fits), axis=-1)
+    else:
+        assert fitfunc is not None and ydata is not None, f'metric {metric} needs fitfunc and ydata'
+        xdata = np.asarray(xdata, dtype=float)
+        ydata = np.asarray(ydata, dtype=float)
+        n, k = ydata.shape[-1], fits.shape[-1]
+        yfit = fitfunc(xdata, *np.moveaxis(fits, -1, 0)[..., None])
+        ss_res = np.sum((yfit - ydata)**2, axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if metric == 'r2':
+                ss_tot = np.sum((ydata - np.mean(ydata, axis=-1, keepdims=True))**2, axis=-1)
+                score = ss_res / ss_tot - 1
+            elif metric == 'aic': score = n*np.log(ss_res/n) + 2*k
+            elif metric == 'bic': score = n*np.log(ss_res/n) + k*np.log(n)
+            else: assert False, f'Unknown metric {metric}'
+    score = np.where(failed | np.isnan(score), np.inf, score)
+    return score
+
+"""
+Compare the fits between the check_measures (amps, avgi, and avgq by default) in data, and return the fit, fit_err,
+and any other get_best_data_params corresponding to the best one.
+
+Candidates are data[f'{prefix}_{check}'] and data[f'{prefix}_err_{check}'] for every prefix and check. Fits can
+have leading dims (e.g. one fit per qubit), in which case the best candidate is picked separately for each, and the
+returned fit, fit_err, and params are stacked the same way.
+
+If fitfunc is specified, uses metric ('r2' by default, or 'aic', 'bic') of the fit to data[check] to determine the
+best fit, otherwise the average relative error of the fit params ('err'). fit_slice selects the points the fits
+were done on (e.g. slice(None, -1) if the last point was dropped). override: a f'{prefix}_err_{check}' key to use
+regardless. Failed fits (0 or inf variance) always lose.
+
+The name of the best check measure (or list of names for each leading index) is data['best_fit_axis'] after.
+"""
+def get_best_fit(data, fitfunc=None, prefixes=['fit'], check_measures=('amps', 'avgi', 'avgq'), get_best_data_params=(), override=None, metric=None, fit_slice=slice(None)):
+    candidates = [(prefix, check) for check in check_measures for prefix in prefixes]
+    all_check_measures = [f'{prefix}_err_{check}' for prefix, check in candidates]
+    fits = np.array([data[f'{prefix}_{check}'] for prefix, check in candidates], dtype=float)
+    fit_errs = np.array([data[f'{prefix}_err_{check}'] for prefix, check in candidates], dtype=float)
+    lead_shape = fits.shape[1:-1]
 
     if override is not None and override in all_check_measures:
-        i_best = np.argwhere(np.array(all_check_measures) == override)[0][0]
+        i_best = np.full(lead_shape, all_check_measures.index(override))
     else:
-        if fitfunc is not None:
-            ydata = [data[check] for check in all_check_measures]  # need to figure out how to make this support multiple qubits readout
-            xdata = data['xpts']
-
-            # residual sum of squares
-            ss_res_checks = np.array([np.sum((fitfunc(xdata, *fit_check) - ydata_check)**2) for fit_check, ydata_check in zip(fits, ydata)])
-            # total sum of squares
-            ss_tot_checks = np.array([np.sum((np.mean(ydata_check) - ydata_check)**2) for ydata_check in ydata])
-            # R^2 value
-            r2 = 1- ss_res_checks / ss_tot_checks
-
-            # override r2 value if fit is bad
-            for icheck, fit_err_check in enumerate(fit_errs):
-                for i, fit_err in enumerate(np.diag(fit_err_check)):
-                    if fit_err == np.inf: r2[icheck] = np.inf
-            i_best = np.argmin(r2)
-            
-        else:
-            # i_best = np.argmin([np.sqrt(np.abs(fit_err[compare_param_i][compare_param_i])) for fit, fit_err in zip(fits, fit_errs)])
-            # i_best = np.argmin([np.sqrt(np.abs(fit_err[compare_param_i][compare_param_i] / fit[compare_param_i])) for fit, fit_err in zip(fits, fit_errs)])
-            errs = [np.average(np.sqrt(np.abs(np.diag(fit_err))) / np.abs(fit)) for fit, fit_err in zip(fits, fit_errs)]
-            # print([np.sqrt(np.abs(np.diag(fit_err))) / np.abs(fit) for fit, fit_err in zip(fits, fit_errs)])
-            for i_err, err in enumerate(errs):
-                if err == np.nan: errs[i_err] = np.inf
-            # print(errs)
-            i_best = np.argmin(errs)
-            # print(i_best)
-    print(i_best)
-
-    best_data = [fits[i_best], fit_errs[i_best]]
+        if metric is None: metric = 'err' if fitfunc is None else 'r2'
+        xdata, ydata = None, None
+        if metric != 'err':
+            xdata = np.asarray(data['xpts'])[fit_slice]
+            ydata = np.array([np.asarray(data[check])[..., fit_slice] for prefix, check in candidates], dtype=float)
+        score = compare_fits(fits, fit_errs, xdata=xdata, ydata=ydata, fitfunc=fitfunc, metric=metric)
+        i_best = np.argmin(score, axis=0)
+
+    lead_inds = np.indices(lead_shape)
+    best_data = [fits[(i_best, *lead_inds)], fit_errs[(i_best, *lead_inds)]]
+    best_checks = np.array([check for prefix, check in candidates])[i_best]
+    data['best_fit_axis'] = best_checks.tolist()
 
     for param in get_best_data_params:
-        assert len(fit_errs) == len(check_measures), 'this is a pathological use of this function anyway, so just restrict to these cases'
-        # best_meas = all_check_measures[i_best]
-        best_meas = check_measures[i_best]
-        best_data.append(data[f'{param}_{best_meas}'])
+        params = np.array([data[f'{param}_{check}'] for prefix, check in candidates])
+        best_data.append(params[(i_best, *lead_inds)])
     return best_data
 
 # ====================================================== #
@@ -67,9 +188,52 @@ def expfunc(x, *p):
     y0, yscale, x0, decay = p
     return y0 + yscale*np.exp(-(x-x0)/decay)
 
-def fitexp(xdata, ydata, fitparams=None):
+def expfunc_jac(x, *p):
+    return expfunc_batch(np.asarray(x), np.array([p]))[1][0]
+
+"""
+Closed form exponential estimate, for when the offset is unknown (so log-linear least squares does not apply).
+Integrating y - y0 = yscale*exp(-(x-x0)/decay) from x[0] gives the linear relation
+    y(x) - y(x[0]) = -1/decay * int_x[0]^x y dx' + y0/decay * (x - x[0])
+so decay comes from a linear regression of y against the running (trapezoid) integral of y and x, which works for
+uneven spacing too. Given decay, y0 and yscale are a linear least squares with x0 held fixed (x0 and yscale are
+degenerate).
+"""
+def exp_closed_form(xdata, ydata, x0=None):
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+    if x0 is None: x0 = xdata[0]
+    integral = np.concatenate(([0], np.cumsum(np.diff(xdata)*(ydata[1:] + ydata[:-1])/2)))
+    A = np.stack([integral, xdata - xdata[0], np.ones_like(xdata)], axis=-1)
+    coeffs = np.linalg.lstsq(A, ydata, rcond=None)[0]
+    if not coeffs[0] < 0: return None # not decaying
+    decay = -1/coeffs[0]
+    A = np.stack([np.ones_like(xdata), np.exp(-(xdata-x0)/decay)], axis=-1)
+    y0, yscale = np.linalg.lstsq(A, ydata, rcond=None)[0]
+    return np.array([y0, yscale, x0, decay])
+
+"""
+fast=True starts from the closed form estimate and accepts it once one Gauss-Newton step would move y0, yscale, and
+decay by less than tol times their uncertainty, i.e. it is already at the least squares minimum to within the fit
+error. Otherwise it takes the step and checks again, up to n_steps times, before falling back to the nonlinear fit
+seeded with the latest estimate.
+"""
+@cached_fit
+def fitexp(xdata, ydata, fitparams=None, fast=False, tol=0.1, n_steps=2):
     if fitparams is None: fitparams = [None]*4
     else: fitparams = np.copy(fitparams)
+    if fast:
+        pOpt = exp_closed_form(xdata, ydata, x0=fitparams[2])
+        for _ in range(n_steps+1):
+            if pOpt is None or not np.all(np.isfinite(pOpt)) or not pOpt[3] > 0: break
+            pOpt, pCov = _fast_fit(expfunc, expfunc_jac, xdata, ydata, pOpt)
+            jac = expfunc_jac(np.asarray(xdata, dtype=float), *pOpt)[:, [0, 1, 3]] # x0 held fixed
+            resid = ydata - expfunc(np.asarray(xdata, dtype=float), *pOpt)
+            step = np.linalg.lstsq(jac, resid, rcond=None)[0]
+            if np.all(np.abs(step) <= tol*np.sqrt(np.diag(pCov)[[0, 1, 3]])): return pOpt, pCov
+            pOpt = np.copy(pOpt)
+            pOpt[[0, 1, 3]] += step
+        if pOpt is not None: fitparams = [p if fitparams[i] is None else fitparams[i] for i, p in enumerate(pOpt)]
     if fitparams[0] is None: fitparams[0] = ydata[-1]
     if fitparams[1] is None: fitparams[1] = ydata[0]-ydata[-1]
     if fitparams[2] is None: fitparams[2] = xdata[0]
@@ -77,7 +241,7 @@ def fitexp(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(expfunc, xdata, ydata, p0=fitparams)
+        pOpt, pCov = sp.optimize.curve_fit(expfunc, xdata, ydata, p0=fitparams, jac=expfunc_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
@@ -88,14 +252,27 @@ def logexpfunc(x, *p):
     decay = p
     return np.log(np.exp(-x/decay))
 
+def logexpfunc_jac(x, *p):
+    decay, = p
+    return (np.asarray(x)/decay**2)[:, None]
+
+"""
+The log model is linear in 1/decay, so the least squares fit is closed form: slope = sum(x y)/sum(x^2), decay =
+-1/slope, with the same pCov curve_fit would give. Falls back to curve_fit only if the data is not decaying.
+"""
+@cached_fit
 def fitlogexp(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*1
     else: fitparams = np.copy(fitparams)
+    xdata = np.asarray(xdata, dtype=float)
+    slope = np.sum(xdata*ydata)/np.sum(xdata**2)
+    if slope < 0 and np.isfinite(slope):
+        return _fast_fit(logexpfunc, logexpfunc_jac, xdata, ydata, [-1/slope])
     if fitparams[0] is None: fitparams[0] = (xdata[-1]-xdata[0])/5
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(logexpfunc, xdata, ydata, p0=fitparams)
+        pOpt, pCov = sp.optimize.curve_fit(logexpfunc, xdata, ydata, p0=fitparams, jac=logexpfunc_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
@@ -110,6 +287,13 @@ def qp_expfunc(x, *p):
     nqp, t1qp, t1r = p
     return nqp*(np.exp(-x/t1qp) - 1) - x/t1r
 
+def qp_expfunc_jac(x, *p):
+    nqp, t1qp, t1r = p
+    x = np.asarray(x)
+    exp = np.exp(-x/t1qp)
+    return np.stack([exp - 1, nqp*exp*x/t1qp**2, x/t1r**2], axis=-1)
+
+@cached_fit
 def fitqpexp(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*3
     else: fitparams = np.copy(fitparams)
@@ -127,7 +311,7 @@ def fitqpexp(xdata, ydata, fitparams=None):
             fitparams[i] = np.mean((bounds[0][i], bounds[1][i]))
             print(f'Attempted to init fitparam {i} to {param}, which is out of bounds {bounds[0][i]} to {bounds[1][i]}. Instead init to {fitparams[i]}')
     try:
-        pOpt, pCov = sp.optimize.curve_fit(qp_expfunc, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(qp_expfunc, xdata, ydata, p0=fitparams, bounds=bounds, jac=qp_expfunc_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
@@ -140,17 +324,21 @@ def lorfunc(x, *p):
     y0, yscale, x0, xscale = p
     return y0 + yscale/(1+(x-x0)**2/xscale**2)
 
+def lorfunc_jac(x, *p):
+    return lorfunc_batch(np.asarray(x), np.array([p]))[1][0]
+
+@cached_fit
 def fitlor(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*4
     else: fitparams = np.copy(fitparams)
     if fitparams[0] is None: fitparams[0] = (ydata[0] + ydata[-1])/2
-    if fitparams[1] is None: fitparams[1] = max(ydata) - min(ydata)
+    if fitparams[1] is None: fitparams[1] = np.max(ydata) - np.min(ydata)
     if fitparams[2] is None: fitparams[2] = xdata[np.argmax(abs(ydata - fitparams[0]))]
-    if fitparams[3] is None: fitparams[3] = (max(xdata)-min(xdata))/10
+    if fitparams[3] is None: fitparams[3] = (np.max(xdata)-np.min(xdata))/10
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(lorfunc, xdata, ydata, p0=fitparams)
+        pOpt, pCov = sp.optimize.curve_fit(lorfunc, xdata, ydata, p0=fitparams, jac=lorfunc_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
@@ -163,6 +351,10 @@ def sinfunc(x, *p):
     yscale, freq, phase_deg, y0 = p
     return yscale*np.sin(2*np.pi*freq*x + phase_deg*np.pi/180) + y0
 
+def sinfunc_jac(x, *p):
+    return sinfunc_batch(np.asarray(x), np.array([p]))[1][0]
+
+@cached_fit
 def fitsin(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*4
     else: fitparams = np.copy(fitparams)
@@ -172,13 +364,13 @@ def fitsin(xdata, ydata, fitparams=None):
     max_ind = np.argmax(np.abs(fourier[1:])) + 1
     max_freq = np.abs(fft_freqs[max_ind])
     max_phase = fft_phases[max_ind]
-    if fitparams[0] is None: fitparams[0]=max(ydata)-min(ydata)
+    if fitparams[0] is None: fitparams[0]=np.max(ydata)-np.min(ydata)
     if fitparams[1] is None: fitparams[1]=max_freq
     if fitparams[2] is None: fitparams[2]=max_phase*180/np.pi
     if fitparams[3] is None: fitparams[3]=np.mean(ydata)
     bounds = (
-        [0.5*fitparams[0], 0.2/(max(xdata)-min(xdata)), -360, np.min(ydata)],
-        [2*fitparams[0], 5/(max(xdata)-min(xdata)), 360, np.max(ydata)]
+        [0.5*fitparams[0], 0.2/(np.max(xdata)-np.min(xdata)), -360, np.min(ydata)],
+        [2*fitparams[0], 5/(np.max(xdata)-np.min(xdata)), 360, np.max(ydata)]
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
@@ -187,7 +379,7 @@ def fitsin(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(sinfunc, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(sinfunc, xdata, ydata, p0=fitparams, bounds=bounds, jac=sinfunc_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
@@ -196,31 +388,107 @@ def fitsin(xdata, ydata, fitparams=None):
 
 # ====================================================== #
 
+"""
+Matrix pencil (ESPRIT) estimate of a sum of damped sinusoids plus an offset,
+    y = y0 + sum_k yscale_k * sin(2*pi*freq_k*x + phase_deg_k*pi/180) * exp(-x/decay_k)
+without any iterative fitting. Each real sinusoid is a pair of complex exponentials z^n, so the data has 2*n_sin+1
+exponentials including the offset. Their z are the eigenvalues of the shift operator on the signal subspace of the
+Hankel matrix of ydata; given the freqs and decays, the amplitudes, phases, and offset are a linear least squares.
+
+Used to seed the decaysin, twofreq, and threefreq fits (much better than the fft peak, which can only resolve
+freq to 1/span and says nothing about decay), or directly as the result with fast=True.
+"""
+
+def _damped_sin_basis(xdata, freqs, decay_rates):
+    # columns: 1, then exp(-rate*x)*sin(2 pi f x), exp(-rate*x)*cos(2 pi f x) for each component
+    cols = [np.ones_like(xdata)]
+    for freq, rate in zip(freqs, decay_rates):
+        env = np.exp(-rate*xdata)
+        cols += [env*np.sin(2*np.pi*freq*xdata), env*np.cos(2*np.pi*freq*xdata)]
+    return np.stack(cols, axis=-1)
+
+def matrix_pencil(xdata, ydata, n_sin=1, freq=None):
+    """
+    xdata must be evenly spaced. Returns (components, y0) where components is a list of n_sin
+    [yscale, freq, phase_deg, decay], sorted by decreasing yscale, or with the component closest to freq first if
+    freq is specified. A component that does not decay gets decay = np.inf. If fewer than n_sin oscillating
+    components are found, the rest are padded with yscale = 0.
+    """
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.asarray(ydata, dtype=float)
+    dx = xdata[1] - xdata[0]
+    order = 2*n_sin + 1
+    pencil = max(len(ydata)//3, order) # L ~ N/3 is the usual compromise between noise and resolution
+    hankel = np.lib.stride_tricks.sliding_window_view(ydata, pencil+1)
+    _, _, Vh = np.linalg.svd(hankel, full_matrices=False)
+    V = Vh[:order].T # signal subspace
+    z = np.linalg.eigvals(np.linalg.pinv(V[:-1]) @ V[1:])
+    rates = -np.log(np.abs(z))/dx
+    freqs = np.angle(z)/(2*np.pi*dx)
+
+    # keep one of each conjugate pair, drop the offset (z ~ 1) and other non-oscillating poles
+    keep = freqs > 1/(4*len(ydata)*dx)
+    freqs, rates = freqs[keep], rates[keep]
+    rates = np.maximum(rates, -1/(xdata[-1] - xdata[0])) # don't let noise blow up the basis
+
+    coeffs = np.linalg.lstsq(_damped_sin_basis(xdata, freqs, rates), ydata, rcond=None)[0]
+    yscales = np.hypot(coeffs[1::2], coeffs[2::2])
+    if freq is not None:
+        order_inds = np.argsort(np.abs(freqs - freq))
+    else: order_inds = np.argsort(-yscales)
+    order_inds = order_inds[:n_sin]
+    freqs, rates = freqs[order_inds], rates[order_inds]
+
+    # redo the amplitudes with only the kept components
+    coeffs = np.linalg.lstsq(_damped_sin_basis(xdata, freqs, rates), ydata, rcond=None)[0]
+    components = []
+    for i, (f, rate) in enumerate(zip(freqs, rates)):
+        a_sin, a_cos = coeffs[1+2*i], coeffs[2+2*i]
+        decay = 1/rate if rate > 0 else np.inf
+        components.append([np.hypot(a_sin, a_cos), f, np.arctan2(a_cos, a_sin)*180/np.pi, decay])
+    while len(components) < n_sin:
+        components.append([0, 0, 0, np.inf])
+    return components, coeffs[0]
+
+def _fast_fit(func, func_jac, xdata, ydata, pOpt):
+    """
+    Use pOpt as the fit result: pCov is the curve_fit covariance linearized around pOpt
+    """
+    xdata = np.asarray(xdata, dtype=float)
+    pOpt = np.array(pOpt, dtype=float)
+    cost = np.sum((func(xdata, *pOpt) - ydata)**2)
+    pCov = _batch_pcov(func_jac(xdata, *pOpt)[None], np.array([cost]))[0]
+    return pOpt, pCov
+
+# ====================================================== #
+
 def decaysin(x, *p):
     yscale, freq, phase_deg, decay, y0 = p
     return yscale * np.sin(2*np.pi*freq*x + phase_deg*np.pi/180) * np.exp(-x/decay) + y0
 
-def fitdecaysin(xdata, ydata, fitparams=None):
+def decaysin_jac(x, *p):
+    return decaysin_batch(np.asarray(x), np.array([p]))[1][0]
+
+"""
+fast=True skips the nonlinear fit and returns the matrix pencil estimate directly (with the component closest to
+fitparams[1] if specified, otherwise the largest), with pCov linearized around it.
+"""
+@cached_fit
+def fitdecaysin(xdata, ydata, fitparams=None, fast=False):
     if fitparams is None: fitparams = [None]*5
     else: fitparams = np.copy(fitparams)
-    fourier = np.fft.fft(ydata)
-    fft_freqs = np.fft.fftfreq(len(ydata), d=xdata[1]-xdata[0])
-    fft_phases = np.angle(fourier)
-    sorted_fourier = np.sort(fourier)
-    max_ind = np.argwhere(fourier == sorted_fourier[-1])[0][0]
-    if max_ind == 0:
-        max_ind = np.argwhere(fourier == sorted_fourier[-2])[0][0]
-    max_freq = np.abs(fft_freqs[max_ind])
-    max_phase = fft_phases[max_ind]
-    if fitparams[0] is None: fitparams[0]=(max(ydata)-min(ydata))/2
-    if fitparams[1] is None: fitparams[1]=max_freq
-    # if fitparams[2] is None: fitparams[2]=0
-    if fitparams[2] is None: fitparams[2]=max_phase*180/np.pi
-    if fitparams[3] is None: fitparams[3]=max(xdata) - min(xdata)
-    if fitparams[4] is None: fitparams[4]=np.mean(ydata)
+    span = np.max(xdata) - np.min(xdata)
+    [[yscale, freq, phase_deg, decay]], y0 = matrix_pencil(xdata, ydata, n_sin=1, freq=fitparams[1])
+    if fast: return _fast_fit(decaysin, decaysin_jac, xdata, ydata, [yscale, freq, phase_deg, decay, y0])
+    if not yscale > 0: yscale = (np.max(ydata)-np.min(ydata))/2
+    if fitparams[0] is None: fitparams[0]=yscale
+    if fitparams[1] is None: fitparams[1]=freq
+    if fitparams[2] is None: fitparams[2]=phase_deg
+    if fitparams[3] is None: fitparams[3]=np.clip(decay, 0.31*span, 100*span) # keep inside the bounds below
+    if fitparams[4] is None: fitparams[4]=y0
     bounds = (
-        [0.75*fitparams[0], 0.1/(max(xdata)-min(xdata)), -360, 0.3*(max(xdata)-min(xdata)), np.min(ydata)],
-        [1.25*fitparams[0], 30/(max(xdata)-min(xdata)), 360, np.inf, np.max(ydata)]
+        [0.75*fitparams[0], 0.1/(np.max(xdata)-np.min(xdata)), -360, 0.3*(np.max(xdata)-np.min(xdata)), np.min(ydata)],
+        [1.25*fitparams[0], 30/(np.max(xdata)-np.min(xdata)), 360, np.inf, np.max(ydata)]
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
@@ -229,58 +497,156 @@ def fitdecaysin(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(decaysin, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(decaysin, xdata, ydata, p0=fitparams, bounds=bounds, jac=decaysin_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
         # return 0, 0
     return pOpt, pCov
 
+# ====================================================== #
+"""
+Multi-start fitting for the many parameter models (twofreq, threefreq), where a single local fit from one guess
+often gets stuck. The starts are the usual initial guess plus a Latin hypercube of n_starts-1 points inside the fit
+bounds (infinite bounds are replaced by the guess +- 10x its magnitude for sampling), each fit with curve_fit in a
+process pool of workers (None: one per cpu, 1: no pool).
+
+Returns the fit with the lowest chi^2, its pCov, and the spread (std of each param) over all starts that got
+within chi2_tol (relative) of the best chi^2: a large spread means several different solutions fit equally well.
+"""
+
+def latin_hypercube(n_samples, lower, upper, rng=None):
+    """
+    (n_samples, n_params) samples with exactly one sample in each of n_samples equal slices of each param's range
+    """
+    rng = np.random.default_rng(rng)
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    slices = np.argsort(rng.random((n_samples, len(lower))), axis=0) # a random permutation of the slices per param
+    u = (slices + rng.random((n_samples, len(lower))))/n_samples
+    return lower + u*(upper - lower)
+
+def _multistart_worker(args):
+    func, func_jac, xdata, ydata, p0, bounds = args
+    try:
+        pOpt, pCov = sp.optimize.curve_fit(func, xdata, ydata, p0=p0, bounds=bounds, jac=func_jac)
+    except (RuntimeError, ValueError):
+        return p0, np.full((len(p0), len(p0)), np.inf), np.inf
+    return pOpt, pCov, np.sum((func(xdata, *pOpt) - ydata)**2)
+
+def multistart_fit(func, func_jac, xdata, ydata, fitparams, bounds, n_starts=16, workers=None, chi2_tol=0.01, rng=None):
+    fitparams = np.asarray(fitparams, dtype=float)
+    lower, upper = np.asarray(bounds[0], dtype=float), np.asarray(bounds[1], dtype=float)
+    scale = 10*np.maximum(np.abs(fitparams), 1e-3)
+    lower_sample = np.where(np.isfinite(lower), lower, fitparams - scale)
+    upper_sample = np.where(np.isfinite(upper), upper, fitparams + scale)
+    starts = np.concatenate(([fitparams], latin_hypercube(n_starts-1, lower_sample, upper_sample, rng=rng)))
+    jobs = [(func, func_jac, xdata, ydata, p0, bounds) for p0 in starts]
+
+    if workers == 1: results = list(map(_multistart_worker, jobs))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        workers = os.cpu_count() if workers is None else workers
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_multistart_worker, jobs, chunksize=max(1, n_starts//(4*workers))))
+
+    pOpts = np.array([r[0] for r in results])
+    chi2 = np.array([r[2] for r in results])
+    best = np.argmin(chi2)
+    if not np.isfinite(chi2[best]):
+        print('Warning: fit failed!')
+        return fitparams, np.full((len(fitparams), len(fitparams)), np.inf), np.full(len(fitparams), np.inf)
+    good = chi2 <= chi2[best]*(1 + chi2_tol)
+    print(f'{np.sum(good)}/{n_starts} starts reached the best chi^2')
+    return pOpts[best], results[best][1], np.std(pOpts[good], axis=0)
+
 # ====================================================== #
 
 def twofreq_decaysin(x, *p):
     yscale0, freq0, phase_deg0, decay0, yscale1, freq1, phase_deg1, y0 = p
     return y0 + np.exp(-x/decay0) * yscale0 * ((1-yscale1)*np.sin(2*np.pi*freq0*x + phase_deg0*np.pi/180) + yscale1 * np.sin(2*np.pi*freq1*x + phase_deg1*np.pi/180))
 
-def fittwofreq_decaysin(xdata, ydata, fitparams=None):
-    if fitparams is None: fitparams = [None]*10
+def twofreq_decaysin_jac(x, *p):
+    yscale0, freq0, phase_deg0, decay0, yscale1, freq1, phase_deg1, y0 = p
+    x = np.asarray(x)
+    theta0 = 2*np.pi*freq0*x + phase_deg0*np.pi/180
+    theta1 = 2*np.pi*freq1*x + phase_deg1*np.pi/180
+    env = np.exp(-x/decay0)
+    osc = (1-yscale1)*np.sin(theta0) + yscale1*np.sin(theta1)
+    cos0 = env*yscale0*(1-yscale1)*np.cos(theta0)
+    cos1 = env*yscale0*yscale1*np.cos(theta1)
+    return np.stack([
+        env*osc,
+        cos0*2*np.pi*x,
+        cos0*np.pi/180,
+        yscale0*env*osc*x/decay0**2,
+        env*yscale0*(np.sin(theta1) - np.sin(theta0)),
+        cos1*2*np.pi*x,
+        cos1*np.pi/180,
+        np.ones_like(env),
+        ], axis=-1)
+
+def _twofreq_decaysin_init(xdata, ydata, fitparams=None, fast=False):
+    """
+    Initial guess and bounds for fittwofreq_decaysin, plus the matrix pencil estimate itself (only the estimate if fast)
+    """
+    if fitparams is None: fitparams = [None]*8
     else: fitparams = np.copy(fitparams)
-    fourier = np.fft.fft(ydata)
-    fft_freqs = np.fft.fftfreq(len(ydata), d=xdata[1]-xdata[0])
-    fft_phases = np.angle(fourier)
-    sorted_fourier = np.sort(fourier)
-    max_ind = np.argwhere(fourier == sorted_fourier[-1])[0][0]
-    if max_ind == 0:
-        max_ind = np.argwhere(fourier == sorted_fourier[-2])[0][0]
-    max_freq = np.abs(fft_freqs[max_ind])
-    max_phase = fft_phases[max_ind]
-    if fitparams[0] is None: fitparams[0]=(max(ydata)-min(ydata)) # yscale0
-    if fitparams[1] is None: fitparams[1]=max_freq # freq0
-    # if fitparams[2] is None: fitparams[2]=0
-    if fitparams[2] is None: fitparams[2]=max_phase*180/np.pi # phase_deg0
-    if fitparams[3] is None: fitparams[3]=max(xdata) - min(xdata) # exp decay
-    if fitparams[4] is None: fitparams[4]=0.1 # yscale1
-    if fitparams[5] is None: fitparams[5]=0.5 # MHz
-    if fitparams[6] is None: fitparams[6]=0 # phase_deg1
-    if fitparams[7] is None: fitparams[7]=np.mean(ydata) # y0
+    span = np.max(xdata) - np.min(xdata)
+    # main oscillation is the one closest to the specified freq0 (or the largest), the other one is freq1
+    [[yscale_a, freq_a, phase_a, decay_a], [yscale_b, freq_b, phase_b, _]], y0 = matrix_pencil(xdata, ydata, n_sin=2, freq=fitparams[1])
+    yscale = yscale_a + yscale_b
+    if not yscale > 0: yscale = (np.max(ydata)-np.min(ydata))/2
+    yscale1 = yscale_b/yscale if yscale_b > 0 else 0.1
+    freq1 = freq_b if yscale_b > 0 else 0.5 # MHz
+    estimate = [yscale, freq_a, phase_a, decay_a, yscale1, freq1, phase_b, y0]
+    if fast: return None, None, estimate
+    if fitparams[0] is None: fitparams[0]=yscale # yscale0
+    if fitparams[1] is None: fitparams[1]=freq_a # freq0
+    if fitparams[2] is None: fitparams[2]=phase_a # phase_deg0
+    if fitparams[3] is None: fitparams[3]=np.clip(decay_a, 0.11*span, 100*span) # exp decay
+    if fitparams[4] is None: fitparams[4]=yscale1 # yscale1
+    if fitparams[5] is None: fitparams[5]=freq1 # MHz
+    if fitparams[6] is None: fitparams[6]=phase_b # phase_deg1
+    if fitparams[7] is None: fitparams[7]=y0 # y0
     bounds = (
-        [0.75*fitparams[0], 0.1/(max(xdata)-min(xdata)), -360, 0.1*(max(xdata)-min(xdata)), 0.001, 0.01, -360, np.min(ydata)],
-        [1.25*fitparams[0], 30/(max(xdata)-min(xdata)), 360, np.inf, 0.5, 10, 360, np.max(ydata)]
+        [0.75*fitparams[0], 0.1/(np.max(xdata)-np.min(xdata)), -360, 0.1*(np.max(xdata)-np.min(xdata)), 0.001, 0.01, -360, np.min(ydata)],
+        [1.25*fitparams[0], 30/(np.max(xdata)-np.min(xdata)), 360, np.inf, 0.5, 10, 360, np.max(ydata)]
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
             fitparams[i] = np.mean((bounds[0][i], bounds[1][i]))
             print(f'Attempted to init fitparam {i} to {param}, which is out of bounds {bounds[0][i]} to {bounds[1][i]}. Instead init to {fitparams[i]}')
+    return fitparams, bounds, estimate
+
+"""
+fast=True skips the nonlinear fit and returns the matrix pencil estimate directly, with pCov linearized around it.
+n_starts > 0: multi-start fit (see multistart_fit) with n_starts starts on workers processes; use
+fittwofreq_decaysin_multistart to also get the spread of the solutions. fast and n_starts > 0 can't be combined.
+"""
+@cached_fit
+def fittwofreq_decaysin(xdata, ydata, fitparams=None, fast=False, n_starts=0, workers=None):
+    assert not (fast and n_starts > 0), 'fast and n_starts > 0 are mutually exclusive'
+    if n_starts > 0: return fittwofreq_decaysin_multistart(xdata, ydata, fitparams=fitparams, n_starts=n_starts, workers=workers)[:2]
+    fitparams, bounds, estimate = _twofreq_decaysin_init(xdata, ydata, fitparams, fast=fast)
+    if fast: return _fast_fit(twofreq_decaysin, twofreq_decaysin_jac, xdata, ydata, estimate)
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(twofreq_decaysin, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(twofreq_decaysin, xdata, ydata, p0=fitparams, bounds=bounds, jac=twofreq_decaysin_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
         # return 0, 0
     return pOpt, pCov
 
+"""
+Multi-start fittwofreq_decaysin (see multistart_fit), returns pOpt, pCov, spread
+"""
+@cached_fit
+def fittwofreq_decaysin_multistart(xdata, ydata, fitparams=None, n_starts=16, workers=None):
+    fitparams, bounds, _ = _twofreq_decaysin_init(xdata, ydata, fitparams)
+    return multistart_fit(twofreq_decaysin, twofreq_decaysin_jac, xdata, ydata, fitparams, bounds, n_starts=n_starts, workers=workers)
+
 
 def threefreq_decaysin(x, *p):
     yscale0, freq0, phase_deg0, decay0, y00, x00, yscale1, freq1, phase_deg1, y01, yscale2, freq2, phase_deg2, y02 = p
@@ -289,23 +655,35 @@ def threefreq_decaysin(x, *p):
     p2 = [yscale2, freq2, phase_deg2, y02]
     return y00 + decaysin(x, *p0) * sinfunc(x, *p1) * sinfunc(x, *p2)
 
-def fitthreefreq_decaysin(xdata, ydata, fitparams=None):
+def threefreq_decaysin_jac(x, *p):
+    yscale0, freq0, phase_deg0, decay0, y00, x00, yscale1, freq1, phase_deg1, y01, yscale2, freq2, phase_deg2, y02 = p
+    x = np.asarray(x)
+    dsin0 = decaysin_jac(x, yscale0, freq0, phase_deg0, decay0, 0)[:, :4]
+    sin0 = decaysin(x, yscale0, freq0, phase_deg0, decay0, 0)
+    dsin1, sin1 = sinfunc_jac(x, yscale1, freq1, phase_deg1, y01), sinfunc(x, yscale1, freq1, phase_deg1, y01)
+    dsin2, sin2 = sinfunc_jac(x, yscale2, freq2, phase_deg2, y02), sinfunc(x, yscale2, freq2, phase_deg2, y02)
+    return np.concatenate([
+        dsin0 * (sin1*sin2)[:, None],
+        np.ones((len(x), 1)), # y00
+        np.zeros((len(x), 1)), # x00 does not enter the model
+        dsin1 * (sin0*sin2)[:, None],
+        dsin2 * (sin0*sin1)[:, None],
+        ], axis=-1)
+
+def _threefreq_decaysin_init(xdata, ydata, fitparams=None):
+    """
+    Initial guess and bounds for fitthreefreq_decaysin
+    """
     if fitparams is None: fitparams = [None]*14
     else: fitparams = np.copy(fitparams)
-    fourier = np.fft.fft(ydata)
-    fft_freqs = np.fft.fftfreq(len(ydata), d=xdata[1]-xdata[0])
-    fft_phases = np.angle(fourier)
-    sorted_fourier = np.sort(fourier)
-    max_ind = np.argwhere(fourier == sorted_fourier[-1])[0][0]
-    if max_ind == 0:
-        max_ind = np.argwhere(fourier == sorted_fourier[-2])[0][0]
-    max_freq = np.abs(fft_freqs[max_ind])
-    max_phase = fft_phases[max_ind]
-    if fitparams[0] is None: fitparams[0]=max(ydata)-min(ydata)
+    span = np.max(xdata) - np.min(xdata)
+    # the model is a product of sines, so the pencil components are mixing products: only use the strongest one
+    # (or the one closest to the specified freq0) for the main oscillation
+    [[_, max_freq, max_phase, max_decay], _, _], _ = matrix_pencil(xdata, ydata, n_sin=3, freq=fitparams[1])
+    if fitparams[0] is None: fitparams[0]=np.max(ydata)-np.min(ydata)
     if fitparams[1] is None: fitparams[1]=max_freq
-    # if fitparams[2] is None: fitparams[2]=0
-    if fitparams[2] is None: fitparams[2]=max_phase*180/np.pi
-    if fitparams[3] is None: fitparams[3]=max(xdata) - min(xdata)
+    if fitparams[2] is None: fitparams[2]=max_phase
+    if fitparams[3] is None: fitparams[3]=np.clip(max_decay, 0.31*span, 100*span)
     if fitparams[4] is None: fitparams[4]=np.mean(ydata) #
     if fitparams[5] is None: fitparams[5]=xdata[0] # x0 (exp decay)
     if fitparams[6] is None: fitparams[6]=1 # y scale
@@ -317,23 +695,41 @@ def fitthreefreq_decaysin(xdata, ydata, fitparams=None):
     if fitparams[12] is None: fitparams[12]=0 # phase degrees
     if fitparams[13] is None: fitparams[13]=0 # y0
     bounds = (
-        [0.75*fitparams[0], 0.1/(max(xdata)-min(xdata)), -360, 0.3*(max(xdata)-min(xdata)), np.min(ydata), xdata[0]-(xdata[-1]-xdata[0]), 0.5, 0.01, -360, -0.1, 0.5, 0.01, -360, -0.1],
-        [1.25*fitparams[0], 15/(max(xdata)-min(xdata)), 360, np.inf, np.max(ydata), xdata[-1]+(xdata[-1]-xdata[0]), 1.5, 10, 360, 0.1, 1.5, 10, 360, 0.1]
+        [0.75*fitparams[0], 0.1/(np.max(xdata)-np.min(xdata)), -360, 0.3*(np.max(xdata)-np.min(xdata)), np.min(ydata), xdata[0]-(xdata[-1]-xdata[0]), 0.5, 0.01, -360, -0.1, 0.5, 0.01, -360, -0.1],
+        [1.25*fitparams[0], 15/(np.max(xdata)-np.min(xdata)), 360, np.inf, np.max(ydata), xdata[-1]+(xdata[-1]-xdata[0]), 1.5, 10, 360, 0.1, 1.5, 10, 360, 0.1]
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
             fitparams[i] = np.mean((bounds[0][i], bounds[1][i]))
             print(f'Attempted to init fitparam {i} to {param}, which is out of bounds {bounds[0][i]} to {bounds[1][i]}. Instead init to {fitparams[i]}')
+    return fitparams, bounds
+
+"""
+n_starts > 0: multi-start fit (see multistart_fit) with n_starts starts on workers processes; use
+fitthreefreq_decaysin_multistart to also get the spread of the solutions
+"""
+@cached_fit
+def fitthreefreq_decaysin(xdata, ydata, fitparams=None, n_starts=0, workers=None):
+    if n_starts > 0: return fitthreefreq_decaysin_multistart(xdata, ydata, fitparams=fitparams, n_starts=n_starts, workers=workers)[:2]
+    fitparams, bounds = _threefreq_decaysin_init(xdata, ydata, fitparams)
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(threefreq_decaysin, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(threefreq_decaysin, xdata, ydata, p0=fitparams, bounds=bounds, jac=threefreq_decaysin_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
         # return 0, 0
     return pOpt, pCov
 
+"""
+Multi-start fitthreefreq_decaysin (see multistart_fit), returns pOpt, pCov, spread
+"""
+@cached_fit
+def fitthreefreq_decaysin_multistart(xdata, ydata, fitparams=None, n_starts=16, workers=None):
+    fitparams, bounds = _threefreq_decaysin_init(xdata, ydata, fitparams)
+    return multistart_fit(threefreq_decaysin, threefreq_decaysin_jac, xdata, ydata, fitparams, bounds, n_starts=n_starts, workers=workers)
+
 # ====================================================== #
     
 def hangerfunc(x, *p):
@@ -353,6 +749,30 @@ def hangerS21func_sloped(x, *p):
 def hangerphasefunc(x, *p):
     return np.angle(hangerfunc(x, *p))
 
+def hangerS21func_sloped_jac(x, *p):
+    f0, Qi, Qe, phi, scale, a0, slope = p
+    x = np.asarray(x)
+    Q0 = 1 / (1/Qi + np.real(1/Qe))
+    g = Q0/Qe
+    u = 1 + 2j*Q0*(x-f0)/f0
+    h = scale * (1 - g*np.exp(1j*phi)/u)
+    # d|h| = Re(conj(h) dh)/|h|
+    dabs = lambda dh: np.real(np.conj(h)*dh)/np.abs(h)
+    dQ0_dQi, dQ0_dQe = Q0**2/Qi**2, Q0**2/Qe**2
+    dg_dQi, dg_dQe = dQ0_dQi/Qe, dQ0_dQe/Qe - Q0/Qe**2
+    du_dQ0 = 2j*(x-f0)/f0
+    dh = lambda dg, du: -scale*np.exp(1j*phi) * (dg/u - g*du/u**2)
+    return np.stack([
+        dabs(dh(0, -2j*Q0*x/f0**2)) - slope,
+        dabs(dh(dg_dQi, du_dQ0*dQ0_dQi)) + scale*dg_dQi,
+        dabs(dh(dg_dQe, du_dQ0*dQ0_dQe)) + scale*dg_dQe,
+        dabs(-1j*scale*g*np.exp(1j*phi)/u),
+        dabs(h/scale) - (1-g),
+        np.ones_like(x, dtype=float),
+        x - f0,
+        ], axis=-1)
+
+@cached_fit
 def fithanger(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*7
     else: fitparams = np.copy(fitparams)
@@ -360,7 +780,7 @@ def fithanger(xdata, ydata, fitparams=None):
     if fitparams[1] is None: fitparams[1]=5000
     if fitparams[2] is None: fitparams[2]=1000
     if fitparams[3] is None: fitparams[3]=0
-    if fitparams[4] is None: fitparams[4]=max(ydata)-min(ydata)
+    if fitparams[4] is None: fitparams[4]=np.max(ydata)-np.min(ydata)
     if fitparams[5] is None: fitparams[5]=np.average(ydata)
     if fitparams[6] is None: fitparams[6]=(ydata[-1] - ydata[0]) / (xdata[-1] - xdata[0])
 
@@ -371,8 +791,8 @@ def fithanger(xdata, ydata, fitparams=None):
     #     [np.max(xdata), 1e9, 1e9, 2*np.pi, (max(np.abs(ydata))-min(np.abs(ydata)))*10, np.max(np.abs(ydata))]
     #     )
     bounds = (
-        [np.min(xdata), 0, 0, -np.inf, 0, min(ydata), -np.inf],
-        [np.max(xdata), np.inf, np.inf, np.inf, np.inf, max(ydata), np.inf],
+        [np.min(xdata), 0, 0, -np.inf, 0, np.min(ydata), -np.inf],
+        [np.max(xdata), np.inf, np.inf, np.inf, np.inf, np.max(ydata), np.inf],
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
@@ -382,7 +802,7 @@ def fithanger(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(hangerS21func_sloped, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(hangerS21func_sloped, xdata, ydata, p0=fitparams, bounds=bounds, jac=hangerS21func_sloped_jac)
         print(pOpt)
         # return pOpt, pCov
     except RuntimeError: 
@@ -390,11 +810,127 @@ def fithanger(xdata, ydata, fitparams=None):
         # return 0, 0
     return pOpt, pCov
 
+"""
+Complex plane (circle) fit for hanger resonators, non-iterative, following Probst et al., Rev. Sci. Instrum. 86,
+024706 (2015):
+    1. remove the electrical delay: the phase slope that makes S21 closest to a circle, found by a short grid search
+       (the only non-closed-form step, but it is a handful of vectorized circle fits)
+    2. algebraic (Pratt) circle fit of S21 in the IQ plane -> center zc, radius r
+    3. off resonant point P: S21(f) is a linear fractional function of f, so S21*(C + f) = A + B*f is linear in
+       A, B, C, and P = B = S21(f -> inf)
+    4. phase vs frequency around the circle center: theta(f) = theta0 + 2*arctan(2*Ql*(1 - f/f0)) where theta0 points
+       from P through zc, i.e. tan((theta - theta0)/2) is linear in f -> f0, Ql
+    5. |Qc| = Ql*|P|/(2r) from the circle diameter, impedance mismatch angle phi from the circle rotation about P,
+       1/Qi = 1/Ql - cos(phi)/|Qc|
+Returns pOpt = [f0, Qi, Qe, phi, scale, a0, slope] in the hangerS21func_sloped convention, so it can be plotted the
+same way as fithanger: Qe = |Qc|/cos(phi) (i.e. 1/Qe = Re(1/Qc)), scale = |P|, and a0, slope set so that
+hangerS21func_sloped is |S21| of the fitted resonance. pCov is linearized around pOpt on |S21|.
+
+zdata is the complex S21, e.g. avgi + 1j*avgq. The batch version takes zdata of shape (n_traces, n_points).
+"""
+
+def circle_fit(zdata):
+    """
+    Pratt algebraic circle fit on the last axis of zdata. Returns center zc and radius r (arrays over the leading axes).
+    """
+    zdata = np.asarray(zdata)
+    # center and scale for conditioning
+    z_mean = np.mean(zdata, axis=-1, keepdims=True)
+    z_scale = np.sqrt(np.mean(np.abs(zdata - z_mean)**2, axis=-1, keepdims=True))
+    z_scale = np.where(z_scale > 0, z_scale, 1)
+    zn = (zdata - z_mean)/z_scale
+    x, y = zn.real, zn.imag
+    v = np.stack([x**2 + y**2, x, y, np.ones_like(x)], axis=-1)
+    M = np.einsum('...ni,...nj->...ij', v, v)/x.shape[-1]
+    # circle a*(x^2+y^2) + b*x + c*y + d = 0 with constraint b^2 + c^2 - 4ad = 1
+    B_inv = np.linalg.inv(np.array([[0, 0, 0, -2], [0, 1, 0, 0], [0, 0, 1, 0], [-2, 0, 0, 0]], dtype=float))
+    eta, vecs = np.linalg.eig(B_inv @ M)
+    eta = np.where((np.abs(eta.imag) < 1e-9) & (eta.real > -1e-12), eta.real, np.inf)
+    a, b, c, d = np.moveaxis(np.take_along_axis(vecs.real, np.argmin(eta, axis=-1)[..., None, None], axis=-1)[..., 0], -1, 0)
+    zc = (-b/(2*a) - 1j*c/(2*a))
+    r = np.sqrt(b**2 + c**2 - 4*a*d)/(2*np.abs(a))
+    return z_mean[..., 0] + z_scale[..., 0]*zc, z_scale[..., 0]*r
+
+def _remove_delay_batch(xdata, zdata, edge_frac=0.1, n_grid=21, n_zoom=4):
+    """
+    Electrical delay: start from the linear phase slope of the first and last edge_frac of the points, which is
+    biased by the tails of the resonance, then refine it by a zooming grid search for the slope at which S21 is
+    closest to a circle. Returns delay corrected zdata and the phase slope (rad per xdata unit).
+    """
+    x = xdata - np.mean(xdata)
+    n_edge = max(2, int(edge_frac*len(x)))
+    edges = np.r_[np.arange(n_edge), np.arange(len(x)-n_edge, len(x))]
+    phase = np.unwrap(np.angle(zdata), axis=-1)[:, edges]
+    x_edges = x[edges] - np.mean(x[edges])
+    slope = np.sum(x_edges*(phase - np.mean(phase, axis=-1, keepdims=True)), axis=-1)/np.sum(x_edges**2)
+
+    offsets = np.linspace(-1, 1, n_grid) * 2*np.pi/(np.max(x) - np.min(x)) # up to one extra turn over the sweep
+    for _ in range(n_zoom):
+        slopes = slope + offsets[:, None] # (n_grid, n_traces)
+        z = zdata*np.exp(-1j*slopes[..., None]*x)
+        zc, r = circle_fit(z)
+        resid = np.mean((np.abs(z - zc[..., None]) - r[..., None])**2, axis=-1) # a line also fits a huge circle well, so not relative to r
+        slope = slopes[np.argmin(resid, axis=0), np.arange(zdata.shape[0])]
+        offsets = offsets * 2/(n_grid - 1)
+    return zdata*np.exp(-1j*slope[:, None]*x), slope
+
+@cached_fit
+def fithanger_circle_batch(xdata, zdata, fit_delay=True):
+    xdata = np.asarray(xdata, dtype=float)
+    zdata = np.atleast_2d(np.asarray(zdata, dtype=complex))
+    n_traces, n_points = zdata.shape
+    if fit_delay: zdata, _ = _remove_delay_batch(xdata, zdata)
+
+    zc, r = circle_fit(zdata)
+
+    # off resonant point from the linear fractional fit, in normalized freq g for conditioning
+    x_mid, x_span = np.mean(xdata), (np.max(xdata) - np.min(xdata))/2
+    g = (xdata - x_mid)/x_span
+    X = np.stack([np.ones_like(zdata), np.broadcast_to(g, zdata.shape).astype(complex), -zdata], axis=-1)
+    XH = np.conj(np.swapaxes(X, -1, -2))
+    A, B, C = np.moveaxis(np.linalg.solve(XH @ X, XH @ (zdata*g)[..., None])[..., 0], -1, 0)
+    P = zc + r*np.exp(1j*np.angle(B - zc)) # project onto the fitted circle
+
+    # phase around the center, relative to the resonance point (opposite P): tan(dtheta/2) = b + m*g, weighted
+    # by cos(dtheta/2) so the points near P don't blow up
+    dtheta = np.angle((zdata - zc[:, None])/(zc - P)[:, None])
+    sin, cos = np.sin(dtheta/2), np.cos(dtheta/2)
+    X = np.stack([cos, cos*g], axis=-1)
+    b, m = np.moveaxis(np.linalg.solve(np.swapaxes(X, -1, -2) @ X, np.einsum('nki,nk->ni', X, sin)[..., None])[..., 0], -1, 0)
+    f0 = x_mid - x_span*b/m
+    Ql = np.abs(m)*f0/(2*x_span)
+
+    Qc_abs = Ql*np.abs(P)/(2*r)
+    phi = np.angle((P - zc)/P)
+    Qe = Qc_abs/np.cos(phi)
+    Qi = 1/(1/Ql - 1/Qe)
+    scale = np.abs(P)
+    a0 = scale*(1 - Ql/Qe)
+    pOpt = np.stack([f0, Qi, Qe, phi, scale, a0, np.zeros(n_traces)], axis=-1)
+
+    resid = np.array([hangerS21func_sloped(xdata, *p) for p in pOpt]) - np.abs(zdata)
+    jac = np.array([hangerS21func_sloped_jac(xdata, *p) for p in pOpt])
+    pCov = _batch_pcov(jac, np.sum(resid**2, axis=-1))
+    bad = ~np.all(np.isfinite(pOpt), axis=-1)
+    if np.any(bad):
+        print(f'Warning: circle fit failed for {np.sum(bad)}/{n_traces} traces!')
+        pCov[bad] = np.inf
+    return pOpt, pCov
+
+def fithanger_circle(xdata, zdata, fit_delay=True):
+    pOpt, pCov = fithanger_circle_batch(xdata, np.asarray(zdata)[None], fit_delay=fit_delay)
+    return pOpt[0], pCov[0]
+
+
 # ====================================================== #
 
 def rb_func(depth, p, a, b):
     return a*p**depth + b
 
+def rb_func_jac(depth, p, a, b):
+    depth = np.asarray(depth)
+    return np.stack([a*depth*p**np.maximum(depth-1, 0), p**depth, np.ones_like(depth, dtype=float)], axis=-1)
+
 # Gives the average error rate over all gates in sequence
 def rb_error(p, d): # d = dim of system = 2^(number of qubits)
     return 1 - (p + (1-p)/d)
@@ -407,6 +943,7 @@ def error_fit_err(cov_p, d):
 def rb_gate_fidelity(p_rb, p_irb, d):
     return 1 - (d-1)*(1-p_irb/p_rb) / d
 
+@cached_fit
 def fitrb(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*3
     else: fitparams = np.copy(fitparams)
@@ -424,7 +961,7 @@ def fitrb(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(rb_func, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(rb_func, xdata, ydata, p0=fitparams, bounds=bounds, jac=rb_func_jac)
         print(pOpt)
         print(pCov[0][0], pCov[1][1], pCov[2][2])
         # return pOpt, pCov
@@ -433,6 +970,148 @@ def fitrb(xdata, ydata, fitparams=None):
         # return 0, 0
     return pOpt, pCov
 
+# ====================================================== #
+"""
+Joint RB fit: one least squares problem over many RB datasets (qubits, runs, reference + interleaved), where
+datasets can share params. E.g. a reference and an interleaved run on the same qubit have different p but the same
+SPAM (a, b), so fitting them together with shared a, b constrains both p better than two separate fits, and gives
+the covariance between p_rb and p_irb needed for the gate fidelity error.
+
+    xdata, ydata: lists with one entry per dataset of flat depths and probs (same as fitrb takes)
+    p_groups, spam_groups: one label per dataset; datasets with the same label share p (or a and b). Default: every
+        dataset has its own p, a, b, which gives the same result as fitrb on each dataset.
+
+The data is reduced to the mean at each unique depth weighted by the number of points there (which has the same
+least squares solution as fitting all the points), and the covariance is scaled by the reduced chi^2 of all the
+points, so a single dataset gives the same pCov as fitrb too. Groups of datasets that share no params with each
+other are independent problems (zero covariance with each other), which are solved together with the batched LM.
+
+Returns pOpt (n_datasets, 3) [p, a, b] and the joint pCov (n_datasets, 3, n_datasets, 3); pCov[k, :, k, :] is the
+usual covariance for dataset k.
+"""
+
+def _rb_joint_batch(x, theta):
+    # x (n_traces, n_points, 5): depth, sqrt(weight), and the index into theta of p, a, b for each point.
+    # theta (n_traces, n_params): the params of each group of datasets fit together
+    depth, sqrt_w = x[..., 0], x[..., 1]
+    ind = x[..., 2:].astype(int)
+    rb_p, a, b = [np.take_along_axis(theta, ind[..., i], axis=1) for i in range(3)]
+    pow = rb_p**depth
+    onehot = ind[..., None] == np.arange(theta.shape[1]) # (n_traces, n_points, 3, n_params)
+    dparams = np.stack([a*depth*rb_p**np.maximum(depth-1, 0), pow, np.ones_like(pow)], axis=-1)
+    jac = np.einsum('tpk,tpkj->tpj', dparams, onehot)
+    return sqrt_w*(a*pow + b), sqrt_w[..., None]*jac
+
+def _rb_joint_components(p_ind, spam_ind):
+    """
+    Label of the group of datasets linked to each other by shared params: these are independent least squares
+    problems, and fitting them separately converges much faster than one big trust region over all of them
+    """
+    component = np.arange(len(p_ind))
+    changed = True
+    while changed: # propagate the smallest label through shared p and shared spam until nothing changes
+        changed = False
+        for ind in (p_ind, spam_ind):
+            group_min = np.full(np.max(ind)+1, len(component))
+            np.minimum.at(group_min, ind, component)
+            new_component = np.minimum(component, group_min[ind])
+            if np.any(new_component != component): changed = True
+            component = new_component
+    return np.unique(component, return_inverse=True)[1]
+
+def fitrb_joint(xdata, ydata, p_groups=None, spam_groups=None, max_iter=200):
+    n_datasets = len(xdata)
+    if p_groups is None: p_groups = np.arange(n_datasets)
+    if spam_groups is None: spam_groups = np.arange(n_datasets)
+    _, p_ind = np.unique(p_groups, return_inverse=True)
+    _, spam_ind = np.unique(spam_groups, return_inverse=True)
+    n_p, n_spam = np.max(p_ind)+1, np.max(spam_ind)+1
+    a_ind, b_ind = n_p + spam_ind, n_p + n_spam + spam_ind
+    n_theta = n_p + 2*n_spam
+
+    # mean of each dataset at each unique depth, and the within depth sum of squares for the chi^2
+    depth, y_mean, sqrt_w, ss_within, n_total = [], [], [], np.zeros(n_datasets), np.zeros(n_datasets)
+    for k, (x, y) in enumerate(zip(xdata, ydata)):
+        x, y = np.asarray(x, dtype=float).flatten(), np.asarray(y, dtype=float).flatten()
+        depths_k, inv = np.unique(x, return_inverse=True)
+        counts_k = np.bincount(inv)
+        mean_k = np.bincount(inv, weights=y)/counts_k
+        ss_within[k] = np.sum((y - mean_k[inv])**2)
+        n_total[k] = len(y)
+        depth.append(depths_k)
+        y_mean.append(mean_k)
+        sqrt_w.append(np.sqrt(counts_k))
+
+    # same initial guess and bounds as fitrb, for shared params from all the datasets sharing them
+    y_min = np.array([np.min(y) for y in ydata])
+    y_max = np.array([np.max(y) for y in ydata])
+    theta0 = np.zeros(n_theta)
+    lower, upper = np.zeros(n_theta), np.zeros(n_theta)
+    theta0[:n_p] = 0.9
+    upper[:n_p] = 1
+    for i in range(n_spam):
+        group = spam_ind == i
+        theta0[n_p+i] = np.max(y_max[group]) - np.min(y_min[group])
+        theta0[n_p+n_spam+i] = np.min(y_min[group])
+        upper[n_p+i] = 10*np.max(y_max[group]) - np.min(y_min[group])
+        upper[n_p+n_spam+i] = np.max(y_max[group])
+    theta0 = np.clip(theta0, lower + 1e-6*(upper-lower), upper - 1e-6*(upper-lower))
+
+    # groups of datasets with the same number of params are fit together as one batch, with each group's points
+    # padded with zero weight to the same length
+    theta = np.copy(theta0)
+    theta_cov = np.zeros((n_theta, n_theta))
+    component = _rb_joint_components(p_ind, spam_ind)
+    groups = [np.flatnonzero(component == c) for c in range(np.max(component)+1)]
+    group_params = [np.unique(np.concatenate([p_ind[g], a_ind[g], b_ind[g]])) for g in groups]
+    for n_params in np.unique([len(params) for params in group_params]):
+        batch = [i for i, params in enumerate(group_params) if len(params) == n_params]
+        n_points = max(sum(len(depth[k]) for k in groups[i]) for i in batch)
+        x = np.zeros((len(batch), n_points, 5))
+        y = np.zeros((len(batch), n_points))
+        for t, i in enumerate(batch):
+            local = np.searchsorted(group_params[i], np.stack([p_ind, a_ind, b_ind], axis=-1)[groups[i]])
+            rows = np.concatenate([np.column_stack([depth[k], sqrt_w[k], np.tile(local[n], (len(depth[k]), 1))]) for n, k in enumerate(groups[i])])
+            x[t, :len(rows)] = rows
+            x[t, len(rows):, 2:] = rows[0, 2:] # padding: zero weight, any valid index
+            y[t, :len(rows)] = rows[:, 1]*np.concatenate([y_mean[k] for k in groups[i]])
+        params = np.array([group_params[i] for i in batch])
+        pOpt, jac, cost, converged = _lm_batch(_rb_joint_batch, x, y, theta0[params], bounds=(lower[params], upper[params]), max_iter=max_iter, x_per_trace=True)
+        if not np.all(converged): print(f'Warning: fit failed for datasets {[list(groups[batch[t]]) for t in np.flatnonzero(~converged)]}!')
+
+        # same as curve_fit: Moore-Penrose inverse of J^T W J, scaled by the reduced chi^2 of all the points (the
+        # cost here is only the between depth part)
+        cov = _batch_pcov(jac, np.full(len(batch), n_points - n_params, dtype=float))
+        n_all = np.array([np.sum(n_total[groups[i]]) for i in batch])
+        chi2 = cost + np.array([np.sum(ss_within[groups[i]]) for i in batch])
+        cov *= np.where(n_all > n_params, chi2/np.maximum(n_all - n_params, 1), np.inf)[:, None, None]
+        for t in range(len(batch)):
+            theta[params[t]] = pOpt[t]
+            theta_cov[np.ix_(params[t], params[t])] = cov[t]
+
+    inds = np.stack([p_ind, a_ind, b_ind], axis=-1) # (n_datasets, 3) index of each param in theta
+    pOpt = theta[inds]
+    pCov = theta_cov[inds[:, :, None, None], inds[None, None, :, :]]
+    return pOpt, pCov
+
+def rb_error_joint(pOpt, pCov, d):
+    """
+    rb_error of every dataset in a joint fit, and their (n_datasets, n_datasets) covariance
+    """
+    error = rb_error(pOpt[:, 0], d)
+    return error, pCov[:, 0, :, 0]*(1/d-1)**2
+
+def rb_gate_fidelity_joint(pOpt, pCov, rb_ind, irb_ind, d):
+    """
+    rb_gate_fidelity for reference dataset rb_ind and interleaved dataset irb_ind in a joint fit, and its variance
+    including the covariance between p_rb and p_irb
+    """
+    p_rb, p_irb = pOpt[rb_ind, 0], pOpt[irb_ind, 0]
+    fidelity = rb_gate_fidelity(p_rb, p_irb, d)
+    grad = np.array([-(d-1)/d*p_irb/p_rb**2, (d-1)/d/p_rb])
+    cov = np.array([[pCov[rb_ind, 0, rb_ind, 0], pCov[rb_ind, 0, irb_ind, 0]], [pCov[irb_ind, 0, rb_ind, 0], pCov[irb_ind, 0, irb_ind, 0]]])
+    return fidelity, grad @ cov @ grad
+
 # ====================================================== #
 # Adiabatic pi pulse functions
 # beta ~ slope of the frequency sweep (also adjusts width)
@@ -462,21 +1141,34 @@ def probg_Xhalf(n, *p):
     delta = delta * np.pi/180
     return a + (0.5 * (-1)**n * np.cos(np.pi/2 + 2*n*delta))
 
+def probg_Xhalf_jac(n, *p):
+    a, delta = p
+    n = np.asarray(n)
+    delta = delta * np.pi/180
+    return np.stack([np.ones_like(n, dtype=float), -0.5 * (-1)**n * np.sin(np.pi/2 + 2*n*delta) * 2*n*np.pi/180], axis=-1)
+
 
 def probg_X(n, *p):
     a, delta = p
     delta = delta * np.pi/180
     return a + (0.5 * np.cos(np.pi/2 + 2*n*delta))
 
+def probg_X_jac(n, *p):
+    a, delta = p
+    n = np.asarray(n)
+    delta = delta * np.pi/180
+    return np.stack([np.ones_like(n, dtype=float), -0.5 * np.sin(np.pi/2 + 2*n*delta) * 2*n*np.pi/180], axis=-1)
+
 
+@cached_fit
 def fit_probg_Xhalf(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*2
     else: fitparams = np.copy(fitparams)
     if fitparams[0] is None: fitparams[0]=np.average(ydata)
     if fitparams[1] is None: fitparams[1]=0.0
     bounds = (
-        [min(ydata), -20.0],
-        [max(ydata), 20.0],
+        [np.min(ydata), -20.0],
+        [np.max(ydata), 20.0],
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
@@ -485,7 +1177,7 @@ def fit_probg_Xhalf(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(probg_Xhalf, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(probg_Xhalf, xdata, ydata, p0=fitparams, bounds=bounds, jac=probg_Xhalf_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
@@ -493,14 +1185,15 @@ def fit_probg_Xhalf(xdata, ydata, fitparams=None):
     return pOpt, pCov
 
 
+@cached_fit
 def fit_probg_X(xdata, ydata, fitparams=None):
     if fitparams is None: fitparams = [None]*2
     else: fitparams = np.copy(fitparams)
     if fitparams[0] is None: fitparams[0]=np.average(ydata)
     if fitparams[1] is None: fitparams[1]=0.0
     bounds = (
-        [min(ydata), -20.0],
-        [max(ydata), 20.0],
+        [np.min(ydata), -20.0],
+        [np.max(ydata), 20.0],
         )
     for i, param in enumerate(fitparams):
         if not (bounds[0][i] < param < bounds[1][i]):
@@ -509,11 +1202,444 @@ def fit_probg_X(xdata, ydata, fitparams=None):
     pOpt = fitparams
     pCov = np.full(shape=(len(fitparams), len(fitparams)), fill_value=np.inf)
     try:
-        pOpt, pCov = sp.optimize.curve_fit(probg_X, xdata, ydata, p0=fitparams, bounds=bounds)
+        pOpt, pCov = sp.optimize.curve_fit(probg_X, xdata, ydata, p0=fitparams, bounds=bounds, jac=probg_X_jac)
         # return pOpt, pCov
     except RuntimeError: 
         print('Warning: fit failed!')
         # return 0, 0
     return pOpt, pCov
 
-    
\ No newline at end of file
+    
+# ====================================================== #
+"""
+Batched fitting: fit the same model to many traces at once, e.g. every frequency row of a chevron.
+
+ydata is a stacked (n_traces, n_points) array sharing the same xdata. All traces are fit together with a
+Levenberg-Marquardt loop where the residuals, Jacobians, and normal equations for every trace are evaluated
+as single numpy operations instead of one curve_fit call per trace. Traces drop out of the loop as they converge.
+
+Returns pOpt (n_traces, n_params) and pCov (n_traces, n_params, n_params) with the same semantics as the
+single trace fit functions: initial guesses and bounds are chosen the same way per trace, pCov is scaled by the
+reduced chi^2, and a trace whose fit fails gets pOpt = its initial guess and pCov filled with inf.
+
+fitparams can be None, or a list with one entry per parameter where each entry is None (guess from data), a
+number (same for all traces), or an array with one value per trace.
+"""
+
+# Each model_batch(x, p) takes x (n_points,) and p (n_traces, n_params), and returns the model values
+# (n_traces, n_points) and the analytic Jacobian (n_traces, n_points, n_params)
+
+def sinfunc_batch(x, p):
+    yscale, freq, phase_deg, y0 = [p[:, i:i+1] for i in range(4)]
+    theta = 2*np.pi*freq*x + phase_deg*np.pi/180
+    sin, cos = np.sin(theta), np.cos(theta)
+    f = yscale*sin + y0
+    jac = np.stack([sin, yscale*cos*2*np.pi*x, yscale*cos*np.pi/180, np.ones_like(f)], axis=-1)
+    return f, jac
+
+def decaysin_batch(x, p):
+    yscale, freq, phase_deg, decay, y0 = [p[:, i:i+1] for i in range(5)]
+    theta = 2*np.pi*freq*x + phase_deg*np.pi/180
+    env = np.exp(-x/decay)
+    sin, cos = np.sin(theta)*env, np.cos(theta)*env
+    f = yscale*sin + y0
+    jac = np.stack([sin, yscale*cos*2*np.pi*x, yscale*cos*np.pi/180, yscale*sin*x/decay**2, np.ones_like(f)], axis=-1)
+    return f, jac
+
+def expfunc_batch(x, p):
+    y0, yscale, x0, decay = [p[:, i:i+1] for i in range(4)]
+    exp = np.exp(-(x-x0)/decay)
+    f = y0 + yscale*exp
+    jac = np.stack([np.ones_like(f), exp, yscale*exp/decay, yscale*exp*(x-x0)/decay**2], axis=-1)
+    return f, jac
+
+def lorfunc_batch(x, p):
+    y0, yscale, x0, xscale = [p[:, i:i+1] for i in range(4)]
+    denom = 1/(1+(x-x0)**2/xscale**2)
+    f = y0 + yscale*denom
+    jac = np.stack([np.ones_like(f), denom, yscale*denom**2*2*(x-x0)/xscale**2, yscale*denom**2*2*(x-x0)**2/xscale**3], axis=-1)
+    return f, jac
+
+def rb_func_batch(x, p):
+    rb_p, a, b = [p[:, i:i+1] for i in range(3)]
+    pow = rb_p**x
+    f = a*pow + b
+    jac = np.stack([a*x*rb_p**np.maximum(x-1, 0), pow, np.ones_like(f)], axis=-1)
+    return f, jac
+
+def _batch_fitparams(fitparams, n_traces, n_params):
+    """
+    Returns (n_traces, n_params) float array of the user specified fitparams, nan where a param should be guessed
+    """
+    params = np.full((n_traces, n_params), np.nan)
+    if fitparams is None: return params
+    for i, param in enumerate(fitparams):
+        if param is None: continue
+        params[:, i] = np.array(param, dtype=float)
+    return params
+
+def _batch_fft_peak(xdata, ydata):
+    """
+    Frequency and phase (deg) of the largest fft component (excluding DC) of each trace
+    """
+    fourier = np.fft.fft(ydata, axis=-1)
+    fft_freqs = np.fft.fftfreq(ydata.shape[-1], d=xdata[1]-xdata[0])
+    max_ind = np.argmax(np.abs(fourier[:, 1:]), axis=-1) + 1
+    max_phase = np.angle(fourier[np.arange(len(ydata)), max_ind])
+    return np.abs(fft_freqs[max_ind]), max_phase*180/np.pi
+
+def _batch_clamp_init(fitparams, bounds):
+    # same as the out of bounds init check in the single trace fits, but one message per param
+    lower, upper = bounds
+    for i in range(fitparams.shape[1]):
+        bad = ~((lower[:, i] < fitparams[:, i]) & (fitparams[:, i] < upper[:, i]))
+        if np.any(bad):
+            fitparams[bad, i] = np.mean((lower[bad, i], upper[bad, i]), axis=0)
+            print(f'Attempted to init fitparam {i} out of bounds in {np.sum(bad)}/{len(bad)} traces. Instead init to the middle of the bounds')
+
+def _init_exp_batch(xdata, ydata, fitparams):
+    guess = np.stack([ydata[:, -1], ydata[:, 0]-ydata[:, -1], np.full(len(ydata), xdata[0]), np.full(len(ydata), (xdata[-1]-xdata[0])/5)], axis=-1)
+    fitparams = np.where(np.isnan(fitparams), guess, fitparams)
+    return fitparams, None
+
+def _init_lor_batch(xdata, ydata, fitparams):
+    y0 = np.where(np.isnan(fitparams[:, 0]), (ydata[:, 0] + ydata[:, -1])/2, fitparams[:, 0])
+    guess = np.stack([
+        y0,
+        np.max(ydata, axis=-1) - np.min(ydata, axis=-1),
+        xdata[np.argmax(np.abs(ydata - y0[:, None]), axis=-1)],
+        np.full(len(ydata), (np.max(xdata)-np.min(xdata))/10),
+        ], axis=-1)
+    fitparams = np.where(np.isnan(fitparams), guess, fitparams)
+    return fitparams, None
+
+def _init_sin_batch(xdata, ydata, fitparams):
+    max_freq, max_phase = _batch_fft_peak(xdata, ydata)
+    ymin, ymax = np.min(ydata, axis=-1), np.max(ydata, axis=-1)
+    guess = np.stack([ymax-ymin, max_freq, max_phase, np.mean(ydata, axis=-1)], axis=-1)
+    fitparams = np.where(np.isnan(fitparams), guess, fitparams)
+    span = np.max(xdata)-np.min(xdata)
+    ones = np.ones(len(ydata))
+    bounds = (
+        np.stack([0.5*fitparams[:, 0], 0.2/span*ones, -360*ones, ymin], axis=-1),
+        np.stack([2*fitparams[:, 0], 5/span*ones, 360*ones, ymax], axis=-1),
+        )
+    _batch_clamp_init(fitparams, bounds)
+    return fitparams, bounds
+
+def _init_decaysin_batch(xdata, ydata, fitparams):
+    max_freq, max_phase = _batch_fft_peak(xdata, ydata)
+    ymin, ymax = np.min(ydata, axis=-1), np.max(ydata, axis=-1)
+    span = np.max(xdata)-np.min(xdata)
+    ones = np.ones(len(ydata))
+    guess = np.stack([(ymax-ymin)/2, max_freq, max_phase, span*ones, np.mean(ydata, axis=-1)], axis=-1)
+    fitparams = np.where(np.isnan(fitparams), guess, fitparams)
+    bounds = (
+        np.stack([0.75*fitparams[:, 0], 0.1/span*ones, -360*ones, 0.3*span*ones, ymin], axis=-1),
+        np.stack([1.25*fitparams[:, 0], 30/span*ones, 360*ones, np.inf*ones, ymax], axis=-1),
+        )
+    _batch_clamp_init(fitparams, bounds)
+    return fitparams, bounds
+
+def _init_rb_batch(xdata, ydata, fitparams):
+    ymin, ymax = np.min(ydata, axis=-1), np.max(ydata, axis=-1)
+    guess = np.stack([np.full(len(ydata), 0.9), ymax-ymin, ymin], axis=-1)
+    fitparams = np.where(np.isnan(fitparams), guess, fitparams)
+    zeros = np.zeros(len(ydata))
+    bounds = (
+        np.stack([zeros, zeros, zeros], axis=-1),
+        np.stack([zeros+1, 10*ymax-ymin, ymax], axis=-1),
+        )
+    _batch_clamp_init(fitparams, bounds)
+    return fitparams, bounds
+
+# name: (model, batched model + jacobian, initial guess + bounds, n params)
+batch_models = dict(
+    sin=(sinfunc, sinfunc_batch, _init_sin_batch, 4),
+    decaysin=(decaysin, decaysin_batch, _init_decaysin_batch, 5),
+    exp=(expfunc, expfunc_batch, _init_exp_batch, 4),
+    lor=(lorfunc, lorfunc_batch, _init_lor_batch, 4),
+    rb=(rb_func, rb_func_batch, _init_rb_batch, 3),
+)
+
+def _batch_solve(A, b):
+    try:
+        return np.linalg.solve(A, b[..., None])[..., 0]
+    except np.linalg.LinAlgError: # some trace has a singular matrix
+        return np.einsum('nij,nj->ni', np.linalg.pinv(A), b)
+
+def _lm_batch(model_batch, xdata, ydata, p0, bounds=None, max_iter=200, ftol=1e-8, xtol=1e-8, x_per_trace=False):
+    """
+    Levenberg-Marquardt on all traces at once, with bounds enforced by clipping each step and holding params
+    that are pushing against a bound fixed. x_per_trace: xdata has a leading n_traces axis (each trace has its own
+    x) instead of being shared.
+    Returns pOpt (n_traces, n_params), final Jacobian (n_traces, n_points, n_params), sum of squared residuals
+    (n_traces,), and whether each trace converged.
+    """
+    n_traces, n_params = p0.shape
+    if bounds is None: bounds = (np.full_like(p0, -np.inf), np.full_like(p0, np.inf))
+    lower, upper = bounds
+    p = np.clip(p0, lower, upper)
+    f, jac = model_batch(xdata, p)
+    cost = np.sum((ydata - f)**2, axis=-1)
+    lam = np.full(n_traces, 1e-2)
+    done = np.zeros(n_traces, dtype=bool)
+    done[~np.isfinite(cost)] = True # nothing to do for these, will be marked failed below
+    converged = np.zeros(n_traces, dtype=bool)
+    for _ in range(max_iter):
+        act = np.flatnonzero(~done)
+        if len(act) == 0: break
+        J = jac[act]
+        resid = ydata[act] - f[act]
+        JTJ = np.einsum('nmi,nmj->nij', J, J)
+        grad = np.einsum('nmi,nm->ni', J, resid)
+        # damping is isotropic in the raw params (like curve_fit's default x_scale), rather than Marquardt's
+        # diag(J^T J) scaling, which lets sin fits wander off in frequency when started with a bad phase
+        damping = lam[act]*np.max(np.diagonal(JTJ, axis1=1, axis2=2), axis=-1)
+        A = JTJ + damping[:, None, None]*np.eye(n_params)
+        step = _batch_solve(A, grad)
+        # params sitting on a bound that want to go further out are held fixed, and the step re-solved for the rest
+        frozen = ((p[act] <= lower[act]) & (step < 0)) | ((p[act] >= upper[act]) & (step > 0))
+        if np.any(frozen):
+            free = ~frozen
+            A = A*(free[:, :, None] & free[:, None, :]) + frozen[:, :, None]*np.eye(n_params)
+            step = _batch_solve(A, grad*free)
+        p_new = np.clip(p[act] + step, lower[act], upper[act])
+        f_new, jac_new = model_batch(xdata[act] if x_per_trace else xdata, p_new)
+        cost_new = np.sum((ydata[act] - f_new)**2, axis=-1)
+
+        better = cost_new < cost[act]
+        small_f = better & (cost[act] - cost_new <= ftol*cost[act])
+        small_x = np.all(np.abs(p_new - p[act]) <= xtol*(np.abs(p[act]) + xtol), axis=-1)
+
+        acc = act[better]
+        p[acc], f[acc], jac[acc], cost[acc] = p_new[better], f_new[better], jac_new[better], cost_new[better]
+        lam[act] = np.where(better, np.maximum(lam[act]/10, 1e-12), lam[act]*10)
+
+        stop = small_f | small_x | (lam[act] > 1e12) # lam blowing up means no downhill step left: at a minimum
+        converged[act[stop]] = True
+        done[act[stop]] = True
+    return p, jac, cost, converged
+
+def _batch_pcov(jac, cost):
+    """
+    Covariance from the Jacobian at the solution, same as curve_fit: Moore-Penrose inverse of J^T J discarding
+    zero singular values, scaled by the reduced chi^2
+    """
+    n_traces, n_points, n_params = jac.shape
+    if n_points <= n_params: return np.full((n_traces, n_params, n_params), np.inf)
+    _, s, VT = np.linalg.svd(jac, full_matrices=False)
+    threshold = np.finfo(float).eps * max(n_points, n_params) * s[:, :1]
+    s_inv2 = np.where(s > threshold, 1/np.where(s > threshold, s, 1)**2, 0)
+    pCov = np.einsum('nki,nk,nkj->nij', VT, s_inv2, VT)
+    pCov *= (cost / (n_points - n_params))[:, None, None]
+    pCov[np.isnan(pCov).any(axis=(1, 2))] = np.inf
+    return pCov
+
+@cached_fit
+def fit_batch(model, xdata, ydata, fitparams=None, max_iter=200):
+    """
+    Fit model (one of the batch_models: 'sin', 'decaysin', 'exp', 'lor', 'rb') to each row of ydata (n_traces, n_points).
+    Returns pOpt (n_traces, n_params), pCov (n_traces, n_params, n_params).
+    """
+    _, model_batch, init_batch, n_params = batch_models[model]
+    xdata = np.asarray(xdata, dtype=float)
+    ydata = np.atleast_2d(np.asarray(ydata, dtype=float))
+    fitparams = _batch_fitparams(fitparams, len(ydata), n_params)
+    fitparams, bounds = init_batch(xdata, ydata, fitparams)
+
+    pOpt, jac, cost, converged = _lm_batch(model_batch, xdata, ydata, fitparams, bounds=bounds, max_iter=max_iter)
+    pCov = _batch_pcov(jac, cost)
+    if not np.all(converged):
+        print(f'Warning: fit failed for {np.sum(~converged)}/{len(converged)} traces!')
+        pOpt[~converged] = fitparams[~converged]
+        pCov[~converged] = np.inf
+    return pOpt, pCov
+
+def fitsin_batch(xdata, ydata, fitparams=None):
+    return fit_batch('sin', xdata, ydata, fitparams=fitparams)
+
+def fitdecaysin_batch(xdata, ydata, fitparams=None):
+    return fit_batch('decaysin', xdata, ydata, fitparams=fitparams)
+
+def fitexp_batch(xdata, ydata, fitparams=None):
+    return fit_batch('exp', xdata, ydata, fitparams=fitparams)
+
+def fitlor_batch(xdata, ydata, fitparams=None):
+    return fit_batch('lor', xdata, ydata, fitparams=fitparams)
+
+def fitrb_batch(xdata, ydata, fitparams=None):
+    return fit_batch('rb', xdata, ydata, fitparams=fitparams)
+
+# ====================================================== #
+"""
+Streaming fits: refit as data comes in during an acquisition (each new round of averaging, or each new sweep point),
+so the experiment can stop as soon as the parameter it cares about is known well enough.
+
+The first update does a full fit of each trace with the usual single trace fit function. Every update after that is
+warm started from the previous pOpt and only runs a few batched LM iterations, since the answer moves little
+between updates. If a warm update loses its covariance (e.g. a param got pinned to a bound) the next update does a
+full fit again.
+
+    stream = fitter.StreamingFit('exp')
+    for each new round:
+        stream.update(xpts, [avgi, avgq, amps])
+        if stream.precise(3, rel_err=0.02).any(): break
+    stream.pOpt, stream.pCov, stream.perr
+"""
+
+# name: full single trace fit used for the first update
+streaming_fits = dict(
+    sin=fitsin,
+    decaysin=fitdecaysin,
+    exp=fitexp,
+    lor=fitlor,
+    rb=fitrb,
+)
+
+class StreamingFit:
+    def __init__(self, model, fitparams=None, max_iter=5, step_tol=0.1, min_points=None):
+        """
+        model: one of the batch_models ('sin', 'decaysin', 'exp', 'lor', 'rb')
+        fitparams: initial guess for the first full fit, same format as the single trace fit functions
+        max_iter: LM iterations per warm update
+        step_tol: a warm update has converged once the Gauss-Newton step still left is below step_tol times the
+            uncertainty of every param; traces that haven't after max_iter are redone with full fits
+        min_points: don't fit until there are at least this many points (default: n params + 2)
+        """
+        _, self.model_batch, self.init_batch, self.n_params = batch_models[model]
+        self.model = model
+        self.fitparams = fitparams
+        self.max_iter = max_iter
+        self.step_tol = step_tol
+        self.min_points = self.n_params + 2 if min_points is None else min_points
+        self.reset()
+
+    def reset(self):
+        self.xdata = None
+        self.ydata = None
+        self.pOpt = None
+        self.pCov = None
+        self.n_updates = 0
+
+    @property
+    def perr(self):
+        if self.pCov is None: return None
+        return np.sqrt(np.abs(np.diagonal(self.pCov, axis1=-2, axis2=-1)))
+
+    def _full_fit(self, traces=slice(None)):
+        pOpt, pCov = [], []
+        for y in self.ydata[traces]:
+            p, cov = streaming_fits[self.model](self.xdata, y, fitparams=self.fitparams)
+            pOpt.append(p)
+            pCov.append(cov)
+        return np.array(pOpt, dtype=float), np.array(pCov, dtype=float)
+
+    def _warm_fit(self):
+        # bounds are set around the previous pOpt the same way the batch fits set them around their initial guess
+        p0, bounds = self.init_batch(self.xdata, self.ydata, np.copy(self.pOpt))
+        pOpt, jac, cost, _ = _lm_batch(self.model_batch, self.xdata, self.ydata, p0, bounds=bounds, max_iter=self.max_iter)
+        pCov = _batch_pcov(jac, cost)
+        # a run that stopped at max_iter still has a finite pCov, so check that the Gauss-Newton step left,
+        # (J^T J)^-1 J^T r = pCov J^T r (n_points - n_params)/cost, is small compared to the param uncertainties,
+        # and redo the traces where it isn't with full fits
+        resid = self.ydata - self.model_batch(self.xdata, pOpt)[0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = np.einsum('nij,nmj,nm->ni', pCov, jac, resid) * ((len(self.xdata) - self.n_params)/cost)[:, None]
+            perr = np.sqrt(np.abs(np.diagonal(pCov, axis1=-2, axis2=-1)))
+            converged = np.all(np.abs(step) <= self.step_tol*perr, axis=-1)
+        if not np.all(converged): pOpt[~converged], pCov[~converged] = self._full_fit(traces=~converged)
+        return pOpt, pCov
+
+    def update(self, xdata, ydata):
+        """
+        Refit to all the data so far. ydata is one trace (n_points,) or several traces sharing xdata
+        (n_traces, n_points); the number of traces must stay the same between updates.
+        Returns pOpt (n_traces, n_params), pCov (n_traces, n_params, n_params), or None, None if there are not yet
+        enough points.
+        """
+        self.xdata = np.asarray(xdata, dtype=float)
+        self.ydata = np.atleast_2d(np.asarray(ydata, dtype=float))
+        if len(self.xdata) < self.min_points: return None, None
+        if self.pOpt is None or not np.all(np.isfinite(self.pCov)):
+            self.pOpt, self.pCov = self._full_fit()
+        else:
+            self.pOpt, self.pCov = self._warm_fit()
+        self.n_updates += 1
+        return self.pOpt, self.pCov
+
+    def append(self, xdata, ydata):
+        """
+        Add new sweep points (ydata (n_new,) or (n_traces, n_new)) to the data so far and refit
+        """
+        xdata = np.atleast_1d(np.asarray(xdata, dtype=float))
+        ydata = np.asarray(ydata, dtype=float).reshape(-1, len(xdata))
+        if self.xdata is not None:
+            xdata = np.concatenate((self.xdata, xdata))
+            ydata = np.concatenate((self.ydata, ydata), axis=-1)
+        return self.update(xdata, ydata)
+
+    def precise(self, param, rel_err=None, abs_err=None):
+        """
+        Whether the uncertainty on pOpt[:, param] is below rel_err (relative to the value) and/or abs_err, for each
+        trace. All False before the first fit.
+        """
+        if self.pOpt is None: return np.zeros(1 if self.ydata is None else len(self.ydata), dtype=bool)
+        err = self.perr[:, param]
+        ok = np.isfinite(err)
+        if rel_err is not None: ok &= err < rel_err*np.abs(self.pOpt[:, param])
+        if abs_err is not None: ok &= err < abs_err
+        return ok
+
+# ====================================================== #
+"""
+Analytic Jacobians passed to curve_fit as jac=, instead of letting it take finite differences (one extra model
+evaluation per parameter per iteration). check_jacobians compares each one against central differences; run it
+after changing any model or Jacobian.
+"""
+
+# model: (jac, test xdata, test params)
+jacobians = {
+    expfunc: (expfunc_jac, np.linspace(0, 50, 101), [0.1, 1.2, 2, 15]),
+    logexpfunc: (logexpfunc_jac, np.linspace(0, 50, 101), [15]),
+    qp_expfunc: (qp_expfunc_jac, np.linspace(0, 50, 101), [0.8, 10, 40]),
+    lorfunc: (lorfunc_jac, np.linspace(4000, 4010, 101), [0.1, 2, 4004.5, 0.7]),
+    sinfunc: (sinfunc_jac, np.linspace(0, 2, 101), [0.6, 1.3, 40, 0.1]),
+    decaysin: (decaysin_jac, np.linspace(0, 10, 101), [0.6, 1.3, 40, 4, 0.1]),
+    twofreq_decaysin: (twofreq_decaysin_jac, np.linspace(0, 10, 101), [0.6, 1.3, 40, 4, 0.2, 0.4, -30, 0.1]),
+    threefreq_decaysin: (threefreq_decaysin_jac, np.linspace(0, 10, 101), [0.6, 1.3, 40, 4, 0.1, 0, 1.1, 0.2, 20, 0.05, 0.9, 0.3, -60, -0.05]),
+    hangerS21func_sloped: (hangerS21func_sloped_jac, np.linspace(6799, 6801, 101), [6800.1, 8000, 3000, 0.3, 1.5, 0.2, 0.05]),
+    rb_func: (rb_func_jac, np.arange(0, 200, 5), [0.98, 0.5, 0.3]),
+    probg_Xhalf: (probg_Xhalf_jac, np.arange(0, 20), [0.5, 3]),
+    probg_X: (probg_X_jac, np.arange(0, 20), [0.5, 3]),
+}
+
+def numerical_jac(func, xdata, p, rel_step=1e-7):
+    p = np.array(p, dtype=float)
+    jac = []
+    for i in range(len(p)):
+        step = rel_step*max(abs(p[i]), 1)
+        p_plus, p_minus = p.copy(), p.copy()
+        p_plus[i] += step
+        p_minus[i] -= step
+        jac.append((func(xdata, *p_plus) - func(xdata, *p_minus))/(2*step))
+    return np.stack(jac, axis=-1)
+
+def check_jacobians(rtol=1e-4, verbose=True):
+    """
+    Compare every analytic Jacobian with central differences at its test point. Returns True if all agree
+    within rtol (relative to the largest entry of each column).
+    """
+    all_ok = True
+    for func, (jac, xdata, p) in jacobians.items():
+        analytic = jac(xdata, *p)
+        numerical = numerical_jac(func, xdata, p)
+        if analytic.shape != numerical.shape:
+            err = np.inf
+        else:
+            scale = np.maximum(np.max(np.abs(numerical), axis=0), 1e-12)
+            err = np.max(np.abs(analytic - numerical)/scale)
+        ok = err < rtol
+        all_ok = all_ok and ok
+        if verbose: print(f'{func.__name__}: max relative error {err:.2e}', '' if ok else 'FAILED')
+    return all_ok
@@ -0,0 +1,62 @@
+import functools
+import importlib
+import os
+import sys
+
+"""
+Headless execution mode for batch/cron runs.
+
+Experiment modules import plt and tqdm from here instead of matplotlib.pyplot and tqdm_notebook directly, so neither
+is imported until something actually draws a figure or a progress bar. In headless mode:
+    - matplotlib is never imported by hist() or display(), and if it does get loaded it uses the non-interactive Agg backend
+    - display() methods wrapped with skip_if_headless return immediately unless called with force_display=True
+    - hist() skips its plots, and debug plots made while building programs (add_IQ) are skipped
+    - tqdm is a passthrough of the iterable (no notebook widget)
+Enable with the environment variable SLAB_HEADLESS=1 before importing, or at any point with set_headless(True).
+"""
+
+_headless = os.environ.get('SLAB_HEADLESS', '0').lower() in ('1', 'true', 'yes')
+
+def set_headless(headless=True):
+    global _headless
+    _headless = headless
+
+def is_headless():
+    return _headless
+
+"""
+Stand-in for a module which is only imported on first attribute access, e.g. plt.figure(...)
+"""
+class _LazyModule:
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            if self._module_name.startswith('matplotlib') and _headless:
+                import matplotlib
+                if 'matplotlib.pyplot' not in sys.modules: matplotlib.use('Agg')
+            self._module = importlib.import_module(self._module_name)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+plt = _LazyModule('matplotlib.pyplot')
+gridspec = _LazyModule('matplotlib.gridspec')
+
+def tqdm(iterable=None, *args, **kwargs):
+    if _headless or kwargs.get('disable', False): return iterable
+    from tqdm import tqdm_notebook
+    return tqdm_notebook(iterable, *args, **kwargs)
+
+"""
+Decorator for Experiment.display: in headless mode, do nothing unless called with force_display=True.
+"""
+def skip_if_headless(display):
+    @functools.wraps(display)
+    def wrapper(*args, force_display=False, **kwargs):
+        if _headless and not force_display: return None
+        return display(*args, **kwargs)
+    return wrapper
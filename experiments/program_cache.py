@@ -0,0 +1,194 @@
+import copy
+import hashlib
+import json
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Process-wide cache of built and compiled QICK programs, keyed by a canonical hash of the effective cfg.
+
+Sweeps that build a new program per point (LengthRabiExperiment, NPulseExperiment, the QramProtocolExperiment
+timestep loop, QramVariantsT1Experiment) go through get_program instead of calling the program class directly:
+
+    prog = program_cache.get_program(LengthRabiProgram, self.soccfg, self.cfg)
+    avgi, avgq = prog.acquire(soc, load_pulses=program_cache.needs_pulses(prog, soc), progress=False)
+
+A point whose cfg hashes the same as an earlier one (e.g. the repeated loops of NPulseExperiment) reuses that program
+as is: no initialize(), no body(), no recompile. The hash covers the whole cfg (dict keys sorted, lists and numpy
+arrays/scalars normalized), the program class, and the contents of the soccfg.
+
+template_key: a cfg.expt key whose value only enters the program as an offset of to_cycles(prog, value) on some
+register immediates, e.g. a wait time [us] that ends up in the synci after state prep (to_cycles defaults to
+prog.us2cycles). The first time a cfg is seen with every other value the same, the program is built twice, at value
+and at value+1, and the two are diffed to find the instruction args that moved by exactly the change in cycles. Every
+later value is a copy of that template with only those instructions re-encoded into its machine code: initialize()
+and body() are not run, and the envelopes are the template's, so needs_pulses skips re-uploading them. If the two
+builds differ in anything else (instructions, labels, envelopes, or args that moved by a different amount), the key
+can't be templated and every value is built normally.
+
+Call forget_loaded() before a sweep: any program not built through this cache may overwrite the envelope memory.
+"""
+
+_program_cache = OrderedDict() # key -> program, in LRU order
+_template_cache = OrderedDict() # template key -> (template program, its templated value, patches or None)
+_program_cache_maxsize = 64
+_loaded_envelopes = weakref.WeakKeyDictionary() # soc -> envelope key of the last program loaded through needs_pulses
+_soccfg_hashes = weakref.WeakKeyDictionary() # soccfg -> soccfg_hash(soccfg)
+
+def _normalize(obj):
+    if isinstance(obj, dict): return {str(k): _normalize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)): return [_normalize(v) for v in obj]
+    if isinstance(obj, np.ndarray): return _normalize(obj.tolist())
+    if isinstance(obj, np.generic): return _normalize(obj.item())
+    if isinstance(obj, bool) or obj is None or isinstance(obj, str): return obj
+    if isinstance(obj, (int, float)):
+        obj = float(obj) # 2 and 2.0 give the same program
+        return obj if np.isfinite(obj) else repr(obj) # json has no inf/nan
+    return repr(obj)
+
+def cfg_hash(cfg, exclude_expt=()):
+    """
+    Canonical hash of cfg, leaving out the cfg.expt keys in exclude_expt
+    """
+    cfg = _normalize(cfg)
+    if len(exclude_expt) > 0:
+        cfg['expt'] = {k: v for k, v in cfg.get('expt', dict()).items() if k not in exclude_expt}
+        for k in exclude_expt: cfg.pop(k, None) # programs copy cfg.expt into the top level cfg too
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True).encode()).hexdigest()
+
+def soccfg_hash(soccfg):
+    """
+    Canonical hash of the QickConfig contents, computed once per soccfg object. Not id(soccfg): a new soccfg can get
+    the id of one that was garbage collected, and would be handed programs built for a different firmware.
+    """
+    try: return _soccfg_hashes[soccfg]
+    except (KeyError, TypeError): pass
+    h = cfg_hash(soccfg.get_cfg())
+    try: _soccfg_hashes[soccfg] = h
+    except TypeError: pass # not weakref-able, hash it again next time
+    return h
+
+def _envelope_key(prog):
+    h = hashlib.sha1()
+    for ch, envelopes in enumerate(prog.envelopes):
+        for name in sorted(envelopes):
+            env = envelopes[name]
+            h.update(repr((ch, name, env.get('addr'))).encode())
+            h.update(np.ascontiguousarray(env['data']).tobytes())
+    return h.hexdigest()
+
+def _labels(prog_list):
+    labels = dict()
+    prog_counter = 0
+    for inst in prog_list:
+        if inst['name'] == 'comment': continue
+        if 'label' in inst: labels[inst['label']] = prog_counter
+        prog_counter += 1
+    return labels
+
+def _template_patches(template, probe, offset):
+    """
+    [(prog_list index, machine code index, arg index)] of the args of probe that are the template's shifted by offset,
+    or None if the two programs differ in anything else
+    """
+    insts = [(i, inst) for i, inst in enumerate(template.prog_list) if inst['name'] != 'comment']
+    probe_insts = [inst for inst in probe.prog_list if inst['name'] != 'comment']
+    if len(insts) != len(probe_insts): return None
+    patches = []
+    for i_bin, ((i_list, inst), p) in enumerate(zip(insts, probe_insts)):
+        if inst['name'] != p['name'] or inst.get('label') != p.get('label') or len(inst['args']) != len(p['args']):
+            return None
+        for i_arg, (arg, arg_probe) in enumerate(zip(inst['args'], p['args'])):
+            if arg == arg_probe: continue
+            if not isinstance(arg, (int, np.integer)) or arg_probe - arg != offset: return None
+            patches.append((i_list, i_bin, i_arg))
+    return patches
+
+def _patched_program(template, patches, template_key, value, offset):
+    """
+    Copy of template with template_key set to value, re-encoding only the patched instructions
+    """
+    prog = copy.copy(template)
+    prog.cfg = copy.deepcopy(template.cfg)
+    prog.cfg.expt[template_key] = value
+    if template_key in prog.cfg: prog.cfg[template_key] = value # programs copy cfg.expt into the top level cfg too
+    prog.prog_list = list(template.prog_list)
+    binprog = list(template.compile())
+    labels = _labels(template.prog_list)
+    for i_list, i_bin, i_arg in patches:
+        inst = dict(prog.prog_list[i_list])
+        args = list(inst['args'])
+        args[i_arg] = template.prog_list[i_list]['args'][i_arg] + offset
+        inst['args'] = tuple(args)
+        prog.prog_list[i_list] = inst
+        binprog[i_bin] = template.compile_instruction(inst, labels)
+    _memoize_compile(prog, binprog)
+    return prog
+
+def _memoize_compile(prog, binprog=None):
+    if binprog is None: binprog = prog.compile()
+    prog.compile = lambda debug=False: binprog
+
+def _build(prog_cls, soccfg, cfg):
+    prog = prog_cls(soccfg=soccfg, cfg=cfg)
+    prog._envelope_key = _envelope_key(prog)
+    _memoize_compile(prog)
+    return prog
+
+def _from_template(prog_cls, soccfg, cfg, template_key, to_cycles):
+    value = cfg['expt'][template_key]
+    key = (prog_cls.__qualname__, soccfg_hash(soccfg), template_key, cfg_hash(cfg, exclude_expt=(template_key,)))
+    entry = _template_cache.get(key)
+    if entry is None:
+        probe_cfg = copy.deepcopy(cfg)
+        probe_cfg['expt'][template_key] = value + 1
+        template = _build(prog_cls, soccfg, cfg)
+        probe = prog_cls(soccfg=soccfg, cfg=probe_cfg)
+        offset = to_cycles(template, value + 1) - to_cycles(template, value)
+        patches = None
+        if offset != 0 and _envelope_key(probe) == template._envelope_key:
+            patches = _template_patches(template, probe, offset)
+        _template_cache[key] = (template, value, patches)
+        while len(_template_cache) > _program_cache_maxsize: _template_cache.popitem(last=False)
+        return template
+    _template_cache.move_to_end(key)
+    template, template_value, patches = entry
+    if patches is None: return _build(prog_cls, soccfg, cfg)
+    offset = to_cycles(template, value) - to_cycles(template, template_value)
+    return _patched_program(template, patches, template_key, value, offset)
+
+def get_program(prog_cls, soccfg, cfg, template_key=None, to_cycles=lambda prog, value: prog.us2cycles(value)):
+    key = (prog_cls.__qualname__, soccfg_hash(soccfg), cfg_hash(cfg))
+    prog = _program_cache.get(key)
+    if prog is None:
+        if template_key is None: prog = _build(prog_cls, soccfg, cfg)
+        else: prog = _from_template(prog_cls, soccfg, cfg, template_key, to_cycles)
+    _program_cache[key] = prog
+    _program_cache.move_to_end(key)
+    while len(_program_cache) > _program_cache_maxsize: _program_cache.popitem(last=False)
+    return prog
+
+def needs_pulses(prog, soc):
+    """
+    Whether prog needs to upload its envelopes to soc, i.e. load_pulses for acquire. Assumes prog is about to be
+    loaded.
+    """
+    envelope_key = getattr(prog, '_envelope_key', None)
+    try:
+        if envelope_key is not None and _loaded_envelopes.get(soc) == envelope_key: return False
+        _loaded_envelopes[soc] = envelope_key
+    except TypeError: pass # soc can't be weakly referenced, so we can't track what is loaded on it
+    return True
+
+def forget_loaded(soc=None):
+    if soc is None: _loaded_envelopes.clear()
+    else:
+        try: _loaded_envelopes.pop(soc, None)
+        except TypeError: pass
+
+def clear_program_cache():
+    _program_cache.clear()
+    _template_cache.clear()
+    _loaded_envelopes.clear()
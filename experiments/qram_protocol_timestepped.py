@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless, is_headless
 from copy import deepcopy
 import json
 import math
@@ -10,6 +9,7 @@ from qick.helpers import gauss
 from slab import Experiment, NpEncoder, AttrDict
 
 import experiments.fitting as fitter
+from experiments import program_cache
 
 from experiments.single_qubit.single_shot import hist
 from experiments.clifford_averager_program import CliffordAveragerProgram
@@ -18,7 +18,8 @@ from experiments.three_qubit.threeQ_state_tomo import AbstractStateTomo3QProgram
 from experiments.four_qubit.fourQ_state_tomo import AbstractStateTomo4QProgram, ErrorMitigationStateTomo4QProgram, sort_counts_4q, make_4q_calib_order, make_4q_meas_order
 
 
-default_colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+# matplotlib default color cycle, hardcoded so importing this module does not load matplotlib
+default_colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
 linestyle_cycle=['solid', 'dashed', 'dotted', 'dashdot']
 marker_cycle = ['o', '*', 's', '^']
 
@@ -32,11 +33,15 @@ class QramProtocolProgram(AbstractStateTomo2QProgram):
 
         self.swap_chs = self.cfg.hw.soc.dacs.swap.ch
         self.swap_ch_types = self.cfg.hw.soc.dacs.swap.type
-        self.f_EgGf_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_EgGf, self.swap_chs)]
+        self.f_EgGf_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_EgGf, gen_chs=self.swap_chs)
 
         self.swap_Q_chs = self.cfg.hw.soc.dacs.swap_Q.ch
         self.swap_Q_ch_types = self.cfg.hw.soc.dacs.swap_Q.type
-        self.f_EgGf_Q_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_EgGf_Q, self.swap_chs)]
+        self.f_EgGf_Q_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_EgGf_Q, gen_chs=self.swap_chs)
+        # the Eg-Gf swaps act on both q and Q1
+        for q, (ch, ch_Q) in enumerate(zip(self.swap_chs, self.swap_Q_chs)):
+            self.add_ch_qubits(ch, [q, 1])
+            self.add_ch_qubits(ch_Q, [q, 1])
 
         # declare swap dac indexed by qSort
         for qSort in self.all_qubits:
@@ -582,6 +587,8 @@ class QramProtocolExperiment(Experiment):
         self.pulse_dict = dict()
         if 'post_select' not in self.cfg.expt: self.cfg.expt.post_select = False
 
+        soc = self.im[self.cfg.aliases.soc]
+        program_cache.forget_loaded(soc)
         for time_i, timestep in enumerate(tqdm(timesteps, disable=not progress)):
             self.cfg.expt.timestep = float(timestep)
             self.cfg.all_qubits = [0, 1, 2, 3]
@@ -592,12 +599,12 @@ class QramProtocolExperiment(Experiment):
                     # print(basis)
                     cfg = AttrDict(deepcopy(self.cfg))
                     cfg.expt.basis = basis
-                    tomo_prog = QramProtocolProgram(soccfg=self.soccfg, cfg=cfg)
+                    tomo_prog = program_cache.get_program(QramProtocolProgram, self.soccfg, cfg)
                     # from qick.helpers import progs2json
                     # print('basis', basis)
                     # print(progs2json([tomo_prog.dump_prog()]))
                     # print()
-                    avgi, avgq = tomo_prog.acquire(self.im[self.cfg.aliases.soc], load_pulses=True, progress=False)
+                    avgi, avgq = tomo_prog.acquire(soc, load_pulses=program_cache.needs_pulses(tomo_prog, soc), progress=False)
                     counts = tomo_prog.collect_counts_post_select(angle=angles_q, threshold=thresholds_q, postselect=self.cfg.expt.post_select, postselect_q=1)
                     if cfg.expt.post_select:
                         data['counts_tomo_ps0'].append(counts[0])
@@ -605,12 +612,12 @@ class QramProtocolExperiment(Experiment):
                     else:
                         data['counts_tomo'].append(counts)
                         print(basis, counts)
-                    self.pulse_dict.update({basis:tomo_prog.pulse_dict})
+                    self.pulse_dict.update({basis:tomo_prog.pulse_params()})
 
             else:
                 self.cfg.expt.basis = 'ZZ'
-                protocol_prog = QramProtocolProgram(soccfg=self.soccfg, cfg=self.cfg)
-                avgi, avgq = protocol_prog.acquire_rotated(soc=self.im[self.cfg.aliases.soc], progress=False, angle=angles_q, threshold=thresholds_q, ge_avgs=ge_avgs_q, post_process=post_process)
+                protocol_prog = program_cache.get_program(QramProtocolProgram, self.soccfg, self.cfg)
+                avgi, avgq = protocol_prog.acquire_rotated(soc=soc, progress=False, angle=angles_q, threshold=thresholds_q, ge_avgs=ge_avgs_q, post_process=post_process, load_pulses=program_cache.needs_pulses(protocol_prog, soc))
 
                 for q in range(4):
                     data['avgi'][q].append(avgi[adc_chs[q]])
@@ -638,6 +645,7 @@ class QramProtocolExperiment(Experiment):
             data=self.data
         return data
 
+    @skip_if_headless
     def display(self, data=None, err=True, saveplot=False, **kwargs):
         if data is None:
             data=self.data 
@@ -733,6 +741,7 @@ def multihist(data, qubit, check_states, play_pulses, g_states, e_states, theta=
     play_pulses: see code for play_pulses
     g_states are indices to the check_states to categorize as "g" (the rest are "e")
     """
+    if is_headless(): plot = False
     numbins = 200
     iqshots = data['iqshots']
     if plot:
@@ -930,6 +939,7 @@ class QramProtocolSingleShotExperiment(Experiment):
         
         return data
 
+    @skip_if_headless
     def display(self, data=None, qubit=None, theta=None, check_states=None, play_pulses=None, g_states=None, e_states=None, verbose=True, **kwargs):
         if data is None:
             data=self.data 
@@ -981,6 +991,8 @@ class QramVariantsT1Experiment(Experiment):
         step: wait time sweep step
         expts: number steps in sweep
         reps: number averages per experiment
+        stop_rel_err, stop_qubit: (optional) refit after each wait time and stop the sweep early once the relative
+            uncertainty on T1 of stop_qubit (in all of avgi, avgq, amps) is below stop_rel_err
     )
     """
 
@@ -1010,12 +1022,21 @@ class QramVariantsT1Experiment(Experiment):
         self.cfg.all_qubits = [0, 1, 2, 3]
         times = self.cfg.expt.start + self.cfg.expt.step * np.arange(self.cfg.expt.expts)
 
+        stop_rel_err = self.cfg.expt.get('stop_rel_err', None)
+        if stop_rel_err is not None:
+            stop_qubit = self.cfg.expt.stop_qubit
+            stream = fitter.StreamingFit('exp')
+            stream_fit, stream_fit_err = [], []
+
         data={'times': times, 'avgi':[], 'avgq':[], 'amps':[], 'phases':[]}
+        soc = self.im[self.cfg.aliases.soc]
+        program_cache.forget_loaded(soc)
         for t in tqdm(times):
             self.cfg.expt.wait_time = float(t)
             cfg_i = deepcopy(self.cfg)
-            protocol_prog = QramVariantsProgram(soccfg=self.soccfg, cfg=cfg_i)
-            avgi, avgq = protocol_prog.acquire(soc=self.im[self.cfg.aliases.soc], load_pulses=True, progress=False)
+            # wait_time only shifts the synci immediate after state prep, patch it into the first program's machine code
+            protocol_prog = program_cache.get_program(QramVariantsProgram, self.soccfg, cfg_i, template_key='wait_time')
+            avgi, avgq = protocol_prog.acquire(soc=soc, load_pulses=program_cache.needs_pulses(protocol_prog, soc), progress=False)
             avgi = np.array(avgi)
             avgq = np.array(avgq)
             # each idata, qdata has 4 readouts, each with the number of shots
@@ -1024,6 +1045,21 @@ class QramVariantsT1Experiment(Experiment):
             data['amps'].append(np.abs(avgi+1j*avgq))
             data['phases'].append(np.angle(avgi+1j*avgq))
 
+            if stop_rel_err is not None:
+                # warm start refit with the new point, [avgi, avgq, amps] of stop_qubit
+                y_new = [avgi[stop_qubit].flatten(), avgq[stop_qubit].flatten(), np.abs(avgi+1j*avgq)[stop_qubit].flatten()]
+                stream.append(np.full(len(y_new[0]), t), y_new)
+                if stream.pOpt is None: continue
+                stream_fit.append(stream.pOpt)
+                stream_fit_err.append(stream.perr)
+                if stream.precise(3, rel_err=stop_rel_err).all(): break # analyze reports the fits to all of avgi, avgq, amps
+
+        data['times'] = times[:len(data['avgi'])] # wait times actually run
+        if stop_rel_err is not None:
+            # stream_fit: (fits, [avgi, avgq, amps], params), starting once there were enough points to fit
+            data['stream_fit'] = stream_fit
+            data['stream_fit_err'] = stream_fit_err
+
         for k, a in data.items():
             data[k] = np.array(a)
 
@@ -1045,6 +1081,7 @@ class QramVariantsT1Experiment(Experiment):
         data[f'fit_avgq_{qubit}'], data[f'fit_err_avgq_{qubit}'] = fitter.fitexp(xpts, avgq, fitparams=None)
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -1214,7 +1251,7 @@ class QramProtocol1QTomoExperiment(Experiment):
             tomo.acquire(self.im[self.cfg.aliases.soc], load_pulses=True, progress=False)
             counts = tomo.collect_counts(angle=angles_q, threshold=thresholds_q)
             data['counts_tomo'].append(counts)
-            self.pulse_dict.update({basis:tomo.pulse_dict})
+            self.pulse_dict.update({basis:tomo.pulse_params()})
 
         self.data=data
         return data
@@ -1224,6 +1261,7 @@ class QramProtocol1QTomoExperiment(Experiment):
         print('Analyze function does nothing, use the analysis notebook.')
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None: data=self.data 
         print('Display function does nothing, use the analysis notebook.')
@@ -1449,7 +1487,7 @@ class QramProtocol3QTomoExperiment(Experiment):
 
                     counts = tomo.collect_counts(angle=angles_q, threshold=thresholds_q)
                     data['counts_tomo'].append(counts)
-                    self.pulse_dict.update({basis:tomo.pulse_dict})
+                    self.pulse_dict.update({basis:tomo.pulse_params()})
 
         if self.cfg.expt.expts > 1:
             data['end_times'] = protocol_prog_g.end_times_us
@@ -1488,6 +1526,7 @@ class QramProtocol3QTomoExperiment(Experiment):
             data['fpop'] = fpop_q_times
         return data
 
+    @skip_if_headless
     def display(self, data=None, saveplot=False, **kwargs):
         if data is None: data=self.data 
         qubits = self.cfg.expt.tomo_qubits
@@ -1797,6 +1836,7 @@ class QramProtocolExperiment4Q(Experiment):
             data['fpop'] = fpop_q_times
         return data
 
+    @skip_if_headless
     def display(self, data=None, err=True, saveplot=False, **kwargs):
         if data is None:
             data=self.data 
@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -189,6 +188,7 @@ class RamseyEFExperiment(Experiment):
             data['f_ef_adjust_ramsey_amps'] = (self.cfg.expt.ramsey_freq - p_amps[1], -self.cfg.expt.ramsey_freq - p_amps[1])
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data
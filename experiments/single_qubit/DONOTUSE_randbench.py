@@ -1,6 +1,5 @@
 # Author: Connie 2022/02/17
 
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.optimize import curve_fit
 from copy import deepcopy
@@ -9,103 +8,17 @@ from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from experiments.single_qubit.single_shot import hist
 from experiments.clifford_averager_program import CliffordAveragerProgram
+from experiments.clifford_tables import clifford_1q_names, clifford_1q_index, clifford_1q_matrix, total_clifford
 from experiments.two_qubit.twoQ_state_tomography import ErrorMitigationStateTomo2QProgram
 
 """
-Define matrices representing (all) Clifford gates for single
-qubit in the basis of Z, X, Y, -Z, -X, -Y, indicating
-where on the 6 cardinal points of the Bloch sphere the
-+Z, +X, +Y axes go after each gate. Each Clifford gate
-can be uniquely identified just by checking where +X and +Y
-go.
+Single qubit Clifford gates are precompiled into integer tables in experiments.clifford_tables:
+clifford_1q_names lists the 24 Cliffords, and composing a sequence is a lookup in clifford_1q_mult.
 """
-clifford_1q = dict()
-clifford_1q['Z'] = np.matrix([[1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0]])
-clifford_1q['X'] = np.matrix([[0, 0, 0, 1, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 1, 0, 0, 0]])
-clifford_1q['Y'] = np.matrix([[0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1]])
-clifford_1q['Z/2'] = np.matrix([[1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0]])
-clifford_1q['X/2'] = np.matrix([[0, 0, 1, 0, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 0, 0, 0, 1, 0],
-                             [1, 0, 0, 0, 0, 0]])
-clifford_1q['Y/2'] = np.matrix([[0, 0, 0, 0, 1, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 0, 1]])
-clifford_1q['-Z/2'] = np.matrix([[1, 0, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 1, 0, 0, 0, 0]])
-clifford_1q['-X/2'] = np.matrix([[0, 0, 0, 0, 0, 1],
-                             [0, 1, 0, 0, 0, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 0, 1, 0, 0]])
-clifford_1q['-Y/2'] = np.matrix([[0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1]])
-clifford_1q['I'] = np.diag([1]*6)
-
-# Read pulse as a matrix product acting on state (meaning apply pulses in reverse order of the tuple)
-two_step_pulses= [
-    ('X','Z/2'), ('X/2','Z/2'), ('-X/2','Z/2'),
-    ('Y','Z/2'), ('Y/2','Z/2'), ('-Y/2','Z/2'),
-    ('X','Z'), ('X/2','Z'), ('-X/2','Z'),
-    ('Y','Z'), ('Y/2','Z'), ('-Y/2','Z'),
-    ('X','-Z/2'), ('X/2','-Z/2'), ('-X/2','-Z/2'),
-    ('Y','-Z/2'), ('Y/2','-Z/2'), ('-Y/2','-Z/2'),
-]
-# Get rid of repeats
-for pulse in two_step_pulses:
-    new_mat = clifford_1q[pulse[0]] @ clifford_1q[pulse[1]]
-    repeat = False
-    for existing_pulse_name, existing_pulse in clifford_1q.items():
-        if np.array_equal(new_mat, existing_pulse):
-            # print(pulse, existing_pulse_name)
-            repeat = True
-    if not repeat: clifford_1q[pulse[0]+','+pulse[1]] = new_mat
-clifford_1q_names = list(clifford_1q.keys())
-
-for name, matrix in clifford_1q.items():
-    z_new = np.argmax(matrix[:,0]) # +Z goes to row where col 0 is 1
-    x_new = np.argmax(matrix[:,1]) # +X goes to row where col 1 is 1
-    # print(name, z_new, x_new)
-    clifford_1q[name] = (matrix, (z_new, x_new))
-
 def gate_sequence(rb_depth, debug=False):
     """
     Generate RB forward gate sequence of length rb_depth as a list of pulse names;
@@ -115,22 +28,9 @@ def gate_sequence(rb_depth, debug=False):
     pulse_n_seq = (len(clifford_1q_names)*np.random.rand(rb_depth)).astype(int)
     if debug: print('pulse seq', pulse_n_seq)
     pulse_name_seq = [clifford_1q_names[n] for n in pulse_n_seq]
-    psi_nz = np.matrix([[1, 0, 0, 0, 0, 0]]).transpose()
-    psi_nx = np.matrix([[0, 1, 0, 0, 0, 0]]).transpose()
-    for n in pulse_n_seq: # n is index in clifford_1q_names
-        gates = clifford_1q_names[n].split(',')
-        for gate in reversed(gates): # Apply matrices from right to left of gates
-            psi_nz = clifford_1q[gate][0] @ psi_nz
-            psi_nx = clifford_1q[gate][0] @ psi_nx
-    psi_nz = psi_nz.flatten()
-    psi_nx = psi_nx.flatten()
-    if debug: print('+Z axis after seq:', psi_nz, '+X axis after seq:', psi_nx)
-    for clifford in clifford_1q_names: # Get the clifford equivalent to the total seq
-        if clifford_1q[clifford][1] == (np.argmax(psi_nz), np.argmax(psi_nx)):
-            total_clifford = clifford
-            break
-    if debug: print('Total gate matrix:\n', clifford_1q[total_clifford][0])
-    return pulse_name_seq, total_clifford
+    total_clifford_name = clifford_1q_names[total_clifford(pulse_n_seq)] # Get the clifford equivalent to the total seq
+    if debug: print('Total gate matrix:\n', clifford_1q_matrix(total_clifford_name))
+    return pulse_name_seq, total_clifford_name
 
 def rb_func(depth, alpha, a, b):
     return a*alpha**depth + b
@@ -157,7 +57,7 @@ class SimultaneousRBProgram(CliffordAveragerProgram):
         Convert a clifford pulse name into the function that performs the pulse.
         """
         pulse_name = pulse_name.upper()
-        assert pulse_name in clifford_1q_names
+        assert pulse_name in clifford_1q_index
         gates = pulse_name.split(',')
         for gate in reversed(gates):
             print(gate)
@@ -377,6 +277,7 @@ class SimultaneousRBExperiment(Experiment):
                 data['error'][iq] = rb_error(popt[0], dim=len(self.cfg.expt.qubits))
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -1,10 +1,8 @@
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 import numpy as np
 from qick import *
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 import time
 
 import experiments.fitting as fitter
@@ -205,6 +203,7 @@ class ACStarkShiftPulseProbeExperiment(Experiment):
             data=self.data
         pass
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
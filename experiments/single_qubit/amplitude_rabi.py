@@ -1,13 +1,11 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless, is_headless
 
 import scipy as sp
-import matplotlib.pyplot as plt
 
 import experiments.fitting as fitter
 
@@ -42,11 +40,12 @@ class AmplitudeRabiProgram(RAveragerProgram):
         t = np.arange(0, np.round(times_samps[-1]))
         iamps = I_func(t)
         qamps = Q_func(t)
-        plt.plot(iamps, '.-')
-        # plt.plot(times_samps, I_func(times_samps), '.-')
-        plt.plot(qamps, '.-')
-        # plt.plot(times_samps, Q_func(times_samps), '.-')
-        plt.show()
+        if not is_headless():
+            plt.plot(iamps, '.-')
+            # plt.plot(times_samps, I_func(times_samps), '.-')
+            plt.plot(qamps, '.-')
+            # plt.plot(times_samps, Q_func(times_samps), '.-')
+            plt.show()
         self.add_pulse(ch=ch, name=name, idata=maxv*iamps, qdata=maxv*qamps)        
 
     def __init__(self, soccfg, cfg):
@@ -462,8 +461,10 @@ class AmplitudeRabiExperiment(Experiment):
             data['fit_err_avgi'] = pCov_avgi   
             data['fit_err_avgq'] = pCov_avgq
             data['fit_err_amps'] = pCov_amps
+            data['best_fit'], data['best_fit_err'] = fitter.get_best_fit(data, fitter.sinfunc, fit_slice=slice(None, -1))
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -623,6 +624,7 @@ class AmplitudeRabiChevronExperiment(Experiment):
             data=self.data
         pass
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 from copy import deepcopy
 
 from qick import *
@@ -8,7 +7,9 @@ from qick.helpers import gauss
 from slab import Experiment, dsfit, AttrDict
 
 import experiments.fitting as fitter
+from experiments import program_cache
 from experiments.single_qubit.single_shot import hist
+from experiments.clifford_averager_program import post_process_shots
 from experiments.two_qubit.twoQ_state_tomography import ErrorMitigationStateTomo2QProgram, sort_counts, correct_readout_err, fix_neg_counts
 
 """
@@ -224,43 +225,10 @@ class LengthRabiProgram(AveragerProgram):
     If post_process == 'scale': uses angle + ge_avgs to scale the average of all shots on a scale of 0 to 1. ge_avgs should be of shape (num_total_qubits, 4) and should represent the pre-rotation Ig, Qg, Ie, Qe
     If post_process == None: uses angle to rotate the i and q and then returns the avg i and q
     """
-    def acquire_rotated(self, soc, progress, angle=None, threshold=None, ge_avgs=None, post_process=None, verbose=False):
-        avgi, avgq = self.acquire(soc, load_pulses=True, progress=progress)
-        if post_process == None: 
-            avgi_rot, avgq_rot, avgi_err, avgq_err = self.get_shots(angle=angle, avg_shots=True, verbose=verbose, return_err=True)
-            if angle is None: return avgi_rot, avgq_rot
-            else: return avgi_rot, avgi_err
-        elif post_process == 'threshold':
-            assert threshold is not None
-            popln, avgq_rot, popln_err, avgq_err = self.get_shots(angle=angle, threshold=threshold, avg_shots=True, verbose=verbose, return_err=True)
-            return popln, popln_err
-        elif post_process == 'scale':
-            assert ge_avgs is not None
-            avgi_rot, avgq_rot, avgi_err, avgq_err = self.get_shots(angle=angle, avg_shots=True, verbose=verbose, return_err=True)
-
-            ge_avgs_rot = [None]*4
-            for q, angle_q in enumerate(angle):
-                if not isinstance(ge_avgs[q], (list, np.ndarray)): continue # this qubit was not calibrated
-                Ig_q, Qg_q, Ie_q, Qe_q = ge_avgs[q]
-                ge_avgs_rot[q] = [
-                    Ig_q*np.cos(np.pi/180*angle_q) - Qg_q*np.sin(np.pi/180*angle_q),
-                    Ie_q*np.cos(np.pi/180*angle_q) - Qe_q*np.sin(np.pi/180*angle_q)
-                ]
-            shape = None
-            for q in range(4):
-                if ge_avgs_rot[q] is not None:
-                    shape = np.shape(ge_avgs_rot[q])
-                    break
-            for q in range(4):
-                if ge_avgs_rot[q] is None: ge_avgs_rot[q] = np.zeros(shape=shape)
-                
-            ge_avgs_rot = np.asarray(ge_avgs_rot)
-            avgi_rot -= ge_avgs_rot[:,0]
-            avgi_rot /= ge_avgs_rot[:,1] - ge_avgs_rot[:,0]
-            avgi_err /= ge_avgs_rot[:,1] - ge_avgs_rot[:,0]
-            return avgi_rot, avgi_err
-        else:
-            assert False, 'Undefined post processing flag, options are None, threshold, scale'
+    def acquire_rotated(self, soc, progress, angle=None, threshold=None, ge_avgs=None, post_process=None, verbose=False, load_pulses=True):
+        avgi, avgq = self.acquire(soc, load_pulses=load_pulses, progress=progress)
+        scale = [1/ro['length'] for ch, ro in self.ro_chs.items()]
+        return post_process_shots(self.di_buf, self.dq_buf, scale=scale, angle=angle, threshold=threshold, ge_avgs=ge_avgs, post_process=post_process, verbose=verbose)
 
 
 # ====================================================== #
@@ -302,11 +270,13 @@ class LengthRabiExperiment(Experiment):
 
         data={"xpts":[], "avgi":[], "avgq":[], "amps":[], "phases":[]}
 
+        soc = self.im[self.cfg.aliases.soc]
+        program_cache.forget_loaded(soc)
         for length in tqdm(lengths, disable=not progress):
             self.cfg.expt.length_placeholder = float(length)
-            lengthrabi = LengthRabiProgram(soccfg=self.soccfg, cfg=self.cfg)
+            lengthrabi = program_cache.get_program(LengthRabiProgram, self.soccfg, self.cfg)
             self.prog = lengthrabi
-            avgi, avgq = lengthrabi.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=True, progress=False)        
+            avgi, avgq = lengthrabi.acquire(soc, threshold=None, load_pulses=program_cache.needs_pulses(lengthrabi, soc), progress=False)        
             avgi = avgi[0][0]
             avgq = avgq[0][0]
             amp = np.abs(avgi+1j*avgq) # Calculating the magnitude
@@ -324,7 +294,10 @@ class LengthRabiExperiment(Experiment):
 
         return data
 
-    def analyze(self, data=None, fit=True, fit_func='decaysin'):
+    def analyze(self, data=None, fit=True, fit_func='decaysin', fast=False):
+        """
+        fast: use the matrix pencil estimate instead of a nonlinear fit (only for fit_func = 'decaysin')
+        """
         if data is None:
             data=self.data
         if fit:
@@ -338,17 +311,21 @@ class LengthRabiExperiment(Experiment):
             fitparams[1]=2.0/xdata[-1]
             if fit_func == 'decaysin': fit_fitfunc = fitter.fitdecaysin
             elif fit_func == 'sin': fit_fitfunc = fitter.fitsin
-            p_avgi, pCov_avgi = fit_fitfunc(data['xpts'][:-1], data["avgi"][:-1], fitparams=fitparams)
-            p_avgq, pCov_avgq = fit_fitfunc(data['xpts'][:-1], data["avgq"][:-1], fitparams=fitparams)
-            p_amps, pCov_amps = fit_fitfunc(data['xpts'][:-1], data["amps"][:-1], fitparams=fitparams)
+            fit_kwargs = dict(fast=fast) if fit_func == 'decaysin' else dict()
+            p_avgi, pCov_avgi = fit_fitfunc(data['xpts'][:-1], data["avgi"][:-1], fitparams=fitparams, **fit_kwargs)
+            p_avgq, pCov_avgq = fit_fitfunc(data['xpts'][:-1], data["avgq"][:-1], fitparams=fitparams, **fit_kwargs)
+            p_amps, pCov_amps = fit_fitfunc(data['xpts'][:-1], data["amps"][:-1], fitparams=fitparams, **fit_kwargs)
             data['fit_avgi'] = p_avgi   
             data['fit_avgq'] = p_avgq
             data['fit_amps'] = p_amps
             data['fit_err_avgi'] = pCov_avgi   
             data['fit_err_avgq'] = pCov_avgq
             data['fit_err_amps'] = pCov_amps
+            model = fitter.decaysin if fit_func == 'decaysin' else fitter.sinfunc
+            data['best_fit'], data['best_fit_err'] = fitter.get_best_fit(data, model, fit_slice=slice(None, -1))
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, fit_func='decaysin'):
         if data is None:
             data=self.data 
@@ -542,13 +519,16 @@ class NPulseExperiment(Experiment):
         self.cfg.expt.length_placeholder = float(length)
 
         if 'loops' not in self.cfg.expt: self.cfg.expt.loops = 1
+        soc = self.im[self.cfg.aliases.soc]
+        program_cache.forget_loaded(soc)
         for loop in tqdm(range(self.cfg.expt.loops), disable=not progress or self.cfg.expt.loops == 1):
             for n_cycle in tqdm(cycles, disable=not progress or self.cfg.expt.loops > 1):
 
                 self.cfg.expt.n_pulses = n_cycle
-                lengthrabi = LengthRabiProgram(soccfg=self.soccfg, cfg=self.cfg)
+                # same program for every loop, only built and compiled in the first one
+                lengthrabi = program_cache.get_program(LengthRabiProgram, self.soccfg, self.cfg)
                 self.prog = lengthrabi
-                avgi, avgq = lengthrabi.acquire_rotated(self.im[self.cfg.aliases.soc], angle=angles_q, threshold=thresholds_q, ge_avgs=ge_avgs_q, post_process=self.cfg.expt.post_process, progress=False, verbose=False)        
+                avgi, avgq = lengthrabi.acquire_rotated(soc, angle=angles_q, threshold=thresholds_q, ge_avgs=ge_avgs_q, post_process=self.cfg.expt.post_process, progress=False, verbose=False, load_pulses=program_cache.needs_pulses(lengthrabi, soc))        
                 avgi = avgi[0][0]
                 avgq = avgq[0][0]
                 amp = np.abs(avgi+1j*avgq) # Calculating the magnitude
@@ -592,6 +572,7 @@ class NPulseExperiment(Experiment):
                 data[f'fit_err_{fit_axis}'] = pCov
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, scale=None):
         if data is None:
             data=self.data 
@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -165,6 +164,7 @@ class PulseProbeEFSpectroscopyExperiment(Experiment):
             data['fit_avgq'], data['fit_err_avgq'] = fitter.fitlor(xdata, signs[2]*data['avgq'][1:-1])
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, signs=[1,1], **kwargs):
         if data is None:
             data=self.data 
@@ -285,6 +285,7 @@ class PulseProbeEFPowerSweepSpectroscopyExperiment(Experiment):
 
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -1,10 +1,8 @@
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
 import numpy as np
 from qick import *
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, gridspec, tqdm, skip_if_headless
 import time
 
 import experiments.fitting as fitter
@@ -171,6 +169,7 @@ class PulseProbeSpectroscopyExperiment(Experiment):
             data['fit_avgq'], data['fit_err_avgq'] = fitter.fitlor(xdata, signs[2]*data['avgq'][1:-1])
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, signs=[1,1,1], **kwargs):
         if data is None:
             data=self.data 
@@ -359,6 +358,7 @@ class PulseProbeVoltSweepSpectroscopyExperiment(Experiment):
         #     data["rspec_phases"].append(rspec_data['phases'])
         #     data["rspec_fits"].append(rspec_data['fit'])
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
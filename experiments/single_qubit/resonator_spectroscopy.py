@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 import time
 from copy import deepcopy
 
@@ -10,8 +9,9 @@ from slab import Experiment, dsfit, AttrDict
 
 import experiments.fitting as fitter
 from experiments.single_qubit.single_shot import HistogramProgram
+from experiments.config_cache import CachedConfigMixin
 
-class ResonatorSpectroscopyExperiment(Experiment):
+class ResonatorSpectroscopyExperiment(CachedConfigMixin, Experiment):
     """
     Resonator Spectroscopy Experiment - just reuses histogram experiment because somehow it's better
     Experimental Config
@@ -74,7 +74,11 @@ class ResonatorSpectroscopyExperiment(Experiment):
 
         return data
 
-    def analyze(self, data=None, fit=False, findpeaks=False, verbose=True, **kwargs):
+    def analyze(self, data=None, fit=False, findpeaks=False, verbose=True, fit_method='amps', **kwargs):
+        """
+        fit_method: 'amps' fits |S21| with fitter.fithanger, 'circle' fits the complex S21 with fitter.fithanger_circle
+        (non-iterative, uses both avgi and avgq)
+        """
         if data is None:
             data=deepcopy(self.data)
         
@@ -103,7 +107,9 @@ class ResonatorSpectroscopyExperiment(Experiment):
             # ydata = data["avgi"][1:-1] + 1j*data["avgq"][1:-1]
             ydata = data['amps'][1:-1]
             fitparams=None
-            data['fit'], data['fit_err'] = fitter.fithanger(xdata, ydata, fitparams=fitparams)
+            if fit_method == 'circle':
+                data['fit'], data['fit_err'] = fitter.fithanger_circle(xdata, data['avgi'][1:-1] + 1j*data['avgq'][1:-1])
+            else: data['fit'], data['fit_err'] = fitter.fithanger(xdata, ydata, fitparams=fitparams)
             if isinstance(data['fit'], (list, np.ndarray)):
                 f0, Qi, Qe, phi, scale, a0, slope = data['fit']
                 if 'lo' in self.cfg.hw:
@@ -129,6 +135,7 @@ class ResonatorSpectroscopyExperiment(Experiment):
             
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, findpeaks=False, **kwargs):
         if data is None:
             data=self.data 
@@ -250,24 +257,37 @@ class ResonatorPowerSweepSpectroscopyExperiment(Experiment):
         self.data = data
         return data
 
-    def analyze(self, data=None, fit=True, highgain=None, lowgain=None, **kwargs):
+    def analyze(self, data=None, fit=True, highgain=None, lowgain=None, fit_method='amps', **kwargs):
+        """
+        fit_method: 'amps' fits a Lorentzian to the amps at highgain and lowgain only, 'circle' fits every gain row at
+        once with fitter.fithanger_circle_batch on the complex S21 (fit params [f0, Qi, Qe, phi, scale, a0, slope] for
+        each gain in data['fit_circle'])
+        """
         if data is None:
             data=self.data
         
-        # Lorentzian fit at highgain [DAC units] and lowgain [DAC units]
+        # Fit at highgain [DAC units] and lowgain [DAC units]
         if fit:
             if highgain == None: highgain = data['gainpts'][-1]
             if lowgain == None: lowgain = data['gainpts'][0]
             i_highgain = np.argmin(np.abs(data['gainpts']-highgain))
             i_lowgain = np.argmin(np.abs(data['gainpts']-lowgain))
-            fit_highpow=dsfit.fitlor(data["xpts"], data["amps"][i_highgain])
-            fit_lowpow=dsfit.fitlor(data["xpts"], data["amps"][i_lowgain])
+            if fit_method == 'circle':
+                data['fit_circle'], data['fit_circle_err'] = fitter.fithanger_circle_batch(data["xpts"], data["avgi"] + 1j*data["avgq"])
+                fit_highpow = data['fit_circle'][i_highgain]
+                fit_lowpow = data['fit_circle'][i_lowgain]
+                data['fit_f0'] = [fit_highpow[0], fit_lowpow[0]]
+            else:
+                fit_highpow=dsfit.fitlor(data["xpts"], data["amps"][i_highgain])
+                fit_lowpow=dsfit.fitlor(data["xpts"], data["amps"][i_lowgain])
+                data['fit_f0'] = [fit_highpow[2], fit_lowpow[2]]
             data['fit'] = [fit_highpow, fit_lowpow]
             data['fit_gains'] = [highgain, lowgain]
-            data['lamb_shift'] = fit_highpow[2] - fit_lowpow[2]
+            data['lamb_shift'] = data['fit_f0'][0] - data['fit_f0'][1]
         
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, select=None, **kwargs):
         if data is None:
             data=self.data 
@@ -294,14 +314,15 @@ class ResonatorPowerSweepSpectroscopyExperiment(Experiment):
         plt.pcolormesh(x_sweep, y_sweep, amps, cmap='viridis', shading='auto')
         
         if fit:
-            fit_highpow, fit_lowpow = data['fit']
+            if 'fit_f0' in data: f0_highpow, f0_lowpow = data['fit_f0']
+            else: f0_highpow, f0_lowpow = data['fit'][0][2], data['fit'][1][2] # Lorentzian fits from before fit_f0 was saved
             highgain, lowgain = data['fit_gains']
-            plt.axvline(fit_highpow[2], linewidth=0.5, color='0.2')
-            plt.axvline(fit_lowpow[2], linewidth=0.5, color='0.2')
+            plt.axvline(f0_highpow, linewidth=0.5, color='0.2')
+            plt.axvline(f0_lowpow, linewidth=0.5, color='0.2')
             plt.plot(x_sweep, [highgain]*len(x_sweep), linewidth=0.5, color='0.2')
             plt.plot(x_sweep, [lowgain]*len(x_sweep), linewidth=0.5, color='0.2')
-            print(f'High power peak [MHz]: {fit_highpow[2]}')
-            print(f'Low power peak [MHz]: {fit_lowpow[2]}')
+            print(f'High power peak [MHz]: {f0_highpow}')
+            print(f'Low power peak [MHz]: {f0_lowpow}')
             print(f'Lamb shift [MHz]: {data["lamb_shift"]}')
 
         # plt.title(f"Resonator Spectroscopy Power Sweep")
@@ -411,6 +432,7 @@ class ResonatorVoltSweepSpectroscopyExperiment(Experiment):
             data=self.data
         pass
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from qick import *
 from slab import Experiment, dsfit, AttrDict
@@ -120,6 +119,7 @@ class ToFCalibrationExperiment(Experiment):
             data=self.data
         return data
 
+    @skip_if_headless
     def display(self, data=None, adc_trig_offset=0, **kwargs):
         if data is None:
             data=self.data 
@@ -1,16 +1,17 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 from copy import deepcopy
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless, is_headless
+from experiments.config_cache import CachedConfigMixin
 
 def hist(data, plot=True, span=None, verbose=True, title=None):
     """
     span: histogram limit is the mean +/- span
     """
+    if is_headless(): plot = False
     Ig = data['Ig']
     Qg = data['Qg']
     Ie = data['Ie']
@@ -372,7 +373,7 @@ class HistogramProgram(AveragerProgram):
         # return shots_i0[:5000], shots_q0[:5000]
 
 
-class HistogramExperiment(Experiment):
+class HistogramExperiment(CachedConfigMixin, Experiment): # constructed per point by SingleShotOptExperiment
     """
     Histogram Experiment
     expt = dict(
@@ -473,6 +474,7 @@ class HistogramExperiment(Experiment):
         
         return data
 
+    @skip_if_headless
     def display(self, data=None, span=None, verbose=True, **kwargs):
         if data is None:
             data=self.data 
@@ -581,6 +583,7 @@ class SingleShotOptExperiment(Experiment):
 
         return imax
 
+    @skip_if_headless
     def display(self, data=None, **kwargs):
         if data is None:
             data=self.data 
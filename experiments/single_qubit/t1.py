@@ -1,11 +1,9 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpl_patches
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -123,6 +121,8 @@ class T1Experiment(Experiment):
         expts: number steps in sweep
         reps: number averages per experiment
         rounds: number rounds to repeat experiment sweep
+        stop_rel_err: (optional) run the rounds one at a time, refitting after each, and stop early once the
+            relative uncertainty on T1 (in all of avgi, avgq, amps) is below this. rounds is then the max rounds.
     )
     """
 
@@ -145,19 +145,53 @@ class T1Experiment(Experiment):
             self.cfg.expt.checkEF = False
         if self.cfg.expt.checkEF:
             self.cfg.device.readout.frequency = self.cfg.device.readout.frequency_ef
-        t1 = T1Program(soccfg=self.soccfg, cfg=self.cfg)
-        x_pts, avgi, avgq = t1.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=True, progress=progress)
+        stop_rel_err = self.cfg.expt.get('stop_rel_err', None)
+        if stop_rel_err is None:
+            t1 = T1Program(soccfg=self.soccfg, cfg=self.cfg)
+            x_pts, avgi, avgq = t1.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=True, progress=progress)
+            avgi = avgi[0][0]
+            avgq = avgq[0][0]
+            stream = None
+        else:
+            x_pts, avgi, avgq, stream = self.acquire_streaming(stop_rel_err, progress=progress)
 
-        avgi = avgi[0][0]
-        avgq = avgq[0][0]
         amps = np.abs(avgi+1j*avgq) # Calculating the magnitude
         phases = np.angle(avgi+1j*avgq) # Calculating the phase        
 
         data={'xpts': x_pts, 'avgi':avgi, 'avgq':avgq, 'amps':amps, 'phases':phases}
+        if stream is not None: data.update(stream)
         self.data=data
         return data
 
-    def analyze(self, data=None, fit_log=True, fit_slice=None):
+    def acquire_streaming(self, stop_rel_err, progress=False):
+        """
+        Acquire one round at a time, warm start refitting the running average after each round. Stops once T1 is
+        known to stop_rel_err or after expt.rounds rounds. Returns x_pts, avgi, avgq, and the fit after each round.
+        """
+        max_rounds = self.cfg.expt.rounds
+        assert max_rounds >= 1, 'Need at least 1 round to acquire'
+        self.cfg.expt.rounds = 1
+        t1 = T1Program(soccfg=self.soccfg, cfg=self.cfg)
+        stream = fitter.StreamingFit('exp')
+        sum_i, sum_q = 0, 0
+        stream_fit, stream_fit_err = [], []
+        for rnd in tqdm(range(max_rounds), disable=not progress):
+            x_pts, avgi, avgq = t1.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=(rnd==0), progress=False)
+            sum_i = sum_i + avgi[0][0]
+            sum_q = sum_q + avgq[0][0]
+            avgi, avgq = sum_i/(rnd+1), sum_q/(rnd+1)
+            stream.update(x_pts, [avgi, avgq, np.abs(avgi+1j*avgq)])
+            stream_fit.append(stream.pOpt)
+            stream_fit_err.append(stream.perr)
+            if stream.precise(3, rel_err=stop_rel_err).all(): break # analyze reports the fits to all of avgi, avgq, amps
+        self.cfg.expt.rounds = rnd+1 # rounds actually run
+        # stream_fit: (rounds, [avgi, avgq, amps], params)
+        return x_pts, avgi, avgq, dict(stream_fit=np.array(stream_fit), stream_fit_err=np.array(stream_fit_err))
+
+    def analyze(self, data=None, fit_log=True, fit_slice=None, fast=False):
+        """
+        fast: use the closed form exponential estimate when it is already as good as the nonlinear fit
+        """
         if data is None:
             data=self.data
             
@@ -168,7 +202,7 @@ class T1Experiment(Experiment):
         for fit_axis in ['avgi', 'avgq', 'amps']:
             ypts_fit = data[fit_axis]
 
-            data[f'fit_{fit_axis}'], data[f'fit_err_{fit_axis}'] = fitter.fitexp(xpts, ypts_fit, fitparams=None)
+            data[f'fit_{fit_axis}'], data[f'fit_err_{fit_axis}'] = fitter.fitexp(xpts, ypts_fit, fitparams=None, fast=fast)
 
             if not fit_log: continue
 
@@ -189,8 +223,12 @@ class T1Experiment(Experiment):
             ypts_logscale = np.log(ypts_fit)
 
             data[f'fit_log_{fit_axis}'], data[f'fit_log_err_{fit_axis}'] = fitter.fitlogexp(xpts_fit, ypts_logscale, fitparams=None)
+
+        # best of the three fits goes in data['best_fit_axis']
+        data['best_fit'], data['best_fit_err'] = fitter.get_best_fit(data, fitter.expfunc)
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, fit_log=True):
         if data is None:
             data=self.data 
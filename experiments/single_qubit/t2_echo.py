@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -267,6 +266,7 @@ class RamseyEchoExperiment(Experiment):
             # data['f_ge_adjust_ramsey_amps'] = sorted((self.cfg.expt.ramsey_freq - p_amps[1], -self.cfg.expt.ramsey_freq - p_amps[1]), key=abs)
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data
@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -256,6 +255,8 @@ class RamseyExperiment(Experiment):
         checkZZ: True/False for putting another qubit in e (specify as qA)
         checkEF: does ramsey on the EF transition instead of ge
         qubits: if not checkZZ, just specify [1 qubit]. if checkZZ: [qA in e , qB sweeps length rabi]
+        stop_freq_err: (optional) run the rounds one at a time, refitting after each, and stop early once the
+            uncertainty on the ramsey freq [MHz] (in all of avgi, avgq, amps) is below this. rounds is then the max rounds.
     )
     """
 
@@ -275,20 +276,57 @@ class RamseyExperiment(Experiment):
                 elif not(isinstance(value, list)):
                     subcfg.update({key: [value]*num_qubits_sample})
 
-        ramsey = RamseyProgram(soccfg=self.soccfg, cfg=self.cfg)
-        
-        x_pts, avgi, avgq = ramsey.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=True, progress=progress)
+        stop_freq_err = self.cfg.expt.get('stop_freq_err', None)
+        if stop_freq_err is None:
+            ramsey = RamseyProgram(soccfg=self.soccfg, cfg=self.cfg)
+            x_pts, avgi, avgq = ramsey.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=True, progress=progress)
+            avgi = avgi[0][0]
+            avgq = avgq[0][0]
+            stream = None
+        else:
+            x_pts, avgi, avgq, stream = self.acquire_streaming(stop_freq_err, progress=progress)
  
-        avgi = avgi[0][0]
-        avgq = avgq[0][0]
         amps = np.abs(avgi+1j*avgq) # Calculating the magnitude
         phases = np.angle(avgi+1j*avgq) # Calculating the phase
 
         data={'xpts': x_pts, 'avgi':avgi, 'avgq':avgq, 'amps':amps, 'phases':phases}        
+        if stream is not None: data.update(stream)
         self.data=data
         return data
 
-    def analyze(self, data=None, fit=True, fit_num_sin=1):
+    def acquire_streaming(self, stop_freq_err, progress=False):
+        """
+        Acquire one round at a time, warm start refitting the running average after each round. Stops once the
+        ramsey freq is known to stop_freq_err or after expt.rounds rounds. Returns x_pts, avgi, avgq, and the fit
+        after each round.
+        """
+        max_rounds = self.cfg.expt.rounds
+        assert max_rounds >= 1, 'Need at least 1 round to acquire'
+        self.cfg.expt.rounds = 1
+        ramsey = RamseyProgram(soccfg=self.soccfg, cfg=self.cfg)
+        stream = fitter.StreamingFit('decaysin', fitparams=[None, self.cfg.expt.ramsey_freq, None, None, None])
+        sum_i, sum_q = 0, 0
+        stream_fit, stream_fit_err = [], []
+        for rnd in tqdm(range(max_rounds), disable=not progress):
+            x_pts, avgi, avgq = ramsey.acquire(self.im[self.cfg.aliases.soc], threshold=None, load_pulses=(rnd==0), progress=False)
+            sum_i = sum_i + avgi[0][0]
+            sum_q = sum_q + avgq[0][0]
+            avgi, avgq = sum_i/(rnd+1), sum_q/(rnd+1)
+            # same as analyze, leave out the last point
+            stream.update(x_pts[:-1], [avgi[:-1], avgq[:-1], np.abs(avgi+1j*avgq)[:-1]])
+            stream_fit.append(stream.pOpt)
+            stream_fit_err.append(stream.perr)
+            if stream.precise(1, abs_err=stop_freq_err).all(): break # analyze reports the fits to all of avgi, avgq, amps
+        self.cfg.expt.rounds = rnd+1 # rounds actually run
+        # stream_fit: (rounds, [avgi, avgq, amps], params)
+        return x_pts, avgi, avgq, dict(stream_fit=np.array(stream_fit), stream_fit_err=np.array(stream_fit_err))
+
+    def analyze(self, data=None, fit=True, fit_num_sin=1, fast=False, n_starts=0, workers=None):
+        """
+        fast: use the matrix pencil estimate instead of a nonlinear fit (only for fit_num_sin = 1 or 2)
+        n_starts, workers: multi-start fit with n_starts starts on workers processes (only for fit_num_sin = 2 or 3),
+            also stores the spread of the equally good solutions in fit_spread_{avgi,avgq,amps}
+        """
         if data is None:
             data=self.data
 
@@ -320,15 +358,27 @@ class RamseyExperiment(Experiment):
             else:
                 fitfunc = fitter.fitdecaysin
                 fitparams=[None, self.cfg.expt.ramsey_freq, None, None, None]
-            p_avgi, pCov_avgi = fitfunc(data['xpts'][:-1], data["avgi"][:-1], fitparams=fitparams)
-            p_avgq, pCov_avgq = fitfunc(data['xpts'][:-1], data["avgq"][:-1], fitparams=fitparams)
-            p_amps, pCov_amps = fitfunc(data['xpts'][:-1], data["amps"][:-1], fitparams=fitparams)
+            multistart = n_starts > 0 and fit_num_sin in (2, 3)
+            assert not (fast and multistart), 'fast and n_starts > 0 are mutually exclusive'
+            if multistart: multistartfunc = {2: fitter.fittwofreq_decaysin_multistart, 3: fitter.fitthreefreq_decaysin_multistart}[fit_num_sin]
+            fit_kwargs = dict(fast=fast) if fit_num_sin in (1, 2) else dict()
+            fits = dict()
+            for fit_axis in ['avgi', 'avgq', 'amps']:
+                if multistart: # also returns the spread of the equally good solutions
+                    p, pCov, data[f'fit_spread_{fit_axis}'] = multistartfunc(data['xpts'][:-1], data[fit_axis][:-1], fitparams=fitparams, n_starts=n_starts, workers=workers)
+                else: p, pCov = fitfunc(data['xpts'][:-1], data[fit_axis][:-1], fitparams=fitparams, **fit_kwargs)
+                fits[fit_axis] = (p, pCov)
+            p_avgi, pCov_avgi = fits['avgi']
+            p_avgq, pCov_avgq = fits['avgq']
+            p_amps, pCov_amps = fits['amps']
             data['fit_avgi'] = p_avgi   
             data['fit_avgq'] = p_avgq
             data['fit_amps'] = p_amps
             data['fit_err_avgi'] = pCov_avgi   
             data['fit_err_avgq'] = pCov_avgq
             data['fit_err_amps'] = pCov_amps
+            model = {2: fitter.twofreq_decaysin, 3: fitter.threefreq_decaysin}.get(fit_num_sin, fitter.decaysin)
+            data['best_fit'], data['best_fit_err'] = fitter.get_best_fit(data, model, fit_slice=slice(None, -1))
 
             # print('p avgi', p_avgi)
             # print('p avgq', p_avgq)
@@ -344,6 +394,7 @@ class RamseyExperiment(Experiment):
                 data['f_adjust_ramsey_amps2'] = sorted((self.cfg.expt.ramsey_freq - p_amps[5], -self.cfg.expt.ramsey_freq - p_amps[5]), key=abs)
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, fit_num_sin=1):
         if data is None:
             data=self.data
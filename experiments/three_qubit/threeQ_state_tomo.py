@@ -1,11 +1,10 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 import json
 from copy import deepcopy
 
 from slab import Experiment, NpEncoder, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from experiments.clifford_averager_program import QutritAveragerProgram, CliffordAveragerProgram
 from experiments.single_qubit.single_shot import hist
@@ -344,7 +343,7 @@ class TestStateTomo3QExperiment(Experiment):
 
             counts = tomo.collect_counts(angle=angles_q, threshold=thresholds_q)
             data['counts_tomo'].append(counts)
-            self.pulse_dict.update({basis:tomo.pulse_dict})
+            self.pulse_dict.update({basis:tomo.pulse_params()})
 
         self.data=data
         return data
@@ -354,6 +353,7 @@ class TestStateTomo3QExperiment(Experiment):
         print('Analyze function does nothing, use the analysis notebook.')
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None: data=self.data 
         print('Display function does nothing, use the analysis notebook.')
@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -330,6 +329,7 @@ class AmplitudeRabiEgGfExperiment(Experiment):
             data['fitB_err_amps'] = pCovB_amps
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -505,6 +505,7 @@ class EgGfLenGainChevronExperiment(Experiment):
         pass
             
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -630,6 +631,7 @@ class EgGfFreqGainChevronExperiment(Experiment):
         pass
             
 
+    @skip_if_headless
     def display(self, data=None, fit=True, plot_freq=None, plot_gain=None, saveplot=False, **kwargs):
         if data is None:
             data=self.data 
@@ -1,13 +1,13 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from copy import deepcopy
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, dsfit, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from experiments.clifford_averager_program import CliffordAveragerProgram
+from experiments.config_cache import CachedConfigMixin
 from experiments.single_qubit.single_shot import hist
 from experiments.two_qubit.twoQ_state_tomography import ErrorMitigationStateTomo2QProgram, sort_counts, correct_readout_err, fix_neg_counts
 import experiments.fitting as fitter
@@ -23,7 +23,8 @@ class CrosstalkEchoProgram(CliffordAveragerProgram):
         self.swap_chs = self.cfg.hw.soc.dacs.swap_Q.ch
         self.swap_ch_types = self.cfg.hw.soc.dacs.swap_Q.type
 
-        self.f_EgGf_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_EgGf_Q, self.swap_chs)]
+        self.f_EgGf_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_EgGf_Q, gen_chs=self.swap_chs)
+        for q, ch in enumerate(self.swap_chs): self.add_ch_qubits(ch, [q, 1]) # the Eg-Gf swaps act on both qDrive and Q1
         self.pi_EgGf_Q_types = self.cfg.device.qubit.pulses.pi_EgGf_Q.type
 
         # declare swap dacs
@@ -181,51 +182,8 @@ class CrosstalkEchoProgram(CliffordAveragerProgram):
             wait=True,
             syncdelay=self.us2cycles(max([cfg.device.readout.relax_delay[q] for q in self.qubits])))
 
-    """
-    If post_process == 'threshold': uses angle + threshold to categorize shots into 0 or 1 and calculate the population
-    If post_process == 'scale': uses angle + ge_avgs to scale the average of all shots on a scale of 0 to 1. ge_avgs should be of shape (num_total_qubits, 4) and should represent the pre-rotation Ig, Qg, Ie, Qe
-    If post_process == None: uses angle to rotate the i and q and then returns the avg i and q
-    """
-    def acquire_rotated(self, soc, progress, angle=None, threshold=None, ge_avgs=None, post_process=None, verbose=False):
-        avgi, avgq = self.acquire(soc, load_pulses=True, progress=progress)
-        if post_process == None: 
-            avgi_rot, avgq_rot, avgi_err, avgq_err = self.get_shots(angle=angle, avg_shots=True, verbose=verbose, return_err=True)
-            if angle is None: return avgi_rot, avgq_rot
-            else: return avgi_rot, avgi_err
-        elif post_process == 'threshold':
-            assert threshold is not None
-            popln, avgq_rot, popln_err, avgq_err = self.get_shots(angle=angle, threshold=threshold, avg_shots=True, verbose=verbose, return_err=True)
-            return popln, popln_err
-        elif post_process == 'scale':
-            assert ge_avgs is not None
-            avgi_rot, avgq_rot, avgi_err, avgq_err = self.get_shots(angle=angle, avg_shots=True, verbose=verbose, return_err=True)
-
-            ge_avgs_rot = [None]*4
-            for q, angle_q in enumerate(angle):
-                if not isinstance(ge_avgs[q], (list, np.ndarray)): continue # this qubit was not calibrated
-                Ig_q, Qg_q, Ie_q, Qe_q = ge_avgs[q]
-                ge_avgs_rot[q] = [
-                    Ig_q*np.cos(np.pi/180*angle_q) - Qg_q*np.sin(np.pi/180*angle_q),
-                    Ie_q*np.cos(np.pi/180*angle_q) - Qe_q*np.sin(np.pi/180*angle_q)
-                ]
-            shape = None
-            for q in range(4):
-                if ge_avgs_rot[q] is not None:
-                    shape = np.shape(ge_avgs_rot[q])
-                    break
-            for q in range(4):
-                if ge_avgs_rot[q] is None: ge_avgs_rot[q] = np.zeros(shape=shape)
-                
-            ge_avgs_rot = np.asarray(ge_avgs_rot)
-            avgi_rot -= ge_avgs_rot[:,0]
-            avgi_rot /= ge_avgs_rot[:,1] - ge_avgs_rot[:,0]
-            avgi_err /= ge_avgs_rot[:,1] - ge_avgs_rot[:,0]
-            return avgi_rot, avgi_err
-        else:
-            assert False, 'Undefined post processing flag, options are None, threshold, scale'
-
 
-class CrosstalkEchoExperiment(Experiment):
+class CrosstalkEchoExperiment(CachedConfigMixin, Experiment):
     """
     Modified echo experiment on Q1 with 2nd wait time replaced by the 2q swap(s) on Q2, Q3
     Experimental Config:
@@ -409,6 +367,7 @@ class CrosstalkEchoExperiment(Experiment):
                 data['f_adjust_ramsey_amps2'] = sorted((self.cfg.expt.ramsey_freq - p_amps[5], -self.cfg.expt.ramsey_freq - p_amps[5]), key=abs)
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, fit_num_sin=1):
         if data is None:
             data=self.data
@@ -663,6 +622,7 @@ class CrosstalkEchoChevronExperiment(Experiment):
         if fit: pass
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, fit_num_sin=1):
         if data is None:
             data=self.data
@@ -852,6 +812,7 @@ class CrosstalkEchoTimeChevronExperiment(Experiment):
         
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, fit_num_sin=1):
         if data is None:
             data=self.data
@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 from copy import deepcopy
 import time
 
@@ -11,6 +10,7 @@ from slab import Experiment, dsfit, AttrDict
 import experiments.fitting as fitter
 from experiments.single_qubit.single_shot import hist
 from experiments.clifford_averager_program import CliffordAveragerProgram
+from experiments.config_cache import CachedConfigMixin
 from experiments.two_qubit.twoQ_state_tomography import AbstractStateTomo2QProgram, ErrorMitigationStateTomo2QProgram, sort_counts, correct_readout_err, fix_neg_counts
 
 """
@@ -317,7 +317,7 @@ class LengthRabiEgGfProgram(CliffordAveragerProgram):
 
 # ===================================================================== #
         
-class LengthRabiEgGfExperiment(Experiment):
+class LengthRabiEgGfExperiment(CachedConfigMixin, Experiment):
     """
     Length Rabi EgGf Experiment
     Experimental Config
@@ -590,6 +590,7 @@ class LengthRabiEgGfExperiment(Experiment):
 
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True):
         if data is None:
             data=self.data 
@@ -817,13 +818,12 @@ class EgGfFreqLenChevronExperiment(Experiment):
                 fit_err = [None]*len(y_sweep)
                 data_fit = [None]*len(y_sweep)
 
-                for i_freq, freq in enumerate(y_sweep):
-                    try:
-                        p, pCov = fitter.fitsin(x_sweep, this_data[i_freq, :], fitparams=fitparams)
-                        fit[i_freq] = p
-                        fit_err[i_freq] = pCov
-                        data_fit[i_freq] = fitter.sinfunc(x_sweep, *p)
-                    except Exception as e: print('Exception:', e)
+                # fit all the frequency rows at once
+                try:
+                    p, pCov = fitter.fitsin_batch(x_sweep, this_data, fitparams=fitparams)
+                    fit, fit_err = list(p), list(pCov)
+                    data_fit = list(fitter.sinfunc_batch(x_sweep, p)[0])
+                except Exception as e: print('Exception:', e)
 
                 data[f'fit{data_name}'][q_index] = fit
                 data[f'fit{data_name}_err'][q_index] = fit_err
@@ -836,6 +836,7 @@ class EgGfFreqLenChevronExperiment(Experiment):
         #         data[k] = np.reshape(data[k], (2, len(y_sweep), len(x_sweep)))
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, plot_rabi=True, signs=[[1,1],[1,1]], verbose=True, saveplot=False):
         if data is None:
             data=self.data 
@@ -1261,6 +1262,7 @@ class NPulseEgGfExperiment(Experiment):
                 # p_amps, pCov_amps = fitter.fitdecaysin(data['xpts'], data["amps"][0], fitparams=None)
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, scale=None):
         if data is None:
             data=self.data 
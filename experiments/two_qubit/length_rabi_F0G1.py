@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 from copy import deepcopy
 import time
 
@@ -11,6 +10,7 @@ from slab import Experiment, dsfit, AttrDict
 import experiments.fitting as fitter
 from experiments.single_qubit.single_shot import hist
 from experiments.clifford_averager_program import CliffordAveragerProgram
+from experiments.config_cache import CachedConfigMixin
 from experiments.two_qubit.twoQ_state_tomography import AbstractStateTomo2QProgram, ErrorMitigationStateTomo2QProgram, sort_counts, correct_readout_err, fix_neg_counts
 
 """
@@ -144,7 +144,7 @@ class LengthRabiF0G1Program(CliffordAveragerProgram):
 
 # ===================================================================== #
         
-class LengthRabiF0G1Experiment(Experiment):
+class LengthRabiF0G1Experiment(CachedConfigMixin, Experiment):
     """
     Length Rabi f0g1 Experiment
     Experimental Config
@@ -405,6 +405,7 @@ class LengthRabiF0G1Experiment(Experiment):
 
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True):
         if data is None:
             data=self.data 
@@ -619,13 +620,12 @@ class F0G1FreqLenChevronExperiment(Experiment):
                 fit_err = [None]*len(y_sweep)
                 data_fit = [None]*len(y_sweep)
 
-                for i_freq, freq in enumerate(y_sweep):
-                    try:
-                        p, pCov = fitter.fitsin(x_sweep, this_data[i_freq, :], fitparams=fitparams)
-                        fit[i_freq] = p
-                        fit_err[i_freq] = pCov
-                        data_fit[i_freq] = fitter.sinfunc(x_sweep, *p)
-                    except Exception as e: print('Exception:', e)
+                # fit all the frequency rows at once
+                try:
+                    p, pCov = fitter.fitsin_batch(x_sweep, this_data, fitparams=fitparams)
+                    fit, fit_err = list(p), list(pCov)
+                    data_fit = list(fitter.sinfunc_batch(x_sweep, p)[0])
+                except Exception as e: print('Exception:', e)
 
                 data[f'fit{data_name}'][q_index] = fit
                 data[f'fit{data_name}_err'][q_index] = fit_err
@@ -638,6 +638,7 @@ class F0G1FreqLenChevronExperiment(Experiment):
         #         data[k] = np.reshape(data[k], (2, len(y_sweep), len(x_sweep)))
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, plot_rabi=True, signs=[[1,1],[1,1]], verbose=True, saveplot=False):
         if data is None:
             data=self.data 
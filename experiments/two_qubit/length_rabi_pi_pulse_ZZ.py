@@ -1,6 +1,5 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from qick import *
 from qick.helpers import gauss
@@ -214,6 +213,7 @@ class LengthRabiPiZZExperiment(Experiment):
             data['fitB_err_amps'] = pCovB_amps
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
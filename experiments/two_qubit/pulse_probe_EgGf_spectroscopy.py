@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 import experiments.fitting as fitter
 
@@ -219,6 +218,7 @@ class PulseProbeEgGfSpectroscopyExperiment(Experiment):
             data['fitB_avgq'], data['fitB_err_avgq'] = fitter.fitlor(data["xpts"], signs[1][1]*data['avgq'][1])
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, signs=None, **kwargs):
         # signs of fit: [iA, qA], [iB, qB]
         if data is None: data=self.data 
@@ -343,6 +343,7 @@ class PulseProbeEgGfSweepSpectroscopyExperiment(Experiment):
             data=self.data
         return data
 
+    @skip_if_headless
     def display(self, data=None, fit=True, signs=None, **kwargs):
         if data is None:
             data=self.data 
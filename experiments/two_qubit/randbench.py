@@ -1,6 +1,5 @@
 # Author: Connie 2022/02/17
 
-import matplotlib.pyplot as plt
 import numpy as np
 from scipy.optimize import curve_fit
 from copy import deepcopy
@@ -9,106 +8,21 @@ from qick import *
 from qick.helpers import gauss
 
 from slab import Experiment, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from experiments.single_qubit.single_shot import hist
 from experiments.clifford_averager_program import CliffordAveragerProgram, CliffordEgGfAveragerProgram
+from experiments.clifford_tables import clifford_1q_names, clifford_1q_index, clifford_1q_matrix, total_clifford
 from experiments.two_qubit.length_rabi_EgGf import LengthRabiEgGfProgram
 from experiments.two_qubit.twoQ_state_tomography import AbstractStateTomo2QProgram, ErrorMitigationStateTomo2QProgram, sort_counts, correct_readout_err, fix_neg_counts
 
 import experiments.fitting as fitter
+from experiments.bootstrap import bootstrap_fit, percentile_interval
 
 """
-Define matrices representing (all) Clifford gates for single
-qubit in the basis of Z, X, Y, -Z, -X, -Y, indicating
-where on the 6 cardinal points of the Bloch sphere the
-+Z, +X, +Y axes go after each gate. Each Clifford gate
-can be uniquely identified just by checking where +X and +Y
-go.
+Single qubit Clifford gates are precompiled into integer tables in experiments.clifford_tables:
+clifford_1q_names lists the 24 Cliffords, and composing a sequence is a lookup in clifford_1q_mult.
 """
-clifford_1q = dict()
-clifford_1q['Z'] = np.matrix([[1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0]])
-clifford_1q['X'] = np.matrix([[0, 0, 0, 1, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 1, 0, 0, 0]])
-clifford_1q['Y'] = np.matrix([[0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1]])
-clifford_1q['Z/2'] = np.matrix([[1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0]])
-clifford_1q['X/2'] = np.matrix([[0, 0, 1, 0, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 0, 0, 0, 1, 0],
-                             [1, 0, 0, 0, 0, 0]])
-clifford_1q['Y/2'] = np.matrix([[0, 0, 0, 0, 1, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 0, 1]])
-clifford_1q['-Z/2'] = np.matrix([[1, 0, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 0, 0, 0, 1],
-                             [0, 1, 0, 0, 0, 0]])
-clifford_1q['-X/2'] = np.matrix([[0, 0, 0, 0, 0, 1],
-                             [0, 1, 0, 0, 0, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [0, 0, 0, 1, 0, 0]])
-clifford_1q['-Y/2'] = np.matrix([[0, 1, 0, 0, 0, 0],
-                             [0, 0, 0, 1, 0, 0],
-                             [0, 0, 1, 0, 0, 0],
-                             [0, 0, 0, 0, 1, 0],
-                             [1, 0, 0, 0, 0, 0],
-                             [0, 0, 0, 0, 0, 1]])
-clifford_1q['I'] = np.diag([1]*6)
-
-# Read pulse as a matrix product acting on state (meaning apply pulses in reverse order of the tuple)
-two_step_pulses= [
-    ('X','Z/2'), ('X/2','Z/2'), ('-X/2','Z/2'),
-    ('Y','Z/2'), ('Y/2','Z/2'), ('-Y/2','Z/2'),
-    ('X','Z'), ('X/2','Z'), ('-X/2','Z'),
-    ('Y','Z'), ('Y/2','Z'), ('-Y/2','Z'),
-    ('X','-Z/2'), ('X/2','-Z/2'), ('-X/2','-Z/2'),
-    ('Y','-Z/2'), ('Y/2','-Z/2'), ('-Y/2','-Z/2'),
-]
-# Get rid of repeats
-for pulse in two_step_pulses:
-    new_mat = clifford_1q[pulse[0]] @ clifford_1q[pulse[1]]
-    repeat = False
-    for existing_pulse_name, existing_pulse in clifford_1q.items():
-        if np.array_equal(new_mat, existing_pulse):
-            # print(pulse, existing_pulse_name)
-            repeat = True
-    if not repeat: clifford_1q[pulse[0]+','+pulse[1]] = new_mat
-clifford_1q_names = list(clifford_1q.keys())
-
-for name, matrix in clifford_1q.items():
-    z_new = np.argmax(matrix[:,0]) # +Z goes to row where col 0 is 1
-    x_new = np.argmax(matrix[:,1]) # +X goes to row where col 1 is 1
-    # print(name, z_new, x_new)
-    clifford_1q[name] = (matrix, (z_new, x_new))
-
 def gate_sequence(rb_depth, pulse_n_seq=None, debug=False):
     """
     Generate RB forward gate sequence of length rb_depth as a list of pulse names;
@@ -117,26 +31,13 @@ def gate_sequence(rb_depth, pulse_n_seq=None, debug=False):
     Optionally, provide pulse_n_seq which is a list of the indices of the Clifford
     gates to apply in the sequence.
     """
-    if pulse_n_seq == None: 
+    if pulse_n_seq is None: 
         pulse_n_seq = (len(clifford_1q_names)*np.random.rand(rb_depth)).astype(int)
     if debug: print('pulse seq', pulse_n_seq)
     pulse_name_seq = [clifford_1q_names[n] for n in pulse_n_seq]
-    psi_nz = np.matrix([[1, 0, 0, 0, 0, 0]]).transpose()
-    psi_nx = np.matrix([[0, 1, 0, 0, 0, 0]]).transpose()
-    for n in pulse_n_seq: # n is index in clifford_1q_names
-        gates = clifford_1q_names[n].split(',')
-        for gate in reversed(gates): # Apply matrices from right to left of gates
-            psi_nz = clifford_1q[gate][0] @ psi_nz
-            psi_nx = clifford_1q[gate][0] @ psi_nx
-    psi_nz = psi_nz.flatten()
-    psi_nx = psi_nx.flatten()
-    if debug: print('+Z axis after seq:', psi_nz, '+X axis after seq:', psi_nx)
-    for clifford in clifford_1q_names: # Get the clifford equivalent to the total seq
-        if clifford_1q[clifford][1] == (np.argmax(psi_nz), np.argmax(psi_nx)):
-            total_clifford = clifford
-            break
-    if debug: print('Total gate matrix:\n', clifford_1q[total_clifford][0])
-    return pulse_name_seq, total_clifford
+    total_clifford_name = clifford_1q_names[total_clifford(pulse_n_seq)] # Get the clifford equivalent to the total seq
+    if debug: print('Total gate matrix:\n', clifford_1q_matrix(total_clifford_name))
+    return pulse_name_seq, total_clifford_name
 
 def interleaved_gate_sequence(rb_depth, gate_char:str, debug=False):
     """
@@ -146,14 +47,101 @@ def interleaved_gate_sequence(rb_depth, gate_char:str, debug=False):
     """
     pulse_n_seq_rand = (len(clifford_1q_names)*np.random.rand(rb_depth)).astype(int)
     pulse_n_seq = []
-    assert gate_char in clifford_1q_names
-    n_gate_char = clifford_1q_names.index(gate_char)
+    assert gate_char in clifford_1q_index
+    n_gate_char = clifford_1q_index[gate_char]
     if debug: print('n gate char:', n_gate_char, clifford_1q_names[n_gate_char])
     for n_rand in pulse_n_seq_rand:
         pulse_n_seq.append(n_rand)
         pulse_n_seq.append(n_gate_char)
     return gate_sequence(len(pulse_n_seq), pulse_n_seq=pulse_n_seq, debug=debug)    
 
+"""
+Compress a gate sequence (a list of hashable gates, e.g. (qubit, pulse name)) into a list of (block, reps) such that
+concatenating each block repeated reps times gives back the sequence. At each position, takes the block of up to
+max_period gates whose back to back repeats cover the most gates (ties go to the shorter block), e.g.
+['X/2']*depth -> [(['X/2'], depth)]; gates that don't repeat are collected into (block, 1).
+"""
+def compress_gate_sequence(gates, max_period=8):
+    gates = list(gates)
+    compressed = []
+    unrepeated = []
+    i = 0
+    while i < len(gates):
+        best_period, best_reps = 1, 1
+        for period in range(1, min(max_period, (len(gates) - i)//2) + 1):
+            block = gates[i:i+period]
+            reps = 1
+            while gates[i+reps*period:i+(reps+1)*period] == block: reps += 1
+            if reps > 1 and period*reps > best_period*best_reps: best_period, best_reps = period, reps
+        if best_reps == 1:
+            unrepeated.append(gates[i])
+            i += 1
+            continue
+        if len(unrepeated) > 0: compressed.append((unrepeated, 1))
+        unrepeated = []
+        compressed.append((gates[i:i+best_period], best_reps))
+        i += best_period*best_reps
+    if len(unrepeated) > 0: compressed.append((unrepeated, 1))
+    return compressed
+
+"""
+Net virtual Z phase [deg] that a clifford pulse name adds to the overall phase of its qubit (same convention as
+Z_pulse/ZEgGf_pulse: Z adds 180, Z/2 adds +/-90)
+"""
+def virtual_phase(pulse_name:str):
+    phase = 0
+    for gate in pulse_name.upper().split(','):
+        if 'Z' not in gate: continue
+        phase += (90 if '/2' in gate else 180) * (-1 if '-' in gate else 1)
+    return phase
+
+"""
+Play gates (a list of (qubit, pulse name)) on prog with play_gate(qubit, pulse_name), each followed by a sync_all
+(unless prog.parallel_pulses, which schedules gates on independent qubits to overlap), but with the repeated blocks
+found by compress_gate_sequence played as tProc loops instead of unrolled, so program memory and compile time no
+longer grow with the number of repeats.
+The pulses in a loop are compiled with the phases of its first repeat, so a block is only looped over a multiple of
+repeats whose net virtual Z phase on every qubit is 0 mod 360 (e.g. 4 repeats of a block with a net Z/2), and the
+leftover repeats are unrolled. Blocks of only virtual gates are unrolled since they play nothing.
+loop_reg: (page, register) for the loop counter; AveragerProgram uses page 0 registers 14 and 15 for the reps loop
+"""
+def play_gate_sequence(prog, gates, play_gate, loop_compress=True, max_period=8, loop_reg=(0, 13)):
+    def play_block(block):
+        for qubit, pulse_name in block:
+            play_gate(qubit, pulse_name)
+            if not prog.parallel_pulses: prog.sync_all()
+
+    if not loop_compress:
+        play_block(gates)
+        return
+
+    rp, r_loop = loop_reg
+    for i_block, (block, reps) in enumerate(compress_gate_sequence(gates, max_period=max_period)):
+        # fewest repeats of the block that bring every qubit back to the same phase mod 360
+        net_phase = dict()
+        for qubit, pulse_name in block: net_phase[qubit] = net_phase.get(qubit, 0) + virtual_phase(pulse_name)
+        closing_reps = 1
+        while any((closing_reps*phase) % 360 != 0 for phase in net_phase.values()): closing_reps += 1
+        loop_reps = reps // closing_reps
+        plays_pulse = any(gate != 'I' and 'Z' not in gate for _, pulse_name in block for gate in pulse_name.upper().split(','))
+        if loop_reps < 2 or not plays_pulse:
+            play_block(block*reps)
+            continue
+
+        overall_phase = list(prog.overall_phase)
+        prog.sync_all() # every repeat has to start from the same timeline
+        prog.regwi(rp, r_loop, loop_reps-1)
+        prog.label(f'RB_LOOP_{i_block}')
+        play_block(block*closing_reps)
+        prog.sync_all()
+        prog.loopnz(rp, r_loop, f'RB_LOOP_{i_block}')
+        # keep tracking the phase as if the loop were unrolled
+        for q, phase in enumerate(overall_phase):
+            delta = prog.overall_phase[q] - phase
+            assert delta % 360 == 0, f'Looped gate block {block} does not close its phase on qubit {q}'
+            prog.overall_phase[q] += (loop_reps-1)*delta
+        play_block(block*(reps % closing_reps))
+
 if __name__ == '__main__':
     print('Clifford gates:', clifford_1q_names)
     print('Total number Clifford gates:', len(clifford_1q_names))
@@ -180,7 +168,7 @@ class SimultaneousRBProgram(CliffordAveragerProgram):
         If inverted, play the inverse of this gate (the extra phase is added on top of the inversion)
         """
         pulse_name = pulse_name.upper()
-        assert pulse_name in clifford_1q_names
+        assert pulse_name in clifford_1q_index
         gates = pulse_name.split(',')
 
         # Normally gates are applied right to left, but if inverted apply them left to right
@@ -218,9 +206,10 @@ class SimultaneousRBProgram(CliffordAveragerProgram):
 
         # Do all the gates given in the initialize except for the total gate, measure
         cfg=AttrDict(self.cfg)
-        for i in range(len(self.gate_list) - 1):
-            self.clifford(qubit=self.qubit_list[i], pulse_name=self.gate_list[i], play=True)
-            self.sync_all()
+        play_gate_sequence(
+            self, list(zip(self.qubit_list[:-1], self.gate_list[:-1])),
+            play_gate=lambda qubit, pulse_name: self.clifford(qubit=qubit, pulse_name=pulse_name, play=True),
+            loop_compress=self.cfg.expt.get('loop_compress', True))
 
         # Do the inverse by applying the total gate with pi phase
         # This is actually wrong!!! need to apply an inverse total gate for each qubit!!
@@ -256,6 +245,8 @@ class SimultaneousRBExperiment(Experiment):
         thresholds: (optional) don't rerun singleshot and instead use this
         ge_avgs: (optional) don't rerun singleshot and instead use this
         angles: (optional) don't rerun singleshot and instead use this
+        loop_compress: (optional) play repeated blocks of gates as tProc loops instead of unrolling them (default True)
+        parallel_pulses: (optional) only sync channels where gates share a qubit, so simultaneous RB gates on different qubits overlap (default False)
     )
     """
 
@@ -455,11 +446,27 @@ class SimultaneousRBExperiment(Experiment):
         self.data=data
         return data
 
-    def analyze(self, data=None, fit=True, **kwargs):
+    def analyze(self, data=None, fit=True, bootstrap=0, ref_data=None, **kwargs):
+        """
+        All qubits are fit together with fitter.fitrb_joint.
+        bootstrap: number of resamples of the variations at each depth for 95% confidence intervals on the fit
+            params (fit_ci) and rb error (error_ci); 0 to skip
+        ref_data: for interleaved RB, the analyzed data of the reference RB run on the same qubits. The reference and
+            interleaved runs are fit jointly, sharing the SPAM params of each qubit, and the gate fidelity is stored
+            in gate_fidelity, gate_fidelity_err (fit_ref: the reference fit)
+        """
         if data is None:
             data=self.data
 
         qubits = self.cfg.expt.qubits
+        data['error_err'] = [None] * len(qubits)
+        if ref_data is not None:
+            data['fit_ref'] = [None] * len(qubits)
+            data['gate_fidelity'] = [None] * len(qubits)
+            data['gate_fidelity_err'] = [None] * len(qubits)
+        if bootstrap > 0:
+            data['fit_ci'] = [None] * len(qubits)
+            data['error_ci'] = [None] * len(qubits)
         data['probs'] = [None] * len(qubits)
         data['fit'] = [None] * len(qubits)
         data['fit_err'] = [None] * len(qubits)
@@ -509,13 +516,37 @@ class SimultaneousRBExperiment(Experiment):
             data['med_probs'][iq] = med_probs
             data['avg_probs'][iq] = avg_probs
             data['working_depths'] = working_depths
-            if fit:
-                popt, pcov = fitter.fitrb(flat_depths, flat_probs)
-                data['fit'][iq] = popt
-                data['fit_err'][iq] = pcov
-                data['error'][iq] = fitter.rb_error(popt[0], d=2**(len(self.cfg.expt.qubits)))
+
+        if fit:
+            d = 2**(len(self.cfg.expt.qubits))
+            n = len(qubits)
+            xdata = [np.concatenate(data['xpts'])]*n
+            ydata = [np.concatenate(data['probs'][iq]) for iq in range(n)]
+            p_groups = list(range(n))
+            spam_groups = list(range(n))
+            if ref_data is not None:
+                xdata += [np.concatenate(ref_data['xpts'])]*n
+                ydata += [np.concatenate(ref_data['probs'][iq]) for iq in range(n)]
+                p_groups += list(range(n, 2*n))
+                spam_groups += list(range(n))
+            pOpt, pCov = fitter.fitrb_joint(xdata, ydata, p_groups=p_groups, spam_groups=spam_groups)
+            error, error_cov = fitter.rb_error_joint(pOpt, pCov, d)
+            for iq, q in enumerate(qubits):
+                data['fit'][iq] = pOpt[iq]
+                data['fit_err'][iq] = pCov[iq, :, iq, :]
+                data['error'][iq] = error[iq]
+                data['error_err'][iq] = np.sqrt(error_cov[iq, iq])
+                if ref_data is not None:
+                    data['fit_ref'][iq] = pOpt[n+iq]
+                    fidelity, fidelity_var = fitter.rb_gate_fidelity_joint(pOpt, pCov, n+iq, iq, d)
+                    data['gate_fidelity'][iq] = fidelity
+                    data['gate_fidelity_err'][iq] = np.sqrt(fidelity_var)
+                if bootstrap > 0:
+                    _, data['fit_ci'][iq], p_boot = bootstrap_fit('rb', data['xpts'][:,0], data['probs'][iq], n_resamples=bootstrap, pOpt=pOpt[iq])
+                    data['error_ci'][iq] = percentile_interval(fitter.rb_error(p_boot[:,0], d=d))
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None:
             data=self.data 
@@ -552,6 +583,8 @@ class SimultaneousRBExperiment(Experiment):
             print(f'Depolarizing parameter p from fit: {data["fit"][iq][0]} +/- {np.sqrt(cov_p)}')
             print(f'Average RB gate error: {data["error"][iq]} +/- {np.sqrt(fitter.error_fit_err(cov_p, 2**(len(self.cfg.expt.qubits))))}')
             print(f'\tFidelity=1-error: {1-data["error"][iq]} +/- {np.sqrt(fitter.error_fit_err(cov_p, 2**(len(self.cfg.expt.qubits))))}')
+            if 'gate_fidelity' in data:
+                print(f'{self.cfg.expt.gate_char} gate fidelity from joint fit with reference RB: {data["gate_fidelity"][iq]} +/- {data["gate_fidelity_err"][iq]}')
 
         plt.grid(linewidth=0.3)
         # if self.cfg.expt.post_process is not None: plt.ylim(-0.1, 1.1)
@@ -594,7 +627,7 @@ class RBEgGfProgram(CliffordEgGfAveragerProgram):
         If inverted, play the inverse of this gate (the extra phase is added on top of the inversion)
         """
         pulse_name = pulse_name.upper()
-        assert pulse_name in clifford_1q_names
+        assert pulse_name in clifford_1q_index
         gates = pulse_name.split(',')
 
         # Normally gates are applied right to left, but if inverted apply them left to right
@@ -632,9 +665,10 @@ class RBEgGfProgram(CliffordEgGfAveragerProgram):
         # self.sync_all(10)
 
         # Do all the gates given in the initialize except for the total gate
-        for i in range(len(self.gate_list) - 1):
-            self.cliffordEgGf(qDrive=self.qDrive, qNotDrive=self.qNotDrive, pulse_name=self.gate_list[i], play=True)
-            self.sync_all()
+        play_gate_sequence(
+            self, [(self.qDrive, pulse_name) for pulse_name in self.gate_list[:-1]],
+            play_gate=lambda qDrive, pulse_name: self.cliffordEgGf(qDrive=qDrive, qNotDrive=self.qNotDrive, pulse_name=pulse_name, play=True),
+            loop_compress=self.cfg.expt.get('loop_compress', True))
 
         # self.Xef_pulse(q=1, play=True)
         # qB = 1
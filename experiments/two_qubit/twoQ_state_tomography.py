@@ -1,11 +1,10 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 import json
 from copy import deepcopy
 
 from slab import Experiment, NpEncoder, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from experiments.clifford_averager_program import QutritAveragerProgram, CliffordAveragerProgram
 from experiments.single_qubit.single_shot import hist
@@ -473,7 +472,7 @@ class EgGfStateTomographyExperiment(Experiment):
 
             counts = tomo.collect_counts(angle=angle, threshold=threshold)
             data['counts_tomo'].append(counts)
-            self.pulse_dict.update({basis:tomo.pulse_dict})
+            self.pulse_dict.update({basis:tomo.pulse_params()})
 
         self.data=data
         return data
@@ -483,6 +482,7 @@ class EgGfStateTomographyExperiment(Experiment):
         print('Analyze function does nothing, use the analysis notebook.')
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None: data=self.data 
         print('Display function does nothing, use the analysis notebook.')
@@ -738,11 +738,15 @@ class StateTomo1QProgram(AbstractStateTomo1QProgram):
         if 'state_prep_kwargs' not in self.cfg.expt: self.cfg.expt.state_prep_kwargs = None
         self.swap_chs = self.cfg.hw.soc.dacs.swap.ch
         self.swap_ch_types = self.cfg.hw.soc.dacs.swap.type
-        self.f_EgGf_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_EgGf, self.swap_chs)]
+        self.f_EgGf_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_EgGf, gen_chs=self.swap_chs)
 
         self.swap_Q_chs = self.cfg.hw.soc.dacs.swap_Q.ch
         self.swap_Q_ch_types = self.cfg.hw.soc.dacs.swap_Q.type
-        self.f_EgGf_Q_regs = [self.freq2reg(f, gen_ch=ch) for f, ch in zip(self.cfg.device.qubit.f_EgGf_Q, self.swap_chs)]
+        self.f_EgGf_Q_regs = self.convert_regs('freq2reg', self.cfg.device.qubit.f_EgGf_Q, gen_chs=self.swap_chs)
+        # the Eg-Gf swaps act on both q and Q1
+        for q, (ch, ch_Q) in enumerate(zip(self.swap_chs, self.swap_Q_chs)):
+            self.add_ch_qubits(ch, [q, 1])
+            self.add_ch_qubits(ch_Q, [q, 1])
 
         # get aliases for the sigmas we need in clock cycles
         self.pi_EgGf_types = self.cfg.device.qubit.pulses.pi_EgGf.type
@@ -852,7 +856,7 @@ class StateTomography1QExperiment(Experiment):
             tomo.acquire(self.im[self.cfg.aliases.soc], load_pulses=True, progress=False)
             counts = tomo.collect_counts(angle=angle, threshold=threshold)
             data['counts_tomo'].append(counts)
-            self.pulse_dict.update({basis:tomo.pulse_dict})
+            self.pulse_dict.update({basis:tomo.pulse_params()})
 
         self.data=data
         return data
@@ -862,6 +866,7 @@ class StateTomography1QExperiment(Experiment):
         print('Analyze function does nothing, use the analysis notebook.')
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None: data=self.data 
         print('Display function does nothing, use the analysis notebook.')
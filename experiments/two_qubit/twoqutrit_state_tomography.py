@@ -1,10 +1,9 @@
-import matplotlib.pyplot as plt
 import numpy as np
 from qick import *
 import json
 
 from slab import Experiment, NpEncoder, AttrDict
-from tqdm import tqdm_notebook as tqdm
+from experiments.headless import plt, tqdm, skip_if_headless
 
 from experiments.clifford_averager_program import QutritAveragerProgram
 from experiments.two_qubit.twoQ_state_tomography import AbstractStateTomo2QProgram
@@ -265,7 +264,7 @@ class EgGfStateTomographyQutritExperiment(Experiment):
                 tomo = EgGfStateTomo2qutritProgram(soccfg=self.soccfg, cfg=cfg)
                 counts = tomo.acquire(self.im[self.cfg.aliases.soc], shot_avg=self.cfg.expt.shot_avg, angle=angle, threshold_ge=threshold_ge, threshold_ef=threshold_ef, load_pulses=True, progress=False)
                 data['counts_tomo'].append(counts)
-                self.pulse_dict.update({prep0+'-'+prep1:tomo.pulse_dict})
+                self.pulse_dict.update({prep0+'-'+prep1:tomo.pulse_params()})
 
         # Error mitigation measurements: prep in gg, ge, gf, eg, ee, ef, fg, fe, ff and measure confusion matrix
         for prep_state in tqdm(self.calib_order):
@@ -284,6 +283,7 @@ class EgGfStateTomographyQutritExperiment(Experiment):
         print('Analyze function does nothing, use the analysis notebook.')
         return data
 
+    @skip_if_headless
     def display(self, qubit, data=None, fit=True, **kwargs):
         if data is None: data=self.data 
         print('Display function does nothing, use the analysis notebook.')
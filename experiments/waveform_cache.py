@@ -0,0 +1,50 @@
+from collections import OrderedDict
+
+import numpy as np
+
+"""
+Process-wide cache of pulse envelope samples.
+
+Sweeps build a new program for every point, and every program regenerates the same gaussian, adiabatic, and IQ
+envelopes in initialize(). Envelopes are cached here keyed by the shape, the generator config that determines the
+samples (maxv, maxv_scale, samps_per_clk), and the shape parameters in generator units (sigma and length in clock
+cycles, mu, beta, the IQ arrays...), so identical envelopes are computed once and the same sample arrays are handed
+to add_pulse in every program. The arrays are read only, since they are shared.
+
+    idata, qdata = waveform_cache.get_waveform('gauss', gencfg, (sigma, length, maxv), make)
+
+make() is only called on a miss and returns (idata, qdata) (qdata can be None).
+"""
+
+_waveform_cache = OrderedDict() # key -> (idata, qdata), in LRU order
+_waveform_cache_maxsize = 1024
+
+def _freeze(param):
+    # hashable version of a shape param, arrays are keyed by their contents
+    if isinstance(param, (list, tuple, np.ndarray)):
+        arr = np.ascontiguousarray(param, dtype=float)
+        return (arr.shape, arr.tobytes())
+    if isinstance(param, (np.number, int, float)): return float(param)
+    return param
+
+def gen_key(gencfg):
+    return (gencfg['maxv'], gencfg['maxv_scale'], gencfg['samps_per_clk'])
+
+def get_waveform(shape, gencfg, params, make):
+    key = (shape, gen_key(gencfg), tuple(_freeze(p) for p in params))
+    cached = _waveform_cache.get(key)
+    if cached is None:
+        cached = tuple(None if d is None else np.array(d, dtype=float) for d in make())
+        for d in cached:
+            if d is not None: d.setflags(write=False)
+    _waveform_cache[key] = cached
+    _waveform_cache.move_to_end(key)
+    while len(_waveform_cache) > _waveform_cache_maxsize: _waveform_cache.popitem(last=False)
+    return cached
+
+def set_waveform_cache_size(maxsize):
+    global _waveform_cache_maxsize
+    _waveform_cache_maxsize = maxsize
+
+def clear_waveform_cache():
+    _waveform_cache.clear()